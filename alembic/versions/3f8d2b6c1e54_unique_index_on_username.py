@@ -0,0 +1,64 @@
+"""Unique index on username
+
+Revision ID: 3f8d2b6c1e54
+Revises: e7a2c5b19f48
+Create Date: 2026-10-19 09:12:36.204517
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+from ms_invoicer.sql_app.models import User
+
+
+# revision identifiers, used by Alembic.
+revision = '3f8d2b6c1e54'
+down_revision = 'e7a2c5b19f48'
+branch_labels = None
+depends_on = None
+
+
+INDEX = "ix_invoicer_user_username"
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    duplicates = bind.execute(
+        sa.select(User.username)
+        .group_by(User.username)
+        .having(sa.func.count() > 1)
+        .limit(10)
+    ).scalars().all()
+    if duplicates:
+        raise RuntimeError(
+            "Merge or rename the users sharing a username before upgrading: {}".format(
+                ", ".join(duplicates)
+            )
+        )
+    # CONCURRENTLY so logins are not blocked while it builds. A failed build
+    # leaves an INVALID index that IF NOT EXISTS would keep, it is rebuilt.
+    with op.get_context().autocommit_block():
+        valid = bind.execute(
+            sa.text("SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:name)"),
+            {"name": INDEX},
+        ).scalar()
+        if valid is False:
+            op.drop_index(INDEX, table_name=User.__tablename__, postgresql_concurrently=True)
+        op.create_index(
+            INDEX,
+            User.__tablename__,
+            ["username"],
+            unique=True,
+            if_not_exists=True,
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            INDEX,
+            table_name=User.__tablename__,
+            if_exists=True,
+            postgresql_concurrently=True,
+        )
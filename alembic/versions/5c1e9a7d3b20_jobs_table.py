@@ -0,0 +1,52 @@
+"""jobs table
+
+Revision ID: 5c1e9a7d3b20
+Revises: 7f7cc788b2a6
+Create Date: 2026-10-18 09:12:31.402518
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from ms_invoicer.sql_app.models import Job, User
+
+
+# revision identifiers, used by Alembic.
+revision = '5c1e9a7d3b20'
+down_revision = '7f7cc788b2a6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        Job.__tablename__,
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("event_type", sa.String(256), nullable=False),
+        sa.Column("payload", sa.JSON, nullable=False),
+        sa.Column("chain_key", sa.String(128), nullable=True),
+        sa.Column("status", sa.String(16), nullable=False),
+        sa.Column("attempts", sa.Integer, nullable=False),
+        sa.Column("max_attempts", sa.Integer, nullable=False),
+        sa.Column("last_error", sa.String, nullable=True),
+        sa.Column("run_after", sa.DateTime, nullable=False),
+        sa.Column("locked_until", sa.DateTime, nullable=True),
+        sa.Column("created", sa.DateTime, nullable=False),
+        sa.Column("updated", sa.DateTime, nullable=False),
+        sa.Column("user_id", sa.Integer, nullable=True),
+    )
+    op.create_foreign_key(
+        "fk_user_id",
+        Job.__tablename__,
+        User.__tablename__,
+        ["user_id"],
+        ["id"],
+    )
+    op.create_index("ix_jobs_user_id", Job.__tablename__, ["user_id"])
+    op.create_index("ix_jobs_chain_key", Job.__tablename__, ["chain_key"])
+    # Claim query: oldest due job first.
+    op.create_index("ix_jobs_status_run_after", Job.__tablename__, ["status", "run_after"])
+
+
+def downgrade() -> None:
+    op.drop_table(Job.__tablename__)
@@ -0,0 +1,28 @@
+"""Add batch_id column in File
+
+Revision ID: 9b3f6e2a4c71
+Revises: 5c1e9a7d3b20
+Create Date: 2026-10-18 15:40:12.208811
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from ms_invoicer.sql_app.models import File
+
+
+# revision identifiers, used by Alembic.
+revision = '9b3f6e2a4c71'
+down_revision = '5c1e9a7d3b20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column(File.__tablename__, sa.Column('batch_id', sa.String(32), nullable=True))
+    op.create_index("ix_files_batch_id", File.__tablename__, ["batch_id"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_files_batch_id", File.__tablename__)
+    op.drop_column(File.__tablename__, 'batch_id')
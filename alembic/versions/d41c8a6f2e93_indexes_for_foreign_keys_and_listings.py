@@ -0,0 +1,53 @@
+"""Indexes for foreign keys and listings
+
+Revision ID: d41c8a6f2e93
+Revises: 9b3f6e2a4c71
+Create Date: 2026-10-18 18:05:47.531902
+
+"""
+from alembic import op
+
+from ms_invoicer.sql_app.models import File, Invoice, Service
+
+
+# revision identifiers, used by Alembic.
+revision = 'd41c8a6f2e93'
+down_revision = '9b3f6e2a4c71'
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ("ix_services_file_id", Service.__tablename__, ["file_id"]),
+    ("ix_services_invoice_id", Service.__tablename__, ["invoice_id"]),
+    ("ix_files_invoice_id_created", File.__tablename__, ["invoice_id", "created"]),
+    # Foreign key checks when a customer is deleted.
+    ("ix_invoices_customer_id", Invoice.__tablename__, ["customer_id"]),
+    (
+        "ix_invoices_user_id_customer_id_number_id",
+        Invoice.__tablename__,
+        ["user_id", "customer_id", "number_id"],
+    ),
+    (
+        "ix_invoices_user_id_customer_id_created",
+        Invoice.__tablename__,
+        ["user_id", "customer_id", "created"],
+    ),
+]
+
+
+def upgrade() -> None:
+    # CONCURRENTLY so the tables stay writable while the indexes build, it
+    # can not run inside a transaction.
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.create_index(
+                name, table, columns, if_not_exists=True, postgresql_concurrently=True
+            )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, _ in INDEXES:
+            op.drop_index(
+                name, table_name=table, if_exists=True, postgresql_concurrently=True
+            )
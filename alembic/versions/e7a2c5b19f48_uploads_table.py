@@ -0,0 +1,46 @@
+"""uploads table
+
+Revision ID: e7a2c5b19f48
+Revises: d41c8a6f2e93
+Create Date: 2026-10-18 21:40:12.318840
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from ms_invoicer.sql_app.models import Upload, User
+
+
+# revision identifiers, used by Alembic.
+revision = 'e7a2c5b19f48'
+down_revision = 'd41c8a6f2e93'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        Upload.__tablename__,
+        sa.Column("id", sa.String(32), primary_key=True),
+        sa.Column("sha256", sa.String(64), nullable=False),
+        sa.Column("size", sa.Integer, nullable=False),
+        sa.Column("filename", sa.String, nullable=True),
+        sa.Column("pages", sa.JSON, nullable=False),
+        sa.Column("s3_xlsx_url", sa.String, nullable=False),
+        sa.Column("created", sa.DateTime, nullable=False),
+        sa.Column("user_id", sa.Integer, nullable=False),
+    )
+    op.create_foreign_key(
+        "fk_user_id",
+        Upload.__tablename__,
+        User.__tablename__,
+        ["user_id"],
+        ["id"],
+    )
+    op.create_index(
+        "ix_uploads_user_id_sha256", Upload.__tablename__, ["user_id", "sha256"], unique=True
+    )
+
+
+def downgrade() -> None:
+    op.drop_table(Upload.__tablename__)
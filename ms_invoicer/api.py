@@ -1,20 +1,33 @@
 import logging
 import time
 from contextlib import asynccontextmanager
-from typing import Any, Awaitable, Callable, AsyncIterator, List, Optional
+from typing import Any, Awaitable, Callable, AsyncIterator, Dict, List, Optional
 
-from fastapi import Depends, FastAPI, Request, Response
+from fastapi import Depends, FastAPI, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.staticfiles import StaticFiles
 from sqlalchemy.orm import Session
 
-from ms_invoicer.config import LOG_LEVEL
-from ms_invoicer.constants import LogEvent
-from ms_invoicer.db_pool import get_db
-from ms_invoicer.sql_app.database import init_db
+from ms_invoicer.cache_manager import cache_metrics
+from ms_invoicer.config import (
+    LOG_LEVEL,
+    STORAGE_BACKEND,
+    STORAGE_BASE_URL,
+    STORAGE_LOCAL_ROOT,
+)
+from ms_invoicer.constants import LogEvent, StorageKind
+from ms_invoicer.db_pool import get_db, transaction
+from ms_invoicer.download_cache import get_download_cache
+from ms_invoicer.sql_app.database import async_engine, init_db
 from ms_invoicer.event_handler import register_event_handlers
-from ms_invoicer.routers import bill_to, customer, files, invoice, user, globals, utils
+from ms_invoicer.executors import pool_metrics, shutdown_pools
+from ms_invoicer.pagination import NEXT_CURSOR_HEADER, decode_cursor, page
+from ms_invoicer.pdf_renderer import get_renderer, shutdown_renderer
+from ms_invoicer.routers import bill_to, customer, files, invoice, jobs, user, globals, utils
+from ms_invoicer.s3_client import close_s3_client
 from ms_invoicer.security_helper import get_current_user
 from ms_invoicer.sql_app import crud, schemas
+from ms_invoicer.template_engine import precompile_templates
 from ms_invoicer.utils import create_folders
 
 @asynccontextmanager
@@ -23,7 +36,12 @@ async def lifespan(_: FastAPI) -> AsyncIterator[None]:
     init_db()
     create_folders()
     register_event_handlers()
+    precompile_templates()
     yield
+    shutdown_renderer()
+    shutdown_pools()
+    close_s3_client()
+    await async_engine.dispose()
 
 
 api = FastAPI(lifespan=lifespan)
@@ -33,6 +51,7 @@ api.add_middleware(
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER],
 )
 api.include_router(customer.router, tags=["Customer"])
 api.include_router(invoice.router, tags=["Invoice"])
@@ -41,6 +60,14 @@ api.include_router(bill_to.router, tags=["Bill_to"])
 api.include_router(globals.router, tags=["Globals"])
 api.include_router(user.router, tags=["User"])
 api.include_router(utils.router, tags=["Utils"])
+api.include_router(jobs.router, tags=["Jobs"])
+if STORAGE_BACKEND == StorageKind.LOCAL:
+    # Urls of the local storage, S3 serves its own.
+    api.mount(
+        STORAGE_BASE_URL,
+        StaticFiles(directory=STORAGE_LOCAL_ROOT, check_dir=False),
+        name="storage",
+    )
 
 logging.basicConfig(
     format="[%(asctime)s] %(levelname)-8s - %(message)s", level=LOG_LEVEL
@@ -82,17 +109,82 @@ def api_status() -> dict[str, str]:
     return {"status": "OK"}
 
 
+@api.get("/metrics/executors", dependencies=[Depends(get_current_user)])
+def get_executor_metrics() -> Dict[str, Dict[str, int]]:
+    """Return the load of the process and thread pools.
+
+    Example response:
+    {
+      "process": {"max_workers": 2, "in_flight": 3, "queue_depth": 1, "completed": 10, "failed": 0},
+      "thread": {"max_workers": 8, "in_flight": 0, "queue_depth": 0, "completed": 42, "failed": 0}
+    }
+    """
+    return pool_metrics()
+
+
+@api.get("/metrics/cache", dependencies=[Depends(get_current_user)])
+def get_cache_metrics() -> Dict[str, Any]:
+    """Return the hits and misses of the cache of this process.
+
+    Example response:
+    {
+      "local": {"entries": 12, "max_entries": 10000, "hits": 40, "misses": 12,
+                "evictions": 0, "expirations": 1},
+      "invalidations": 3,
+      "shared": {"hits": 5, "misses": 7, "errors": 0},
+      "principals": {"entries": 2, "max_entries": 10000, "hits": 80, "misses": 2,
+                     "evictions": 0, "expirations": 0},
+      "downloads": {"entries": 40, "size": 5242880, "max_bytes": 2147483648,
+                    "hits": 120, "misses": 40, "evictions": 0}
+    }
+    """
+    return {**cache_metrics(), "downloads": get_download_cache().metrics()}
+
+
+@api.get("/metrics/renderer", dependencies=[Depends(get_current_user)])
+def get_renderer_metrics() -> Dict[str, Any]:
+    """Return the state of the PDF renderer of this process.
+
+    Example response:
+    {
+      "renderer": "pool", "engine": "wkhtmltopdf", "size": 2,
+      "processes": [{"pid": 4242, "alive": true, "jobs": 17}],
+      "idle": 1, "waiting": 0, "queue_size": 16,
+      "rendered": 17, "failed": 0, "recycled": 0
+    }
+    """
+    return get_renderer().health()
+
+
 @api.get("/service", response_model=List[schemas.Service])
 def get_services(
+    response: Response,
+    after: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000),
     current_user: schemas.User = Depends(get_current_user),
     db: Session = Depends(get_db),
 ) -> List[schemas.Service]:
-    """List services for the current user.
+    """List services for the current user, by id.
+
+    The cursor of the next page is in the X-Next-Cursor header, pass it as
+    `after`.
 
     Example request:
-    GET /service
+    GET /service?limit=100&after=WzEwMF0
     """
-    return crud.get_services(db=db, current_user_id=current_user.id)
+    services, next_cursor = page(
+        crud.get_services(
+            db=db,
+            current_user_id=current_user.id,
+            after=decode_cursor(after, 1),
+            limit=limit + 1,
+        ),
+        limit,
+        key=lambda service: (service.id,),
+    )
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return services
 
 
 @api.post("/service", response_model=List[schemas.Service])
@@ -116,14 +208,16 @@ def post_service(
       }
     ]
     """
-    result = []
+    model_list = []
     for contract in contracts:
         obj_dict = contract.model_dump()
         obj_dict["user_id"] = current_user.id
-        result.append(
-            crud.create_service(db=db, model=schemas.ServiceCreate(**obj_dict))
-        )
-    return result
+        model_list.append(schemas.ServiceCreate(**obj_dict))
+    with transaction(db):
+        service_ids = crud.create_services_bulk(db=db, model_list=model_list)
+    return crud.get_services_by_ids(
+        db=db, model_ids=service_ids, current_user_id=current_user.id
+    )
 
 
 @api.get("/topinfo", response_model=list[schemas.TopInfo])
@@ -156,9 +250,10 @@ def update_topinfo(
       "email": "info@example.com"
     }
     """
-    result = crud.patch_topinfo(
-        db=db, model_id=model_id, current_user_id=current_user.id, update_dict=model
-    )
+    with transaction(db):
+        result = crud.patch_topinfo(
+            db=db, model_id=model_id, current_user_id=current_user.id, update_dict=model
+        )
     if result:
         return crud.get_topinfos(db=db, current_user_id=current_user.id)
     else:
@@ -1,48 +1,322 @@
+"""Cache of small derived values, such as the breadcrumbs.
+
+Two tiers: a bounded LRU of the process with a TTL, and, when
+CACHE_SHARED_URL is set, a Redis shared by every node (requires the redis
+package). A miss in the LRU is looked up in the shared tier before
+fetching the value. Values must be JSON serializable and are not copied,
+callers must not modify them.
+
+Keys are a namespace, the user (user_key), and a name. The CRUD patch and
+delete functions call invalidate_user_on_commit, so the entries of a user
+are dropped once the change is committed. The shared tier is not scanned
+for them: its keys hold the generation of their namespace, a counter that
+the invalidation increments, and the entries of the older generations
+expire with their TTL. The other nodes keep the generation and their LRU
+entries CACHE_SHARED_LOCAL_TTL_SECONDS.
+
+The authenticated users are kept apart, by token subject, in an LRU of the
+process only: get_current_user then skips the database for
+AUTH_CACHE_TTL_SECONDS. A deleted user is dropped on the node that deletes
+it, the other nodes accept its tokens up to the TTL.
+"""
 import json
-import os
+import logging
+import threading
 import time
-from typing import Callable
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Set, Tuple, TypeVar
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from ms_invoicer.config import (
+    AUTH_CACHE_TTL_SECONDS,
+    CACHE_MAX_ENTRIES,
+    CACHE_SHARED_LOCAL_TTL_SECONDS,
+    CACHE_SHARED_URL,
+    CACHE_TTL_SECONDS,
+)
+
+log = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Namespace and name of an entry.
+CacheKey = Tuple[str, str]
+
+SHARED_KEY_PREFIX = "invoicer:cache:"
+GENERATION_KEY_PREFIX = "invoicer:generation:"
+PENDING_INVALIDATIONS = "cache_invalidations"
+
+_MISSING = object()
+
+
+class LRUCache:
+    """Bounded LRU of the process, entries expire after ttl seconds."""
+
+    def __init__(self, max_entries: int, ttl: float) -> None:
+        """Initialize instance."""
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Any:
+        """Value of key, _MISSING when absent or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return _MISSING
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return _MISSING
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value: Any) -> None:
+        """Set."""
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete_prefix(self, prefix: str) -> int:
+        """Delete the keys starting with prefix."""
+        with self._lock:
+            keys = [key for key in self._entries if key.startswith(prefix)]
+            for key in keys:
+                del self._entries[key]
+            return len(keys)
+
+    def delete_matching(self, predicate: Callable[[Any], bool]) -> int:
+        """Delete the entries whose value matches predicate."""
+        with self._lock:
+            keys = [key for key, (_, value) in self._entries.items() if predicate(value)]
+            for key in keys:
+                del self._entries[key]
+            return len(keys)
+
+    def metrics(self) -> Dict[str, int]:
+        """Metrics."""
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+class RedisTier:
+    """
+    Tier shared by the nodes, values stored as JSON under the generation of
+    their namespace. The generations read are kept generation_ttl seconds.
+    """
+
+    def __init__(self, url: str, ttl: int, generation_ttl: float) -> None:
+        """Initialize instance."""
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.generations = LRUCache(CACHE_MAX_ENTRIES, generation_ttl)
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def generation(self, namespace: str) -> int:
+        """Current generation of namespace, 0 until its first invalidation."""
+        generation = self.generations.get(namespace)
+        if generation is _MISSING:
+            generation = int(self.client.get(GENERATION_KEY_PREFIX + namespace) or 0)
+            self.generations.set(namespace, generation)
+        return generation
 
-from ms_invoicer.utils import BreadCrumbs
+    def shared_key(self, key: CacheKey) -> str:
+        """Redis key of key, in the current generation of its namespace."""
+        namespace, name = key
+        return "{}{}:{}:{}".format(
+            SHARED_KEY_PREFIX, namespace, self.generation(namespace), name
+        )
 
+    def get(self, key: CacheKey) -> Any:
+        """Value of key, _MISSING when absent or the server fails."""
+        try:
+            data = self.client.get(self.shared_key(key))
+        except Exception:
+            self.errors += 1
+            log.warning("Shared cache unavailable", exc_info=True, extra={"event": "cache"})
+            return _MISSING
+        if data is None:
+            self.misses += 1
+            return _MISSING
+        self.hits += 1
+        return json.loads(data)
 
-CACHE_DIR = "temp/cache"
-#TODO: Probar expiracion
-CACHE_EXPIRY_SECONDS = 3600*24*7  # Example: 1 week
+    def set(self, key: CacheKey, value: Any) -> None:
+        """Set."""
+        try:
+            self.client.set(self.shared_key(key), json.dumps(value), ex=self.ttl)
+        except Exception:
+            self.errors += 1
+            log.warning("Shared cache unavailable", exc_info=True, extra={"event": "cache"})
 
+    def invalidate(self, namespace: str) -> int:
+        """Move namespace to a new generation, the entries of the old one are not read again."""
+        generation = self.client.incr(GENERATION_KEY_PREFIX + namespace)
+        self.generations.set(namespace, generation)
+        return generation
 
-def cache_key(key: str) -> str:
-    """Cache key."""
-    return os.path.join(CACHE_DIR, f"{key}.json")
+    def metrics(self) -> Dict[str, int]:
+        """Metrics."""
+        return {"hits": self.hits, "misses": self.misses, "errors": self.errors}
 
 
-def is_cache_valid(file_path: str) -> bool:
-    """Is cache valid."""
-    if not os.path.exists(file_path):
-        return False
-    if time.time() - os.path.getmtime(file_path) > CACHE_EXPIRY_SECONDS:
-        return False
-    return True
+class Cache:
+    """The LRU of the process in front of the optional shared tier."""
 
+    def __init__(self, local: LRUCache, shared: Optional[RedisTier] = None) -> None:
+        """Initialize instance."""
+        self.local = local
+        self.shared = shared
+        self.invalidations = 0
 
-def read_cache(file_path: str) -> BreadCrumbs:
-    """Read cache."""
-    with open(file_path, 'r') as file:
-        data_json = json.load(file)
-        return BreadCrumbs(**json.loads(data_json))
+    def get_or_fetch(self, key: CacheKey, fetch_function: Callable[[], T]) -> T:
+        """Cached value of key, fetched and cached on a miss of every tier."""
+        local_key = local_cache_key(key)
+        value = self.local.get(local_key)
+        if value is not _MISSING:
+            return value
+        if self.shared is not None:
+            value = self.shared.get(key)
+            if value is not _MISSING:
+                self.local.set(local_key, value)
+                return value
+        value = fetch_function()
+        self.local.set(local_key, value)
+        if self.shared is not None:
+            self.shared.set(key, value)
+        return value
 
+    def invalidate(self, namespace: str) -> None:
+        """Drop the entries of namespace from every tier."""
+        self.invalidations += 1
+        self.local.delete_prefix(local_cache_key((namespace, "")))
+        if self.shared is not None:
+            try:
+                self.shared.invalidate(namespace)
+            except Exception:
+                self.shared.errors += 1
+                log.exception(
+                    "Failed to invalidate shared cache",
+                    extra={"namespace": namespace, "event": "cache"},
+                )
 
-def write_cache(file_path: str, data: BreadCrumbs) -> None:
-    """Write cache."""
-    with open(file_path, 'w') as file:
-        json.dump(str(data), file)
+    def metrics(self) -> Dict[str, Any]:
+        """Metrics."""
+        result: Dict[str, Any] = {
+            "local": self.local.metrics(),
+            "invalidations": self.invalidations,
+        }
+        if self.shared is not None:
+            result["shared"] = self.shared.metrics()
+        return result
 
 
-def get_cached_data(key: str, fetch_function: Callable[[], BreadCrumbs]) -> BreadCrumbs:
+def _create_cache() -> Cache:
+    """Cache of the process, as configured."""
+    if CACHE_SHARED_URL:
+        return Cache(
+            LRUCache(CACHE_MAX_ENTRIES, min(CACHE_TTL_SECONDS, CACHE_SHARED_LOCAL_TTL_SECONDS)),
+            RedisTier(CACHE_SHARED_URL, CACHE_TTL_SECONDS, CACHE_SHARED_LOCAL_TTL_SECONDS),
+        )
+    return Cache(LRUCache(CACHE_MAX_ENTRIES, CACHE_TTL_SECONDS))
+
+
+cache = _create_cache()
+
+# Id and username of the authenticated users, by token subject.
+principals = LRUCache(CACHE_MAX_ENTRIES, AUTH_CACHE_TTL_SECONDS)
+
+
+def local_cache_key(key: CacheKey) -> str:
+    """Key of the LRU of the process, the namespace first so it can be dropped by prefix."""
+    return "{}:{}".format(*key)
+
+
+def user_namespace(user_id: int) -> str:
+    """Namespace of the keys of a user."""
+    return "user:{}".format(user_id)
+
+
+def user_key(user_id: int, *parts: Any) -> CacheKey:
+    """Key of a user, e.g. user_key(1, "customer", 2) is ("user:1", "customer:2")."""
+    return user_namespace(user_id), ":".join(str(part) for part in parts)
+
+
+def get_cached_data(key: CacheKey, fetch_function: Callable[[], T]) -> T:
     """Get cached data."""
-    file_path = cache_key(key)
-    if is_cache_valid(file_path):
-        return read_cache(file_path)
-    data = fetch_function()
-    write_cache(file_path, data)
-    return data
+    return cache.get_or_fetch(key, fetch_function)
+
+
+def get_principal(
+    subject: str, fetch_function: Callable[[], Optional[Dict[str, Any]]]
+) -> Optional[Dict[str, Any]]:
+    """
+    Cached principal of a token subject. An unknown subject (None) is not
+    cached, so a user created afterwards can authenticate at once.
+    """
+    value = principals.get(subject)
+    if value is not _MISSING:
+        return value
+    value = fetch_function()
+    if value is not None:
+        principals.set(subject, value)
+    return value
+
+
+def invalidate_user(user_id: int) -> None:
+    """Drop the cached entries and the principal of a user."""
+    cache.invalidate(user_namespace(user_id))
+    principals.delete_matching(lambda principal: principal["id"] == user_id)
+
+
+def invalidate_user_on_commit(db: Session, user_id: int) -> None:
+    """
+    Drop the cached entries of a user once the session commits, so a read
+    between the change and the commit can not cache the old value for good.
+    Nothing is dropped when the session rolls back.
+    """
+    pending: Set[int] = db.info.setdefault(PENDING_INVALIDATIONS, set())
+    pending.add(user_id)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_committed(session: Session) -> None:
+    """Invalidate committed."""
+    for user_id in session.info.pop(PENDING_INVALIDATIONS, ()):
+        invalidate_user(user_id)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _discard_rolled_back(session: Session, previous_transaction: Any) -> None:
+    """Discard rolled back."""
+    if not session.in_transaction():
+        session.info.pop(PENDING_INVALIDATIONS, None)
+
+
+def cache_metrics() -> Dict[str, Any]:
+    """Cache metrics."""
+    return {**cache.metrics(), "principals": principals.metrics()}
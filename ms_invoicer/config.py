@@ -9,14 +9,64 @@ POOL_MAX_OVERFLOW = settings.POOL_MAX_OVERFLOW
 POOL_TIMEOUT = settings.POOL_TIMEOUT
 POOL_RECYCLE = settings.POOL_RECYCLE
 POOL_PRE_PING = settings.POOL_PRE_PING
+ASYNC_POOL_SIZE = settings.ASYNC_POOL_SIZE
+ASYNC_POOL_MAX_OVERFLOW = settings.ASYNC_POOL_MAX_OVERFLOW
 
 # S3
 S3_ACCESS_KEY = settings.S3_ACCESS_KEY
 S3_SECRET_ACCESS_KEY = settings.S3_SECRET_ACCESS_KEY
 S3_BUCKET_NAME = settings.S3_BUCKET_NAME
+S3_MAX_POOL_CONNECTIONS = settings.S3_MAX_POOL_CONNECTIONS
+S3_MULTIPART_THRESHOLD_MB = settings.S3_MULTIPART_THRESHOLD_MB
+S3_MULTIPART_CHUNKSIZE_MB = settings.S3_MULTIPART_CHUNKSIZE_MB
+S3_MAX_CONCURRENCY = settings.S3_MAX_CONCURRENCY
+S3_ENDPOINT_URL = settings.S3_ENDPOINT_URL
+
+# Storage
+STORAGE_BACKEND = settings.STORAGE_BACKEND
+STORAGE_LOCAL_ROOT = settings.STORAGE_LOCAL_ROOT
+STORAGE_BASE_URL = settings.STORAGE_BASE_URL
 
 # PDF
 WKHTMLTOPDF_PATH = settings.WKHTMLTOPDF_PATH
+PDF_RENDERER = settings.PDF_RENDERER
+PDF_RENDERER_ENGINE = settings.PDF_RENDERER_ENGINE
+PDF_RENDERER_POOL_SIZE = settings.PDF_RENDERER_POOL_SIZE
+PDF_RENDERER_QUEUE_SIZE = settings.PDF_RENDERER_QUEUE_SIZE
+PDF_RENDERER_MAX_JOBS = settings.PDF_RENDERER_MAX_JOBS
+PDF_RENDERER_TIMEOUT_SECONDS = settings.PDF_RENDERER_TIMEOUT_SECONDS
+PDF_RENDERER_HEALTH_CHECK_SECONDS = settings.PDF_RENDERER_HEALTH_CHECK_SECONDS
+
+# Jobs
+JOBS_ENABLED = settings.JOBS_ENABLED
+JOB_WORKER_CONCURRENCY = settings.JOB_WORKER_CONCURRENCY
+JOB_MAX_ATTEMPTS = settings.JOB_MAX_ATTEMPTS
+JOB_RETRY_BACKOFF_SECONDS = settings.JOB_RETRY_BACKOFF_SECONDS
+JOB_POLL_INTERVAL_SECONDS = settings.JOB_POLL_INTERVAL_SECONDS
+JOB_LEASE_SECONDS = settings.JOB_LEASE_SECONDS
+
+# Batch
+BATCH_MAX_ITEMS = settings.BATCH_MAX_ITEMS
+
+# Uploads
+MAX_UPLOAD_MB = settings.MAX_UPLOAD_MB
+
+# Cache
+CACHE_MAX_ENTRIES = settings.CACHE_MAX_ENTRIES
+CACHE_TTL_SECONDS = settings.CACHE_TTL_SECONDS
+CACHE_SHARED_URL = settings.CACHE_SHARED_URL
+CACHE_SHARED_LOCAL_TTL_SECONDS = settings.CACHE_SHARED_LOCAL_TTL_SECONDS
+AUTH_CACHE_TTL_SECONDS = settings.AUTH_CACHE_TTL_SECONDS
+
+# Summary
+SUMMARY_DOWNLOAD_CONCURRENCY = settings.SUMMARY_DOWNLOAD_CONCURRENCY
+SUMMARY_CACHE_DIR = settings.SUMMARY_CACHE_DIR
+SUMMARY_CACHE_MAX_MB = settings.SUMMARY_CACHE_MAX_MB
+PARSED_CACHE_MAX_MB = settings.PARSED_CACHE_MAX_MB
+
+# Executors
+PROCESS_POOL_SIZE = settings.PROCESS_POOL_SIZE
+THREAD_POOL_SIZE = settings.THREAD_POOL_SIZE
 
 # Security
 # to get a string like this run:
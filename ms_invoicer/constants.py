@@ -11,3 +11,41 @@ class LogEvent(str, Enum):
     ENSURE_DATABASE_EXISTS = "ensure_database_exists"
     INIT_DB = "init_db"
     CREATE_INVOICE_FROM_FILE = "create_invoice_from_file"
+    ENQUEUE_JOB = "enqueue_job"
+    RUN_JOB = "run_job"
+    WORKER = "worker"
+    RENDER_PDF = "render_pdf"
+
+
+class JobStatus(str, Enum):
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+
+class ExecutorKind(str, Enum):
+    PROCESS = "process"
+    THREAD = "thread"
+
+
+class PdfRendererKind(str, Enum):
+    PDFKIT = "pdfkit"
+    POOL = "pool"
+
+
+class PdfEngine(str, Enum):
+    WKHTMLTOPDF = "wkhtmltopdf"
+    WEASYPRINT = "weasyprint"
+
+
+class StorageKind(str, Enum):
+    S3 = "s3"
+    LOCAL = "local"
+    MEMORY = "memory"
+
+
+class TotalMode(str, Enum):
+    EXACT = "exact"
+    APPROXIMATE = "approximate"
+    NONE = "none"
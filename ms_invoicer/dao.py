@@ -1,12 +1,22 @@
 from typing import List, Optional
 from ms_invoicer.event_bus import Event
-from ms_invoicer.sql_app.schemas import File, Invoice
+
+
+def file_job_key(file_id: int) -> str:
+    """Job key of the events that build the invoice of a file."""
+    return "file_{}".format(file_id)
 
 
 class FilesToProcessEvent(Event):
+    """
+    Extract the services of the xlsx stored at xlsx_url. Steps of a pipeline
+    run can be handled by workers on different hosts: events refer to files
+    by their storage url or key, never by a local path.
+    """
+
     def __init__(
         self,
-        file_path: str,
+        xlsx_url: str,
         file_id: int,
         invoice_id: int,
         current_user_id: int,
@@ -16,7 +26,7 @@ class FilesToProcessEvent(Event):
         pages: Optional[List[str]] = None
     ) -> None:
         """Initialize instance."""
-        self.xlsx_url = file_path
+        self.xlsx_url = xlsx_url
         self.file_id = file_id
         self.invoice_id = invoice_id
         self.current_user_id = current_user_id
@@ -25,6 +35,10 @@ class FilesToProcessEvent(Event):
         self.currency = currency
         self.pages = pages or []
 
+    def job_key(self) -> Optional[str]:
+        """Job key."""
+        return file_job_key(self.file_id)
+
 
 class PdfToProcessEvent(Event):
     """
@@ -34,8 +48,8 @@ class PdfToProcessEvent(Event):
     def __init__(
         self,
         current_user_id: int,
-        invoice: Invoice,
-        file: File,
+        invoice_id: int,
+        file_id: int,
         html_template_name: str,
         xlsx_url: str,
         with_file: bool = True,
@@ -43,13 +57,17 @@ class PdfToProcessEvent(Event):
     ):
         """Initialize instance."""
         self.current_user_id = current_user_id
-        self.invoice = invoice
-        self.file = file
+        self.invoice_id = invoice_id
+        self.file_id = file_id
         self.html_template_name = html_template_name
         self.xlsx_url = xlsx_url
         self.with_file = with_file
         self.pages = pages or []
 
+    def job_key(self) -> Optional[str]:
+        """Job key."""
+        return file_job_key(self.file_id)
+
 
 class GenerateFinalPDF(Event):
     def __init__(
@@ -63,6 +81,10 @@ class GenerateFinalPDF(Event):
         self.filename = filename
         self.file_id = file_id
 
+    def job_key(self) -> Optional[str]:
+        """Job key."""
+        return file_job_key(self.file_id)
+
 
 class GenerateFinalPDFWithFile(GenerateFinalPDF):
     """
@@ -72,9 +94,8 @@ class GenerateFinalPDFWithFile(GenerateFinalPDF):
     def __init__(
         self,
         current_user_id: int,
-        pdf_tables: str,
         xlsx_url: str,
-        pdf_invoice: str,
+        pdf_invoice_key: str,
         filename: str,
         file_id: int,
         with_tables: bool = True,
@@ -82,9 +103,8 @@ class GenerateFinalPDFWithFile(GenerateFinalPDF):
     ):
         """Initialize instance."""
         super().__init__(current_user_id=current_user_id, filename=filename, file_id=file_id)
-        self.path_pdf_tables = pdf_tables
         self.xlsx_url = xlsx_url
-        self.path_pdf_invoice = pdf_invoice
+        self.pdf_invoice_key = pdf_invoice_key
         self.with_tables = with_tables
         self.pages = pages or []
 
@@ -97,10 +117,10 @@ class GenerateFinalPDFNoFile(GenerateFinalPDF):
     def __init__(
         self,
         current_user_id: int,
-        pdf_invoice: str,
+        pdf_invoice_key: str,
         filename: str,
         file_id: int,
     ):
         """Initialize instance."""
         super().__init__(current_user_id=current_user_id, filename=filename, file_id=file_id)
-        self.path_pdf_invoice = pdf_invoice
+        self.pdf_invoice_key = pdf_invoice_key
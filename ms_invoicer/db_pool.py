@@ -1,13 +1,28 @@
-from contextlib import contextmanager
-from typing import ContextManager, Generator
+from contextlib import asynccontextmanager, contextmanager
+from typing import (
+    AsyncContextManager,
+    AsyncGenerator,
+    Awaitable,
+    Callable,
+    ContextManager,
+    Generator,
+    List,
+)
 
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from ms_invoicer.sql_app.database import SessionLocal
+from ms_invoicer.sql_app.database import AsyncSessionLocal, SessionLocal
+
+# Session info key of the callbacks run once the unit of work commits.
+AFTER_COMMIT = "after_commit"
 
 
 def get_db() -> Generator[Session, None, None]:
-    """Get db."""
+    """
+    Get db. Nothing is committed for the endpoint: writes go inside a
+    `with transaction(db):` block, anything else is rolled back on close.
+    """
     db = SessionLocal()
     try:
         yield db
@@ -15,11 +30,63 @@ def get_db() -> Generator[Session, None, None]:
         db.close()
 
 
+@contextmanager
+def transaction(db: Session) -> ContextManager[Session]:
+    """
+    Unit of work: commit the changes staged by the CRUD functions in the
+    block once at its end, or roll all of them back if it raises.
+    """
+    try:
+        yield db
+    except Exception:
+        db.rollback()
+        raise
+    db.commit()
+
+
 @contextmanager
 def get_db_context() -> ContextManager[Session]:
-    """Get db context."""
+    """Get db context. The block is one unit of work, see transaction."""
     db = SessionLocal()
     try:
-        yield db
+        with transaction(db):
+            yield db
     finally:
         db.close()
+
+
+async def get_async_db() -> AsyncGenerator[AsyncSession, None]:
+    """
+    Get async db, for the `async def` endpoints so their queries do not block
+    the event loop. Writes go inside an `async with async_transaction(db):`.
+    """
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+def after_commit(db: AsyncSession, callback: Callable[[], Awaitable[None]]) -> None:
+    """
+    Await callback once the async_transaction of db commits. It is dropped
+    when the unit of work rolls back.
+    """
+    callbacks: List[Callable[[], Awaitable[None]]] = db.info.setdefault(
+        AFTER_COMMIT, []
+    )
+    callbacks.append(callback)
+
+
+@asynccontextmanager
+async def async_transaction(db: AsyncSession) -> AsyncContextManager[AsyncSession]:
+    """
+    Unit of work on an AsyncSession, see transaction. The after_commit
+    callbacks run once it is committed, their errors are raised.
+    """
+    try:
+        yield db
+    except Exception:
+        db.info.pop(AFTER_COMMIT, None)
+        await db.rollback()
+        raise
+    await db.commit()
+    for callback in db.info.pop(AFTER_COMMIT, []):
+        await callback()
@@ -0,0 +1,154 @@
+"""Disk cache of the files downloaded from the storage, for the summaries
+and the pipeline steps that read an xlsx.
+
+An entry is named after the storage key and the etag of its content, so a
+replaced file is downloaded again and its old entry ages out. The entries
+are evicted least recently used first once they take more than
+SUMMARY_CACHE_MAX_MB. Every process of a node can share SUMMARY_CACHE_DIR:
+entries are written to a partial file and renamed, and each process keeps
+its own index, adopting the entries another one wrote.
+
+Callers get a hard link to the entry in their own folder (a copy when the
+folders are on different devices), so an eviction never removes a file in
+use.
+"""
+import hashlib
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from ms_invoicer.config import SUMMARY_CACHE_DIR, SUMMARY_CACHE_MAX_MB
+from ms_invoicer.storage import Storage, get_storage
+
+MB = 1024 * 1024
+
+
+class DownloadCache:
+    """Size bounded LRU of downloaded files under root."""
+
+    def __init__(self, root: str, max_bytes: int) -> None:
+        """Initialize instance."""
+        self.root = root
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.size = 0
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        self._load()
+
+    def _load(self) -> None:
+        """Index the entries left on disk, the oldest first."""
+        paths = [
+            os.path.join(self.root, name)
+            for name in os.listdir(self.root)
+            if not name.endswith(".partial")
+        ]
+        for path in sorted(paths, key=os.path.getmtime):
+            self._add(path)
+        self._evict()
+
+    def entry_path(self, key: str, etag: str) -> str:
+        """Path of the entry of key with content etag."""
+        digest = hashlib.sha256("{}\n{}".format(key, etag).encode()).hexdigest()
+        return os.path.join(self.root, digest + os.path.splitext(key)[1])
+
+    def fetch(self, storage: Storage, key: str, file_path: str) -> None:
+        """Place the current content of key at file_path, downloading it on a miss."""
+        path = self.entry_path(key, storage.etag(key))
+        with self._lock:
+            if path in self._entries or os.path.exists(path):
+                try:
+                    _link(path, file_path)
+                except FileNotFoundError:
+                    # Evicted by another process.
+                    self._remove(path)
+                else:
+                    self.hits += 1
+                    self._add(path)
+                    os.utime(path)
+                    return
+            self.misses += 1
+
+        partial_path = "{}.{}.partial".format(path, threading.get_ident())
+        try:
+            etag = storage.get_with_etag(key, partial_path)
+            # The etag of what was downloaded, the file may have been replaced.
+            path = self.entry_path(key, etag)
+            os.replace(partial_path, path)
+        finally:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+        with self._lock:
+            _link(path, file_path)
+            self._add(path)
+            self._evict()
+
+    def _add(self, path: str) -> None:
+        """Index path as the most recently used entry."""
+        size = os.path.getsize(path)
+        self.size -= self._entries.pop(path, 0)
+        self._entries[path] = size
+        self.size += size
+
+    def _remove(self, path: str) -> None:
+        """Forget path and delete it."""
+        self.size -= self._entries.pop(path, 0)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _evict(self) -> None:
+        """Delete the least recently used entries over max_bytes, but the last one."""
+        while self.size > self.max_bytes and len(self._entries) > 1:
+            path = next(iter(self._entries))
+            self._remove(path)
+            self.evictions += 1
+
+    def metrics(self) -> Dict[str, int]:
+        """Metrics."""
+        return {
+            "entries": len(self._entries),
+            "size": self.size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+def _link(path: str, file_path: str) -> None:
+    """Hard link file_path to path, or copy it across devices."""
+    try:
+        os.link(path, file_path)
+    except FileNotFoundError:
+        raise
+    except OSError:
+        shutil.copyfile(path, file_path)
+
+
+_download_cache: Optional[DownloadCache] = None
+_lock = threading.Lock()
+
+
+def get_download_cache() -> DownloadCache:
+    """Download cache of the process, created on first use."""
+    global _download_cache
+    if _download_cache is None:
+        with _lock:
+            if _download_cache is None:
+                _download_cache = DownloadCache(
+                    SUMMARY_CACHE_DIR, SUMMARY_CACHE_MAX_MB * MB
+                )
+    return _download_cache
+
+
+def fetch_url(url: str, file_path: str) -> None:
+    """Place the stored file of url at file_path, through the download cache."""
+    storage = get_storage()
+    get_download_cache().fetch(storage, storage.key_from_url(url), file_path)
@@ -1,16 +1,25 @@
 import asyncio
+import contextvars
 import inspect
 import types
-from typing import Any, Callable, Coroutine, List, Type, Union, cast
+from typing import Any, Callable, Coroutine, Dict, List, Optional, Type, Union, cast
 
 # Compatibility shim for Python 3.12+ where asyncio.coroutine was removed.
 if not hasattr(asyncio, "coroutine"):
     asyncio.coroutine = types.coroutine  # type: ignore[attr-defined]
 
 from awebus import Bus
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ms_invoicer.config import JOBS_ENABLED
+from ms_invoicer.constants import ExecutorKind
+from ms_invoicer.db_pool import after_commit
+from ms_invoicer.executors import in_pool_process, pools
 
 # Avoid weakref handler collection when we wrap handlers at runtime.
 bus = Bus(event_use_weakref=False)
+# Registered event classes by event type, used to rebuild events from jobs.
+_event_classes: Dict[str, Type["Event"]] = {}
 
 
 def _event_type(clazz: Type) -> str:
@@ -27,18 +36,54 @@ class Event:
         """Event type."""
         return _event_type(self.__class__)
 
+    def job_key(self) -> Optional[str]:
+        """
+        Key shared by the events of one pipeline run. Queued events with the
+        same key are handled one after the other, in publish order.
+        """
+        return None
+
+    def to_payload(self) -> Dict[str, Any]:
+        """
+        JSON serializable representation of the event, stored with its job.
+        """
+        return dict(vars(self))
+
+    @classmethod
+    def from_payload(cls, payload: Dict[str, Any]) -> "Event":
+        """Rebuild an event from the payload produced by to_payload."""
+        event = cls.__new__(cls)
+        event.__dict__.update(payload)
+        return event
+
+
+def event_class(event_type: str) -> Type[Event]:
+    """Event class."""
+    return _event_classes[event_type]
+
 
 EventHandlerType = Callable[..., Coroutine[Any, Event, Any]]
 
 
-def _ensure_async(handler: Callable[..., Any]) -> EventHandlerType:
-    """Ensure async."""
+def _ensure_async(
+    handler: Callable[..., Any], executor: ExecutorKind = ExecutorKind.THREAD
+) -> EventHandlerType:
+    """
+    Wrap sync handlers so they run in the given executor pool instead of
+    blocking the event loop. Async handlers are returned as they are.
+    Thread handlers run in a copy of the caller's context, so publish defers
+    their events to the running job like it does for async handlers.
+    """
     if asyncio.iscoroutinefunction(handler):
         return cast(EventHandlerType, handler)
 
     async def _wrapper(*args: Any, **kwargs: Any) -> Any:
         """Wrapper."""
-        result = handler(*args, **kwargs)
+        if executor == ExecutorKind.THREAD:
+            context = contextvars.copy_context()
+            result = await pools[executor].run(context.run, handler, *args, **kwargs)
+        else:
+            result = await pools[executor].run(handler, *args, **kwargs)
         if inspect.isawaitable(result):
             return await result
         return result
@@ -59,7 +104,9 @@ def unregister(
 
 
 def register(
-    event_type: Type, async_event_handler: Union[EventHandlerType, List[EventHandlerType]]
+    event_type: Type,
+    async_event_handler: Union[EventHandlerType, List[EventHandlerType]],
+    executor: ExecutorKind = ExecutorKind.THREAD,
 ) -> None:
     """
     :event_type: the class corresponding to the event type to register
@@ -67,17 +114,122 @@ def register(
         inherit from this module's Event class).
     :async_event_handler: an async event handler function to call when events of
         of the passed in type are published
+    :executor: pool running the handler when it is a sync function: PROCESS for
+        CPU-bound handlers (must be picklable), THREAD for blocking I/O.
     """
+    _event_classes[_event_type(event_type)] = event_type
     if type(async_event_handler) == list:
         handlers: List[EventHandlerType] = cast(List[EventHandlerType], async_event_handler)
         for h in handlers:
-            bus.on(_event_type(event_type), _ensure_async(h))
+            bus.on(_event_type(event_type), _ensure_async(h, executor))
     else:
-        bus.on(_event_type(event_type), _ensure_async(async_event_handler))
+        bus.on(_event_type(event_type), _ensure_async(async_event_handler, executor))
 
 
-async def publish(event: Event) -> None:
+async def dispatch(event: Event) -> None:
     """
-    :event: publishes the given event (internally dispatched to the registered handlers).
+    :event: dispatches the given event to the registered handlers in this process.
     """
     await bus.emitAsync(event.event_type(), event)
+
+
+class DispatchError(Exception):
+    """Handlers of events dispatched in-process failed, events are the failed ones."""
+
+    def __init__(self, events: List[Event]) -> None:
+        """Initialize instance."""
+        super().__init__("{} event(s) failed".format(len(events)))
+        self.events = events
+
+
+async def dispatch_in_order(events: List[Event]) -> None:
+    """
+    Dispatch events in-process: events sharing a job key one after the other,
+    different keys concurrently. Raises DispatchError with the events of every
+    chain that failed, from its first failed event on.
+    """
+    chains: Dict[Any, List[Event]] = {}
+    for index, event in enumerate(events):
+        chains.setdefault(event.job_key() or index, []).append(event)
+
+    async def dispatch_chain(chain: List[Event]) -> Optional[BaseException]:
+        """Dispatch chain, return the error of its first failed event."""
+        for position, event in enumerate(chain):
+            try:
+                await dispatch(event)
+            except Exception as e:
+                del chain[:position]
+                return e
+        return None
+
+    errors = await asyncio.gather(
+        *(dispatch_chain(chain) for chain in chains.values())
+    )
+    failed = [
+        event
+        for chain, error in zip(chains.values(), errors)
+        if error is not None
+        for event in chain
+    ]
+    if failed:
+        raise DispatchError(failed) from next(e for e in errors if e is not None)
+
+
+async def publish(event: Event, db: Optional[AsyncSession] = None) -> Optional[int]:
+    """
+    :event: publishes the given event. When the job queue is enabled the event
+        is stored as a job and handled later by a worker, otherwise it is
+        dispatched in-process to the registered handlers.
+    :db: session of the caller's async_transaction. The job is committed with
+        it; dispatched in-process, the event is dispatched once it commits
+        since the handlers use their own sessions, and DispatchError is raised
+        from the end of the async_transaction when a handler fails.
+    :return: the id of the enqueued job, None when dispatched in-process or
+        published by a job handler: the job is then enqueued once the running
+        job is marked done.
+    """
+    if in_pool_process():
+        # The running job and its deferred events live in the parent process.
+        raise RuntimeError("Events can not be published from the process pool")
+    if not JOBS_ENABLED:
+        if db is None:
+            await dispatch(event)
+        else:
+            after_commit(db, lambda: dispatch_in_order([event]))
+        return None
+    from ms_invoicer.job_queue import defer, enqueue
+
+    if db is None:
+        if defer(event):
+            return None
+        return enqueue(event)
+    return await db.run_sync(lambda session: enqueue(event, db=session))
+
+
+async def publish_many(
+    events: List[Event], db: Optional[AsyncSession] = None
+) -> List[Optional[int]]:
+    """
+    :events: publishes the given events, like publish, with a single insert of
+        their jobs. Dispatched in-process, events sharing a job key are handled
+        one after the other and different keys concurrently.
+    :return: the ids of the enqueued jobs, in order, None for the events
+        dispatched in-process or deferred to the running job.
+    """
+    if in_pool_process():
+        raise RuntimeError("Events can not be published from the process pool")
+    if not JOBS_ENABLED:
+        if db is None:
+            await dispatch_in_order(events)
+        else:
+            after_commit(db, lambda: dispatch_in_order(events))
+        return [None] * len(events)
+    from ms_invoicer.job_queue import defer, enqueue_many, running_job
+
+    if db is None:
+        if running_job() is not None:
+            for event in events:
+                defer(event)
+            return [None] * len(events)
+        return enqueue_many(events)
+    return await db.run_sync(lambda session: enqueue_many(events, db=session))
@@ -10,5 +10,6 @@ def register_event_handlers() -> None:
     """
     register(FilesToProcessEvent, extract_data)
     register(PdfToProcessEvent, build_pdf)
+    # Runs its CPU-bound tables and PDF merge in the process pool itself.
     register(GenerateFinalPDFWithFile, generate_invoice)
     register(GenerateFinalPDFNoFile, generate_invoice_no_file)
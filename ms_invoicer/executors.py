@@ -0,0 +1,130 @@
+import asyncio
+import functools
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, TypeVar
+
+from ms_invoicer.config import LOG_LEVEL, PROCESS_POOL_SIZE, THREAD_POOL_SIZE
+from ms_invoicer.constants import ExecutorKind
+
+log = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+# Set in the workers of the process pool.
+_in_pool_process = False
+
+
+def _init_process() -> None:
+    """Initializer of the process pool workers."""
+    global _in_pool_process
+    _in_pool_process = True
+    logging.basicConfig(
+        format="[%(asctime)s] %(levelname)-8s - %(message)s", level=LOG_LEVEL
+    )
+
+
+class Pool:
+    """
+    Lazily created executor that keeps track of the work submitted to it.
+
+    Counters are only updated from the event loop thread.
+    """
+
+    def __init__(self, kind: ExecutorKind, max_workers: int) -> None:
+        """Initialize instance."""
+        self.kind = kind
+        self.max_workers = max_workers
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self._executor: Optional[Executor] = None
+        self._lock = threading.Lock()
+
+    def executor(self) -> Executor:
+        """Executor."""
+        with self._lock:
+            if self._executor is None:
+                if self.kind == ExecutorKind.PROCESS:
+                    # spawn: children must not inherit the parent's DB connections or loop.
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.max_workers,
+                        mp_context=multiprocessing.get_context("spawn"),
+                        initializer=_init_process,
+                    )
+                else:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.max_workers, thread_name_prefix="invoicer-io"
+                    )
+            return self._executor
+
+    async def run(self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """Run fn in the pool and wait for its result."""
+        loop = asyncio.get_running_loop()
+        self.in_flight += 1
+        try:
+            result = await loop.run_in_executor(
+                self.executor(), functools.partial(fn, *args, **kwargs)
+            )
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.in_flight -= 1
+        self.completed += 1
+        return result
+
+    def metrics(self) -> Dict[str, int]:
+        """Metrics."""
+        return {
+            "max_workers": self.max_workers,
+            "in_flight": self.in_flight,
+            "queue_depth": max(self.in_flight - self.max_workers, 0),
+            "completed": self.completed,
+            "failed": self.failed,
+        }
+
+    def shutdown(self) -> None:
+        """Shutdown."""
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+
+
+pools: Dict[ExecutorKind, Pool] = {
+    ExecutorKind.PROCESS: Pool(ExecutorKind.PROCESS, PROCESS_POOL_SIZE),
+    ExecutorKind.THREAD: Pool(ExecutorKind.THREAD, THREAD_POOL_SIZE),
+}
+
+
+async def run_in_process(fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """
+    Run CPU-bound work in the process pool. fn, its arguments and its result
+    must be picklable (module-level function, plain data).
+    """
+    return await pools[ExecutorKind.PROCESS].run(fn, *args, **kwargs)
+
+
+async def run_in_thread(fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Run blocking I/O (DB, S3, files, subprocesses) in the thread pool."""
+    return await pools[ExecutorKind.THREAD].run(fn, *args, **kwargs)
+
+
+def in_pool_process() -> bool:
+    """Whether this is a worker of the process pool."""
+    return _in_pool_process
+
+
+def pool_metrics() -> Dict[str, Dict[str, int]]:
+    """Pool metrics."""
+    return {kind.value: pool.metrics() for kind, pool in pools.items()}
+
+
+def shutdown_pools() -> None:
+    """Shutdown pools."""
+    for pool in pools.values():
+        pool.shutdown()
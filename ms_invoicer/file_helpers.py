@@ -1,46 +1,83 @@
-from ctypes import Union
+import asyncio
 import logging
 import shutil
 import os
-from typing import Dict, List, Tuple, Union
-import openpyxl
-from openpyxl.worksheet.worksheet import Worksheet
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
 
 from datetime import datetime
-from pathlib import Path
 from uuid import uuid4
 
 from fastapi import UploadFile, status, HTTPException
+from pydantic import ValidationError
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from openpyxl.cell.cell import Cell
-from ms_invoicer.config import S3_BUCKET_NAME
-
-from ms_invoicer.dao import FilesToProcessEvent, PdfToProcessEvent
-from ms_invoicer.db_pool import get_db_context
-from ms_invoicer.event_bus import publish
-from ms_invoicer.sql_app import crud, schemas
+from ms_invoicer.config import MAX_UPLOAD_MB, SUMMARY_DOWNLOAD_CONCURRENCY
+
+from ms_invoicer.constants import JobStatus
+from ms_invoicer.dao import FilesToProcessEvent, PdfToProcessEvent, file_job_key
+from ms_invoicer.db_pool import async_transaction, get_db_context
+from ms_invoicer.download_cache import fetch_url, get_download_cache
+from ms_invoicer.event_bus import Event, publish, publish_many
+from ms_invoicer.executors import run_in_process, run_in_thread
+from ms_invoicer.job_queue import (
+    chain_status,
+    combined_status,
+    complete_job,
+    running_job,
+)
+from ms_invoicer.sql_app import async_crud, crud, schemas
 from ms_invoicer.sql_app import models
 from ms_invoicer.sql_app.models import Invoice, User
+from ms_invoicer.storage import get_storage
+from ms_invoicer.summary_writer import SummaryWriter, get_summary_template
+from ms_invoicer.timesheet import load_parsed_timesheet, read_sheet_names
 from ms_invoicer.utils import (
-    download_file_from_s3,
+    UploadReader,
     extract_and_get_month_name,
-    find_letter,
     remove_file,
     save_file,
-    find_ranges,
-    upload_file,
     get_current_date,
 )
 
 log = logging.getLogger(__name__)
 
+XLSX_CONTENT_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
 
 def extract_pages(uploaded_file: UploadFile, current_user_id: int) -> List[str]:
-    """Extract pages."""
+    """Sheet names of the upload, read from its workbook part only."""
     log.info(
         "Extracting xlsx pages",
         extra={"customer_id": current_user_id, "event": "extract_pages"},
     )
+    if uploaded_file.size is not None and uploaded_file.size > MAX_UPLOAD_MB * 1024 * 1024:
+        raise HTTPException(
+            status_code=status.HTTP_413_CONTENT_TOO_LARGE,
+            detail="Archivo demasiado grande",
+        )
+    try:
+        return read_sheet_names(uploaded_file.file)
+    except Exception:
+        log.exception(
+            "Failed to extract xlsx pages",
+            extra={"customer_id": current_user_id, "event": "extract_pages"},
+        )
+        return []
+
+
+def extract_sheets(
+    uploaded_file: UploadFile, current_user_id: int
+) -> List[schemas.SheetInfo]:
+    """
+    Sheet names of the upload with the contracts and hours column found in
+    the scanned window of each sheet. Parsing every sheet now caches the
+    timesheet for /generate_pdf.
+    """
+    log.info(
+        "Extracting xlsx sheets",
+        extra={"customer_id": current_user_id, "event": "extract_pages"},
+    )
     try:
         date_now = get_current_date()
 
@@ -49,11 +86,18 @@ def extract_pages(uploaded_file: UploadFile, current_user_id: int) -> List[str]:
         file_path = "temp/xlsx/{}".format(filename)
         save_file(file_path, uploaded_file)
 
-        xlsx_file = Path(file_path)
-        wb_obj = openpyxl.load_workbook(xlsx_file)
-        results = wb_obj.sheetnames
+        timesheet = load_parsed_timesheet(file_path)
         remove_file(file_path)
-        return results
+        return [
+            schemas.SheetInfo(
+                name=sheet.name,
+                contracts=len(sheet.contracts),
+                hours_column=sheet.hours_letter,
+            )
+            for sheet in timesheet.selected(lambda name: True)
+        ]
+    except HTTPException:
+        raise
     except Exception:
         log.exception(
             "Failed to extract xlsx pages",
@@ -62,16 +106,129 @@ def extract_pages(uploaded_file: UploadFile, current_user_id: int) -> List[str]:
         return []
 
 
+def store_xlsx(file: UploadFile) -> str:
+    """
+    Stream the uploaded xlsx to the storage and return its url. The pipeline
+    steps read it from there, see fetch_xlsx.
+    """
+    date_now = get_current_date()
+    filename = f"{date_now.year}{date_now.month}{date_now.day}{date_now.hour}{date_now.minute}{date_now.second}-{str(uuid4())}.xlsx"
+    filename = filename.replace(" ", "_")
+    reader = UploadReader(file.file)
+    s3_url = get_storage().put(filename, reader, content_type=XLSX_CONTENT_TYPE)
+    reader.drain()
+    log.debug(
+        "Stored xlsx",
+        extra={
+            "filename": filename,
+            "sha256": reader.sha256.hexdigest(),
+            "size": reader.size,
+            "event": "process_file",
+        },
+    )
+    return s3_url
+
+
+def fetch_xlsx(xlsx_url: str) -> str:
+    """
+    Local copy of the stored xlsx under temp/xlsx, through the download
+    cache. The caller removes it.
+    """
+    file_path = "temp/xlsx/{}.xlsx".format(uuid4().hex)
+    fetch_url(xlsx_url, file_path)
+    return file_path
+
+
+def ingest_upload(file: UploadFile) -> Tuple[str, str, int, List[str]]:
+    """
+    Copy the upload to temp/xlsx and read its sheet names. Returns the path
+    of the copy, which the caller removes, the sha256, the size and the sheet
+    names.
+    """
+    file_path = "temp/xlsx/upload_{}.xlsx".format(uuid4().hex)
+    sha256, size = save_file(file_path, file)
+    try:
+        pages = read_sheet_names(file_path)
+    except Exception:
+        remove_file(file_path)
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Archivo Invalido"
+        )
+    return file_path, sha256, size, pages
+
+
+async def create_upload(
+    db: AsyncSession, file: UploadFile, current_user_id: int
+) -> models.Upload:
+    """
+    Upload of an xlsx, read once to pick its sheets and then reused by
+    /generate_pdf. The same content is only stored once per user. Nothing is
+    kept on the local disk: /generate_pdf reads it from the storage.
+    """
+    file_path, sha256, size, pages = await run_in_thread(ingest_upload, file)
+    try:
+        upload = await async_crud.get_upload_by_sha256(
+            db=db, sha256=sha256, current_user_id=current_user_id
+        )
+        if upload is not None:
+            return upload
+
+        s3_url = await run_in_thread(
+            get_storage().put_file,
+            "uploads/{}/{}.xlsx".format(current_user_id, sha256),
+            file_path,
+            content_type=XLSX_CONTENT_TYPE,
+        )
+    finally:
+        await run_in_thread(remove_file, file_path)
+    try:
+        async with async_transaction(db):
+            upload = await async_crud.create_upload(
+                db=db,
+                model=schemas.UploadCreate(
+                    id=uuid4().hex,
+                    sha256=sha256,
+                    size=size,
+                    filename=file.filename,
+                    pages=pages,
+                    s3_xlsx_url=s3_url,
+                    created=get_current_date(),
+                    user_id=current_user_id,
+                ),
+            )
+    except IntegrityError:
+        # The same xlsx was uploaded by a concurrent request.
+        await db.rollback()
+        upload = await async_crud.get_upload_by_sha256(
+            db=db, sha256=sha256, current_user_id=current_user_id
+        )
+    log.info(
+        "Stored upload",
+        extra={
+            "customer_id": current_user_id,
+            "upload_id": upload.id,
+            "size": size,
+            "event": "create_upload",
+        },
+    )
+    return upload
+
+
 async def process_file(
+    db: AsyncSession,
     file: Union[UploadFile, None],
     invoice_id: int,
     bill_to_id: int,
     current_user_id: int,
     col_letter: str = "F",
     pages: Union[List[str], None] = None,
+    upload: Optional[models.Upload] = None,
 ) -> Tuple[Union[schemas.File, None], Union[str, None]]:
-    """Process file."""
-    if file is None:
+    """
+    Process file, the uploaded xlsx or the one of a previous upload. Returns
+    the new file and the url of its xlsx.
+    """
+    if file is None and upload is None:
         return None, None
     pages = pages or []
     try:
@@ -85,24 +242,13 @@ async def process_file(
             },
         )
         date_now = get_current_date()
-        filename = f"{date_now.year}{date_now.month}{date_now.day}{date_now.hour}{date_now.minute}{date_now.second}-{str(uuid4())}.xlsx"
-        filename = filename.replace(" ", "_")
-        file_path = "temp/xlsx/{}".format(filename)
-        save_file(file_path, file)
+        if upload is not None:
+            s3_url = upload.s3_xlsx_url
+        else:
+            s3_url = await run_in_thread(store_xlsx, file)
 
         price_unit = 1
         currency = "CAD"
-        log.debug(
-            "Uploading xlsx to S3",
-            extra={
-                "customer_id": current_user_id,
-                "invoice_id": invoice_id,
-                "event": "process_file",
-            },
-        )
-        s3_url = upload_file(
-            file_path=file_path, file_name=filename, bucket=S3_BUCKET_NAME
-        )
         file_obj = schemas.FileCreate(
             **{
                 "s3_xlsx_url": s3_url,
@@ -114,29 +260,28 @@ async def process_file(
                 "user_id": current_user_id,
             }
         )
-        with get_db_context() as db:
-            new_file = crud.create_file(db=db, model=file_obj)
-            data_event = FilesToProcessEvent(
-                file_path=file_path,
-                file_id=new_file.id,
-                invoice_id=invoice_id,
-                current_user_id=current_user_id,
-                price_unit=price_unit,
-                col_letter=col_letter,
-                currency=currency,
-                pages=pages,
-            )
-            log.info(
-                "Publishing file processing event",
-                extra={
-                    "customer_id": current_user_id,
-                    "invoice_id": invoice_id,
-                    "file_id": new_file.id,
-                    "event": "process_file",
-                },
-            )
-            await publish(data_event)
-            return new_file, file_path
+        new_file = await async_crud.create_file(db=db, model=file_obj)
+        data_event = FilesToProcessEvent(
+            xlsx_url=s3_url,
+            file_id=new_file.id,
+            invoice_id=invoice_id,
+            current_user_id=current_user_id,
+            price_unit=price_unit,
+            col_letter=col_letter,
+            currency=currency,
+            pages=pages,
+        )
+        log.info(
+            "Publishing file processing event",
+            extra={
+                "customer_id": current_user_id,
+                "invoice_id": invoice_id,
+                "file_id": new_file.id,
+                "event": "process_file",
+            },
+        )
+        await publish(data_event, db=db)
+        return new_file, s3_url
     except Exception:
         log.exception(
             "Failed to process xlsx upload",
@@ -150,6 +295,108 @@ async def process_file(
         raise
 
 
+def parse_invoice_date(value: Any) -> Any:
+    """Parse invoice date from the summary row of a sheet."""
+    parsed_date = str(value)
+    date_formats = [
+        "%d/%m/%Y %H:%M:%S",
+        "%d/%m/%Y",
+        "%d-%m-%Y %H:%M:%S",
+        "%d-%m-%Y",
+    ]
+    for date_format in date_formats:
+        try:
+            parsed_date = datetime.strptime(parsed_date, date_format)
+            break  # Break out of the loop if parsing is successful
+        except ValueError:
+            pass
+    return parsed_date
+
+
+def read_services(
+    xlsx_path: str, pages: List[str], currency: str
+) -> Tuple[Any, List[Dict[str, Any]]]:
+    """
+    Read the services of every contract in the selected sheets of the xlsx.
+
+    Returns the invoice date found in the last selected sheet (None when no
+    contract was found) and one service dict per contract, without ids.
+    Runs in the process pool: arguments and result are plain data.
+    """
+    invoice_date = None
+    services: List[Dict[str, Any]] = []
+    timesheet = load_parsed_timesheet(xlsx_path, select=lambda name: name in pages)
+    for sheet in timesheet.selected(lambda name: name in pages):
+        if sheet.contracts:
+            invoice_date = parse_invoice_date(sheet.contracts[0].date_value)
+        for contract in sheet.contracts:
+            if contract.hours is None:
+                raise ValueError(
+                    "Invalid hours in sheet {} rows {}-{}".format(
+                        sheet.name, contract.start, contract.end - 1
+                    )
+                )
+            contract_dict = {}
+            for cell, value in contract.info:
+                if cell and isinstance(cell, str):
+                    if "NOM CONTRAT" in cell or "NOM" in cell:
+                        contract_dict["title"] = value
+                    elif "HEURE" in cell or "HEURES" in cell:
+                        contract_dict["price_unit"] = value
+                    elif "MONTANT" in cell:
+                        contract_dict["total_amount"] = value
+            hours = contract.hours
+
+            # Derive amount and price_unit depending on the sheet data.
+            price_unit = contract_dict.get("price_unit", None)
+            amount = 0
+            if not price_unit:
+                amount = float(contract_dict.get("total_amount", 1))
+                price_unit = round(amount / hours, 2)
+            else:
+                str_price_unit = str(price_unit).replace("$", "").strip()
+                price_unit = float(str_price_unit)
+                amount = hours * float(price_unit)
+            contract_dict.pop("total_amount", None)
+            contract_dict["hours"] = hours
+            contract_dict["currency"] = currency
+            contract_dict["amount"] = round(amount, 2)
+            contract_dict["price_unit"] = price_unit
+            services.append(contract_dict)
+    return invoice_date, services
+
+
+def save_services(
+    event: FilesToProcessEvent,
+    invoice_date: Any,
+    services: List[Dict[str, Any]],
+    job: Optional[schemas.Job] = None,
+) -> None:
+    """
+    Store the services read from the xlsx and the invoice date. Given the job
+    of the event, it is marked done with them: a retry can not insert them
+    twice next to the services sent with the request.
+    """
+    model_list = []
+    for contract_dict in services:
+        contract_dict["file_id"] = event.file_id
+        contract_dict["invoice_id"] = event.invoice_id
+        contract_dict["user_id"] = event.current_user_id
+        model_list.append(schemas.ServiceCreate(**contract_dict))
+    with get_db_context() as conn:
+        # All the services of the file are stored or none is.
+        crud.create_services_bulk(db=conn, model_list=model_list)
+        if invoice_date is not None:
+            crud.patch_invoice(
+                db=conn,
+                model_id=event.invoice_id,
+                current_user_id=event.current_user_id,
+                update_dict={"created": invoice_date},
+            )
+        if job is not None:
+            complete_job(conn, job)
+
+
 async def extract_data(event: FilesToProcessEvent) -> bool:
     """Extract data."""
     log.info(
@@ -161,118 +408,80 @@ async def extract_data(event: FilesToProcessEvent) -> bool:
             "event": "extract_data",
         },
     )
-    event_handled = False
-    with get_db_context() as conn:
+    try:
+        xlsx_path = await run_in_thread(fetch_xlsx, event.xlsx_url)
         try:
-            currency = event.currency
-
-            xlsx_file = Path(event.xlsx_url)
-            wb_obj = openpyxl.load_workbook(xlsx_file, data_only=True)
-            for sheet_name in wb_obj.sheetnames:
-                if sheet_name not in event.pages:
-                    continue
-                sheet: Cell = wb_obj[sheet_name]
-                col_letter = find_letter(sheet)
-
-                # Identify row ranges for each contract section.
-                ranges = find_ranges(sheet)
-                invoice_update = False
-                for range_of in ranges:
-                    (minrowinfo, maxrowinfo, minrow, maxrow) = range_of
-                    if not invoice_update:
-                        # Parse invoice date from the summary row in the sheet.
-                        parsed_date = str(sheet["{}{}".format("A", maxrow - 1)].value)
-                        date_formats = [
-                            "%d/%m/%Y %H:%M:%S",
-                            "%d/%m/%Y",
-                            "%d-%m-%Y %H:%M:%S",
-                            "%d-%m-%Y",
-                        ]
-                        for date_format in date_formats:
-                            try:
-                                parsed_date = datetime.strptime(parsed_date, date_format)
-                                break  # Break out of the loop if parsing is successful
-                            except ValueError:
-                                pass
-
-                        crud.patch_invoice(
-                            db=conn,
-                            model_id=event.invoice_id,
-                            current_user_id=event.current_user_id,
-                            update_dict={"created": parsed_date},
-                        )
-                        invoice_update = True
-                    contract_dict = {}
-                    for row in sheet.iter_rows(
-                        min_row=minrowinfo, max_row=maxrowinfo, max_col=15
-                    ):
-                        cell = row[0].value
-                        if cell:
-                            if "NOM CONTRAT" in cell or "NOM" in cell:
-                                contract_dict["title"] = row[2].value
-                            elif "HEURE" in cell or "HEURES" in cell:
-                                contract_dict["price_unit"] = row[2].value
-                            elif "MONTANT" in cell:
-                                contract_dict["total_amount"] = row[2].value
-                    hours: float = 0
-                    for col in range(minrow, maxrow):
-                        hour: float = sheet["{}{}".format(col_letter, col)].value
-                        hours += float(round(hour, 2))
-
-                    # Derive amount and price_unit depending on the sheet data.
-                    price_unit = contract_dict.get("price_unit", None)
-                    amount = 0
-                    if not price_unit:
-                        amount = float(contract_dict.get("total_amount", 1))
-                        price_unit = round(amount / hours, 2)
-                    else:
-                        str_price_unit = str(price_unit).replace("$", "").strip()
-                        price_unit = float(str_price_unit)
-                        amount = hours * float(price_unit)
-                    contract_dict["hours"] = hours
-                    contract_dict["currency"] = currency
-                    contract_dict["amount"] = round(amount, 2)
-                    contract_dict["price_unit"] = price_unit
-                    contract_dict["file_id"] = event.file_id
-                    contract_dict["invoice_id"] = event.invoice_id
-                    contract_dict["user_id"] = event.current_user_id
-                    service_created = schemas.ServiceCreate(**contract_dict)
-                    crud.create_service(db=conn, model=service_created)
-
-            log.info(
-                "Extracted invoice data from xlsx",
-                extra={
-                    "customer_id": event.current_user_id,
-                    "invoice_id": event.invoice_id,
-                    "file_id": event.file_id,
-                    "event": "extract_data",
-                },
+            invoice_date, services = await run_in_process(
+                read_services, xlsx_path, event.pages, event.currency
             )
-            event_handled = True
-            return event_handled
-        except Exception:
-            log.exception(
-                "Failed to extract invoice data from xlsx",
-                extra={
-                    "customer_id": event.current_user_id,
-                    "invoice_id": event.invoice_id,
-                    "file_id": event.file_id,
-                    "event": "extract_data",
-                },
+        finally:
+            remove_file(xlsx_path)
+        await run_in_thread(save_services, event, invoice_date, services, running_job())
+        log.info(
+            "Extracted invoice data from xlsx",
+            extra={
+                "customer_id": event.current_user_id,
+                "invoice_id": event.invoice_id,
+                "file_id": event.file_id,
+                "service_count": len(services),
+                "event": "extract_data",
+            },
+        )
+        return True
+    except Exception:
+        log.exception(
+            "Failed to extract invoice data from xlsx",
+            extra={
+                "customer_id": event.current_user_id,
+                "invoice_id": event.invoice_id,
+                "file_id": event.file_id,
+                "event": "extract_data",
+            },
+        )
+        raise
+
+
+def remove_failed_files(
+    events: List[Event], current_user_id: int, created_invoice_ids: Iterable[int] = ()
+) -> None:
+    """
+    Delete the files of events whose in-process handlers failed, with their
+    services, and the invoices of created_invoice_ids among them. With
+    JOBS_ENABLED = false the handlers run after the request commits, this
+    undoes what the request created for them.
+    """
+    file_ids = {event.file_id for event in events}
+    invoice_ids = {getattr(event, "invoice_id", None) for event in events}
+    created = set(created_invoice_ids) & invoice_ids
+    with get_db_context() as conn:
+        for invoice_id in created:
+            crud.delete_invoices_cascade(
+                db=conn, current_user_id=current_user_id, invoice_id=invoice_id
+            )
+        for file_id in file_ids:
+            crud.delete_services_by_file(
+                db=conn, model_id=file_id, current_user_id=current_user_id
             )
-            raise
+            crud.delete_file(db=conn, model_id=file_id, current_user_id=current_user_id)
+
+
+def invoice_template_name(with_taxes: Optional[bool]) -> str:
+    """Base template of an invoice."""
+    if not with_taxes:
+        return "template03.html"
+    return "template01.html"
 
 
 async def process_pdf(
-    db: Session,
+    db: AsyncSession,
     invoice: Invoice,
     bill_to_id: int,
     contracts: List[schemas.ServiceCreateNoFile],
     current_user: User,
     new_file_obj: schemas.File,
-    xlsx_local_path: str,
+    xlsx_url: Optional[str],
     pages: Union[List[str], None] = None,
-) -> schemas.File:
+) -> schemas.FileWithJob:
     """Process pdf."""
     pages = pages or []
     log.info(
@@ -298,7 +507,7 @@ async def process_pdf(
                 "user_id": current_user.id,
             }
         )
-        new_file = crud.create_file(db=db, model=file_obj)
+        new_file = await async_crud.create_file(db=db, model=file_obj)
         log.info(
             "Created file record without xlsx",
             extra={
@@ -321,15 +530,14 @@ async def process_pdf(
             },
         )
 
-    result = []
+    model_list = []
     for contract in contracts:
         obj_dict = contract.model_dump()
         obj_dict["user_id"] = current_user.id
         obj_dict["invoice_id"] = invoice.id
         obj_dict["file_id"] = new_file.id
-        result.append(
-            crud.create_service(db=db, model=schemas.ServiceCreate(**obj_dict))
-        )
+        model_list.append(schemas.ServiceCreate(**obj_dict))
+    result = await async_crud.create_services_bulk(db=db, model_list=model_list)
     log.info(
         "Created invoice services",
         extra={
@@ -341,15 +549,12 @@ async def process_pdf(
         },
     )
 
-    template_name = "template01.html"
-    if not invoice.with_taxes:
-        template_name = "template03.html"
     data_event = PdfToProcessEvent(
         current_user_id=current_user.id,
-        invoice=invoice,
-        file=new_file,
-        html_template_name=template_name,
-        xlsx_url=xlsx_local_path,
+        invoice_id=invoice.id,
+        file_id=new_file.id,
+        html_template_name=invoice_template_name(invoice.with_taxes),
+        xlsx_url=xlsx_url,
         with_file=with_file,
         pages=pages,
     )
@@ -362,18 +567,379 @@ async def process_pdf(
             "event": "process_pdf",
         },
     )
-    await publish(data_event)
-    crud.patch_invoice(
+    job_id = await publish(data_event, db=db)
+    await async_crud.patch_invoice(
         db=db,
         model_id=invoice.id,
         current_user_id=current_user.id,
         update_dict={"updated": current_date},
     )
-    return crud.get_file(db=db, model_id=new_file.id, current_user_id=current_user.id)
+    result = schemas.FileWithJob.model_validate(
+        await async_crud.get_file_with_relations(
+            db=db, model_id=new_file.id, current_user_id=current_user.id
+        )
+    )
+    result.job_id = job_id
+    return result
+
+
+def format_pages(pages: List[str]) -> List[str]:
+    """Sheet names as stored in pages_xlsx, where "," separates pages."""
+    return [page.replace(",", "-") for page in pages]
+
+
+async def process_batch(
+    db: AsyncSession,
+    raw_items: List[Any],
+    files: List[UploadFile],
+    current_user: User,
+) -> schemas.BatchResult:
+    """
+    Create the invoices of a batch and queue the build of their PDFs.
+
+    Items are validated together: an invalid item, an invoice number already
+    used (in the batch or in the DB) or a failed xlsx upload is reported in
+    its result and the other items go on. The xlsx are uploaded concurrently,
+    then invoices, files, services and jobs are each created with one INSERT.
+    """
+    batch_id = uuid4().hex
+    log.info(
+        "Processing invoice batch",
+        extra={
+            "customer_id": current_user.id,
+            "batch_id": batch_id,
+            "item_count": len(raw_items),
+            "event": "process_batch",
+        },
+    )
+    results = [
+        schemas.BatchItemResult(index=index, status=JobStatus.PENDING.value)
+        for index in range(len(raw_items))
+    ]
+    items: Dict[int, schemas.BatchInvoiceItem] = {}
+
+    def reject(index: int, detail: str) -> None:
+        """Reject."""
+        results[index].status = JobStatus.FAILED.value
+        results[index].detail = detail
+        items.pop(index, None)
+
+    for index, raw_item in enumerate(raw_items):
+        try:
+            items[index] = schemas.BatchInvoiceItem.model_validate(raw_item)
+        except ValidationError as e:
+            reject(
+                index,
+                "; ".join(
+                    "{}: {}".format(".".join(map(str, error["loc"])), error["msg"])
+                    for error in e.errors()
+                ),
+            )
+
+    keys: Dict[Tuple[int, int], int] = {}
+    for index, item in list(items.items()):
+        key = (item.customer_id, item.number_id)
+        if key in keys:
+            reject(index, "Numéro de factura repetido en el lote")
+        elif item.file_index is not None and not 0 <= item.file_index < len(files):
+            reject(index, "Archivo no encontrado")
+        else:
+            keys[key] = index
+    for invoice in await async_crud.get_invoices_by_number_ids(
+        db=db, keys=list(keys), current_user_id=current_user.id
+    ):
+        reject(
+            keys[(invoice.customer_id, invoice.number_id)],
+            "Existe una factura con ese numéro de factura",
+        )
+
+    file_indexes = sorted(
+        {item.file_index for item in items.values() if item.file_index is not None}
+    )
+    stored = await asyncio.gather(
+        *(run_in_thread(store_xlsx, files[file_index]) for file_index in file_indexes),
+        return_exceptions=True,
+    )
+    stored_files = dict(zip(file_indexes, stored))
+    for index, item in list(items.items()):
+        if item.file_index is not None and isinstance(
+            stored_files[item.file_index], Exception
+        ):
+            log.error(
+                "Failed to store batch xlsx",
+                exc_info=stored_files[item.file_index],
+                extra={
+                    "customer_id": current_user.id,
+                    "batch_id": batch_id,
+                    "file_index": item.file_index,
+                    "event": "process_batch",
+                },
+            )
+            stored_error = stored_files[item.file_index]
+            reject(
+                index,
+                stored_error.detail
+                if isinstance(stored_error, HTTPException)
+                else "Error al subir el archivo",
+            )
+
+    indexes = list(items)
+    if not indexes:
+        return schemas.BatchResult(batch_id=batch_id, items=results)
+
+    now = get_current_date()
+    invoice_ids = await async_crud.create_invoices_bulk(
+        db=db,
+        model_list=[
+            schemas.InvoiceCreate(
+                **items[index].model_dump(
+                    exclude={"bill_to_id", "contracts", "pages", "file_index"}
+                ),
+                created=now,
+                updated=now,
+                user_id=current_user.id,
+            )
+            for index in indexes
+        ],
+    )
+    stored_urls: Dict[int, Optional[str]] = {
+        index: (
+            stored_files[items[index].file_index]
+            if items[index].file_index is not None
+            else None
+        )
+        for index in indexes
+    }
+    file_ids = await async_crud.create_files_bulk(
+        db=db,
+        model_list=[
+            schemas.FileCreate(
+                s3_xlsx_url=stored_urls[index],
+                s3_pdf_url=None,
+                created=now,
+                pages_xlsx=",".join(format_pages(items[index].pages)),
+                invoice_id=invoice_id,
+                bill_to_id=items[index].bill_to_id,
+                user_id=current_user.id,
+                batch_id=batch_id,
+            )
+            for index, invoice_id in zip(indexes, invoice_ids)
+        ],
+    )
+    await async_crud.create_services_bulk(
+        db=db,
+        model_list=[
+            schemas.ServiceCreate(
+                **contract.model_dump(),
+                file_id=file_id,
+                invoice_id=invoice_id,
+                user_id=current_user.id,
+            )
+            for index, invoice_id, file_id in zip(indexes, invoice_ids, file_ids)
+            for contract in items[index].contracts
+        ],
+    )
+
+    events = []
+    pdf_events: Dict[int, int] = {}
+    for index, invoice_id, file_id in zip(indexes, invoice_ids, file_ids):
+        item = items[index]
+        pages = format_pages(item.pages)
+        xlsx_url = stored_urls[index]
+        if xlsx_url:
+            events.append(
+                FilesToProcessEvent(
+                    xlsx_url=xlsx_url,
+                    file_id=file_id,
+                    invoice_id=invoice_id,
+                    current_user_id=current_user.id,
+                    price_unit=1,
+                    col_letter="F",
+                    currency="CAD",
+                    pages=pages,
+                )
+            )
+        pdf_events[index] = len(events)
+        events.append(
+            PdfToProcessEvent(
+                current_user_id=current_user.id,
+                invoice_id=invoice_id,
+                file_id=file_id,
+                html_template_name=invoice_template_name(item.with_taxes),
+                xlsx_url=xlsx_url,
+                with_file=xlsx_url is not None,
+                pages=pages,
+            )
+        )
+    job_ids = await publish_many(events, db=db)
+
+    for index, invoice_id, file_id in zip(indexes, invoice_ids, file_ids):
+        results[index].invoice_id = invoice_id
+        results[index].file_id = file_id
+        results[index].job_id = job_ids[pdf_events[index]]
+    log.info(
+        "Queued invoice batch",
+        extra={
+            "customer_id": current_user.id,
+            "batch_id": batch_id,
+            "queued": len(indexes),
+            "rejected": len(raw_items) - len(indexes),
+            "event": "process_batch",
+        },
+    )
+    return schemas.BatchResult(batch_id=batch_id, items=results)
+
+
+def get_batch_status(
+    db: Session, batch_id: str, current_user_id: int
+) -> Optional[schemas.BatchStatus]:
+    """Status of every invoice of a batch, None when the batch is unknown."""
+    files = crud.get_files_by_batch(
+        db=db, batch_id=batch_id, current_user_id=current_user_id
+    )
+    if not files:
+        return None
+    jobs_by_chain: Dict[str, List[models.Job]] = {}
+    for job in crud.get_jobs_by_chains(
+        db=db,
+        chain_keys=[file_job_key(file.id) for file in files],
+        current_user_id=current_user_id,
+    ):
+        jobs_by_chain.setdefault(job.chain_key, []).append(job)
+
+    items = [
+        schemas.BatchFileStatus(
+            file_id=file.id,
+            invoice_id=file.invoice_id,
+            status=(
+                JobStatus.DONE.value
+                if file.s3_pdf_url
+                else chain_status(jobs_by_chain.get(file_job_key(file.id), []))
+            ),
+            s3_pdf_url=file.s3_pdf_url,
+        )
+        for file in files
+    ]
+    return schemas.BatchStatus(
+        batch_id=batch_id,
+        status=combined_status(item.status for item in items),
+        items=items,
+    )
+
+
+class FileToProcess:
+    def __init__(
+        self, filename: str, file_path: str, invoice_id: int, pages_xlsx: str
+    ) -> None:
+        """Initialize instance."""
+        self.filename = filename
+        self.file_path = file_path
+        self.invoice_id = invoice_id
+        self.pages_xlsx = pages_xlsx
+
+    def __str__(self) -> str:
+        """Return display string."""
+        return "file_path: {} - invoice_id: {}".format(
+            self.file_path, self.invoice_id, self.pages_xlsx
+        )
+
+
+async def fetch_summary_files(
+    xlsx_list: List[models.File], folder: str
+) -> List[FileToProcess]:
+    """
+    Place the xlsx of each file in folder, SUMMARY_DOWNLOAD_CONCURRENCY at a
+    time, through the download cache. Files without xlsx are skipped.
+    """
+    storage = get_storage()
+    download_cache = get_download_cache()
+    semaphore = asyncio.Semaphore(SUMMARY_DOWNLOAD_CONCURRENCY)
+
+    async def fetch(xlsx: models.File) -> FileToProcess:
+        """Fetch."""
+        filename = f"to_process_{xlsx.invoice_id}_{xlsx.id}_{xlsx.user_id}.xlsx"
+        file_path = os.path.join(folder, filename)
+        async with semaphore:
+            await run_in_thread(
+                download_cache.fetch,
+                storage,
+                storage.key_from_url(xlsx.s3_xlsx_url),
+                file_path,
+            )
+        return FileToProcess(filename, file_path, xlsx.invoice_id, xlsx.pages_xlsx)
+
+    xlsx_path_name_list = await asyncio.gather(
+        *(fetch(xlsx) for xlsx in xlsx_list if xlsx.s3_xlsx_url is not None)
+    )
+    return sorted(xlsx_path_name_list, key=lambda x: x.invoice_id)
+
+
+# Columns A-F of an input contract go to columns A, C-G of the summary.
+SUMMARY_VALUE_COLUMNS = (1, 3, 4, 5, 6, 7)
+
+
+def build_summary_workbook(
+    xlsx_path_name_list: List[FileToProcess], output_file_path: str
+) -> None:
+    """
+    Write the contracts of every input xlsx into one sheet each, laid out as
+    the summary template, and save them to output_file_path. Sheets are
+    streamed one by one, see summary_writer. Runs in the process pool.
+    """
+    writer = SummaryWriter(get_summary_template())
+    index_contract = 1
+    for path in xlsx_path_name_list:
+        pages_xlsx: List[str] = []
+        should_check = False
+        if path.pages_xlsx is not None and path.pages_xlsx != "":
+            pages_xlsx = path.pages_xlsx.split(",")
+            should_check = True
+
+        def is_selected(sheet_name: str) -> bool:
+            """Is selected."""
+            return not should_check or sheet_name.replace(",", "-") in pages_xlsx
+
+        timesheet = load_parsed_timesheet(path.file_path, select=is_selected)
+        for input_sheet in timesheet.selected(is_selected):
+            summary_sheet = writer.add_sheet("{}".format(index_contract))
+            index_contract += 1
+
+            period_extracted = False
+            for contract in input_sheet.contracts:
+                for label, value in contract.info:
+                    if isinstance(label, str) and "NOM CONTRAT" in label:
+                        summary_sheet.set_value(1, 3, value)
+
+                if not period_extracted:
+                    summary_sheet.set_value(
+                        2,
+                        3,
+                        extract_and_get_month_name(contract.cell(contract.start, 0)),
+                    )
+                    period_extracted = True
+
+                minrow, maxrow = contract.start, contract.end
+                for row_number, row in enumerate(
+                    contract.rows(minrow, maxrow - 1), start=minrow
+                ):
+                    summary_sheet.set_values(
+                        row_number, dict(zip(SUMMARY_VALUE_COLUMNS, row))
+                    )
+
+                # Months of 30 days or less: drop the 31st and fix the totals.
+                if maxrow - minrow <= 30:
+                    summary_sheet.delete_row(36)
+                    summary_sheet.set_values(
+                        36, {7: "=SUM(G6:G35)", 9: "=SUM(I6:I35)", 11: "=SUM(K6:K35)"}
+                    )
+                    summary_sheet.set_value(38, 7, "=SUM(G22:G35)")
+            summary_sheet.write()
+
+    writer.save(output_file_path)
 
 
 async def generate_summary_by_date(
-    db: Session,
+    db: AsyncSession,
     customer_id: int,
     current_user: User,
     start_date: datetime,
@@ -390,168 +956,44 @@ async def generate_summary_by_date(
             "event": "generate_summary_by_date",
         },
     )
-    invoices_by_customer = crud.get_invoices_by_customer_and_date_range(
+    xlsx_list = await async_crud.get_summary_files(
         db=db,
-        model_id=customer_id,
+        customer_id=customer_id,
         current_user_id=current_user.id,
         start_date=start_date,
         end_date=end_date,
     )
 
-    xlsx_list: List[models.File] = []
-    for invoice in invoices_by_customer:
-        files_list = crud.get_files_by_invoice(
-            db=db, model_id=invoice.id, current_user_id=current_user.id
-        )
-        if len(files_list) > 0:
-            xlsx_list.append(files_list[0])
-
-    class FileToProcess:
-        def __init__(
-            self, filename: str, file_path: str, invoice_id: int, pages_xlsx: str
-        ) -> None:
-            """Initialize instance."""
-            self.filename = filename
-            self.file_path = file_path
-            self.invoice_id = invoice_id
-            self.pages_xlsx = pages_xlsx
-
-        def __str__(self) -> str:
-            """Return display string."""
-            return "file_path: {} - invoice_id: {}".format(
-                self.file_path, self.invoice_id, self.pages_xlsx
-            )
-
     log.info(
         "Downloading xlsx files for summary",
         extra={
             "customer_id": current_user.id,
             "target_customer_id": customer_id,
+            "num_files": len(xlsx_list),
             "event": "generate_summary_by_date",
         },
     )
-    xlsx_path_name_list: List[FileToProcess] = []
-    for xlsx in xlsx_list:
-        filename = f"to_process_{xlsx.invoice_id}_{xlsx.id}_{xlsx.user_id}.xlsx"
-        file_path = "temp/xlsx/{}".format(filename)
-        new_file_to_process = FileToProcess(
-            filename, file_path, xlsx.invoice_id, xlsx.pages_xlsx
-        )
-        xlsx_path_name_list.append(new_file_to_process)
-        if not os.path.exists(file_path) and xlsx.s3_xlsx_url is not None:
-            splitted_name = xlsx.s3_xlsx_url.split("/")
-            download_file_from_s3(
-                file_path_s3=splitted_name[3],
-                path_to_save=file_path,
-                bucket=S3_BUCKET_NAME,
-            )
-    xlsx_path_name_list = sorted(xlsx_path_name_list, key=lambda x: x.invoice_id)
-
+    # Scratch folder of this summary, removed once it is uploaded.
+    folder = "temp/xlsx/summary_{}".format(uuid4().hex)
+    os.mkdir(folder)
     try:
-        customer_obj = crud.get_customer(
+        xlsx_path_name_list = await fetch_summary_files(xlsx_list, folder)
+        customer_obj = await async_crud.get_customer(
             db=db, model_id=customer_id, current_user_id=current_user.id
         )
         output_filename = "resumen_{}_{}_{}-{}_{}.xlsx".format(
-            customer_obj.name.replace(" ", "_"),
+            customer_obj["name"].replace(" ", "_"),
             start_date.month,
             start_date.year,
             end_date.month,
             end_date.year,
         )
-        output_file_path = "temp/xlsx/{}".format(output_filename)
-        shutil.copy("scripts/summary_template.xlsx", output_file_path)
-
-        new_workbook = openpyxl.load_workbook(output_file_path)
-        pair_sheet_names: Dict[str, List[Tuple]] = {}
-        for path in xlsx_path_name_list:
-            xlsx_file = Path(path.file_path)
-            wb_obj = openpyxl.load_workbook(xlsx_file, data_only=True)
-
-            # Track the mapping between input and output sheet names.
-            if path.file_path not in pair_sheet_names:
-                pair_sheet_names[path.file_path] = []
-            pages_xlsx: List[str] = []
-            should_check = False
-            if path.pages_xlsx is not None and path.pages_xlsx != "":
-                pages_xlsx = path.pages_xlsx.split(",")
-                should_check = True
-            for _, sheet_name in enumerate(wb_obj.sheetnames):
-                sheet: Worksheet = wb_obj[sheet_name]
-                if should_check and sheet_name.replace(",", "-") not in pages_xlsx:
-                    continue
-                new_sheet: Worksheet = new_workbook["01"]
-                new_worksheet: Worksheet = new_workbook.copy_worksheet(new_sheet)
-                pair_sheet_names[path.file_path].append(
-                    (sheet.title, new_worksheet.title)
-                )
-
-        index_contract = 1
-        for path in xlsx_path_name_list:
-            xlsx_file = Path(path.file_path)
-            wb_obj = openpyxl.load_workbook(xlsx_file, data_only=True)
-            for input_sheet_name, output_sheet_name in pair_sheet_names[path.file_path]:
-                input_sheet: Worksheet = wb_obj[input_sheet_name]
-
-                new_sheet_wb: Worksheet = new_workbook[output_sheet_name]
-                new_sheet_wb.title = "{}".format(index_contract)
-                index_contract += 1
-
-                ranges = find_ranges(input_sheet)
-                period_extracted = False
-                for range_of in ranges:
-                    (minrowinfo, maxrowinfo, minrow, maxrow) = range_of
-                    for row in input_sheet.iter_rows(
-                        min_row=minrowinfo, max_row=maxrowinfo, max_col=10
-                    ):
-                        cell = row[0].value
-                        if cell:
-                            if "NOM CONTRAT" in cell:
-                                cell_new_wb = new_sheet_wb["C1"]
-                                cell_new_wb.value = row[2].value
-
-                    if not period_extracted:
-                        new_sheet_wb[
-                            "{}{}".format("C", 2)
-                        ].value = extract_and_get_month_name(
-                            input_sheet["{}{}".format("A", minrow)].value
-                        )
-                        period_extracted = True
-
-                    # Values
-                    # Copy input sheet columns into the summary template layout.
-                    for col in range(minrow, maxrow):
-                        input_date_value = input_sheet["{}{}".format("A", col)].value
-                        new_sheet_wb["{}{}".format("A", col)].value = input_date_value
-
-                        input_date_value = input_sheet["{}{}".format("B", col)].value
-                        new_sheet_wb["{}{}".format("C", col)].value = input_date_value
-
-                        input_date_value = input_sheet["{}{}".format("C", col)].value
-                        new_sheet_wb["{}{}".format("D", col)].value = input_date_value
-
-                        input_date_value = input_sheet["{}{}".format("D", col)].value
-                        new_sheet_wb["{}{}".format("E", col)].value = input_date_value
-
-                        input_date_value = input_sheet["{}{}".format("E", col)].value
-                        new_sheet_wb["{}{}".format("F", col)].value = input_date_value
-
-                        input_date_value = input_sheet["{}{}".format("F", col)].value
-                        new_sheet_wb["{}{}".format("G", col)].value = input_date_value
-
-                    if maxrow - minrow <= 30:
-                        new_sheet_wb.delete_rows(36)
-                        new_sheet_wb["{}{}".format("G", 36)].value = "=SUM(G6:G35)"
-                        new_sheet_wb["{}{}".format("G", 38)].value = "=SUM(G22:G35)"
-                        new_sheet_wb["{}{}".format("I", 36)].value = "=SUM(I6:I35)"
-                        new_sheet_wb["{}{}".format("K", 36)].value = "=SUM(K6:K35)"
-
-        original_sheet = new_workbook["01"]
-        new_workbook.remove(original_sheet)
-        new_workbook.save(output_file_path)
-        # Close the workbook
-        new_workbook.close()
-        s3_url = upload_file(
-            file_path=output_file_path, file_name=output_filename, bucket=S3_BUCKET_NAME
+        output_file_path = os.path.join(folder, output_filename)
+        await run_in_process(
+            build_summary_workbook, xlsx_path_name_list, output_file_path
+        )
+        s3_url = await run_in_thread(
+            get_storage().put_file, output_filename, output_file_path
         )
         return s3_url
 
@@ -570,3 +1012,5 @@ async def generate_summary_by_date(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Hubo un error generanto el resumen",
         )
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
@@ -1,14 +1,9 @@
 import os
-import bs4
-import jinja2
-import pdfkit
 import logging
-from typing import IO, Union
+from typing import IO, Any, Dict, List, Optional, Tuple, Union
 
 from datetime import datetime
 from uuid import uuid4
-from bs4 import BeautifulSoup
-from openpyxl import load_workbook
 try:
     from pypdf import PdfMerger
 except ImportError:  # pypdf>=5 removed PdfMerger
@@ -40,21 +35,200 @@ from reportlab.lib import colors
 from reportlab.lib.pagesizes import letter
 from reportlab.platypus import PageBreak, SimpleDocTemplate, Table, TableStyle
 
-from ms_invoicer.config import S3_BUCKET_NAME, WKHTMLTOPDF_PATH
 from ms_invoicer.dao import (
+    GenerateFinalPDF,
     GenerateFinalPDFNoFile,
     GenerateFinalPDFWithFile,
     PdfToProcessEvent,
 )
 from ms_invoicer.db_pool import get_db_context
+from ms_invoicer.download_cache import fetch_url
 from ms_invoicer.event_bus import publish
-from ms_invoicer.utils import find_ranges, remove_file, upload_file
+from ms_invoicer.executors import run_in_process, run_in_thread
+from ms_invoicer.pdf_renderer import get_renderer
+from ms_invoicer.storage import get_storage
+from ms_invoicer.timesheet import load_parsed_timesheet
+from ms_invoicer.utils import remove_file
 from ms_invoicer.sql_app import crud
+from ms_invoicer.template_engine import render_invoice
 
-base = os.path.dirname(os.path.dirname(__file__))
 log = logging.getLogger(__name__)
 
 
+class InvoiceRenderData:
+    """
+    Everything needed to render the invoice of a file, loaded from the DB.
+    """
+
+    def __init__(
+        self,
+        context: Dict[str, Any],
+        services: List[Dict[str, Any]],
+        filename: str,
+        file_id: int,
+        invoice_id: int,
+        with_tables: bool,
+    ) -> None:
+        """Initialize instance."""
+        self.context = context
+        self.services = services
+        self.filename = filename
+        self.file_id = file_id
+        self.invoice_id = invoice_id
+        self.with_tables = with_tables
+
+
+def load_invoice_render_data(event: PdfToProcessEvent) -> InvoiceRenderData:
+    """
+    Load the template context of the invoice of event.file_id, with one query
+    for the file, services, bill to, invoice and top info and one for the
+    globals.
+    """
+    with get_db_context() as connection:
+        file, invoice, top_info = crud.get_file_render_data(
+            db=connection,
+            file_id=event.file_id,
+            invoice_id=event.invoice_id,
+            current_user_id=event.current_user_id,
+        )
+        variables = crud.get_globals(
+            db=connection, current_user_id=event.current_user_id
+        )
+        log.debug(
+            "Preparing PDF template data",
+            extra={
+                "customer_id": event.current_user_id,
+                "invoice_id": invoice.id,
+                "file_id": file.id,
+                "template": event.html_template_name,
+                "event": "build_pdf",
+            },
+        )
+        top_info_data = {}
+        if top_info:
+            top_info_data["top_info_from"] = top_info.ti_from
+            top_info_data["top_info_addr"] = top_info.addr
+            top_info_data["top_info_phone"] = top_info.phone
+            top_info_data["top_info_email"] = top_info.email
+
+        bill_to_data = {}
+        if file.bill_to:
+            bill_to_data["to"] = file.bill_to.to
+            bill_to_data["addr"] = file.bill_to.addr
+            bill_to_data["phone"] = file.bill_to.phone
+            bill_to_data["email"] = file.bill_to.email
+
+        services = []
+        subtotal = 0
+        service_info = None
+        # Contratos enviados sin archivo
+        for index, service in enumerate(file.services):
+            if not service_info:
+                service_info = service
+            services.append(
+                {
+                    "service_id": index + 1,
+                    "service_txt": service.title,
+                    "num_hours": service.hours,
+                    "amount": service.amount,
+                }
+            )
+            subtotal += service.amount
+
+        if invoice.with_taxes:
+            total_tax_1 = (invoice.tax_1 / 100) * subtotal
+            total_tax_2 = (invoice.tax_2 / 100) * subtotal
+            total = total_tax_1 + total_tax_2 + subtotal
+        else:
+            total = subtotal
+
+        title_company = "-"
+        tps_name = "TPS -"
+        tvq_name = "TVQ -"
+        empresa_found = False
+        for variable in variables:
+            if variable.identifier == 1:
+                tps_name = variable.name
+            elif variable.identifier == 2:
+                tvq_name = variable.name
+            elif variable.identifier == 3 and not empresa_found:
+                title_company = variable.value
+                empresa_found = True
+
+        context = {
+            "title_company": title_company,
+            "invoice_date": invoice.created.strftime("%d-%m-%Y"),
+            "invoice_id": invoice.number_id,
+            "created": invoice.created,
+            "total": round(total, 2),
+        }
+
+        if invoice.with_taxes:
+            context["tps_name"] = tps_name
+            context["tvq_name"] = tvq_name
+            context["total_no_taxes"] = round(subtotal, 2)
+            context["total_tax1"] = round(total_tax_1, 2)
+            context["total_tax2"] = round(total_tax_2, 2)
+
+        # Combine base, bill-to and company info into template context.
+        context |= bill_to_data
+        context |= top_info_data
+
+        # Named after the file, so a retried step stores the same part and PDF keys.
+        filename = f"facture_{invoice.number_id}_{service_info.title}_{invoice.created.strftime('%m_%Y')}-{invoice.id}_{file.id}.pdf"
+        filename = filename.replace(" ", "_")
+        return InvoiceRenderData(
+            context=context,
+            services=services,
+            filename=filename,
+            file_id=file.id,
+            invoice_id=invoice.id,
+            with_tables=invoice.with_tables,
+        )
+
+
+def invoice_part_key(filename: str) -> str:
+    """Storage key of the rendered invoice, before the tables are merged in."""
+    return "parts/{}".format(filename)
+
+
+def store_invoice_part(filename: str, pdf_path: str) -> str:
+    """Put the rendered invoice at pdf_path in the storage for the next step."""
+    key = invoice_part_key(filename)
+    get_storage().put_file(key, pdf_path, content_type="application/pdf")
+    return key
+
+
+def fetch_invoice_part(event: GenerateFinalPDF) -> str:
+    """Local copy of the rendered invoice of event under temp/pdf."""
+    pdf_path = "temp/pdf/part_{}".format(event.filename)
+    get_storage().get(event.pdf_invoice_key, pdf_path)
+    return pdf_path
+
+
+def write_pdf(pdf: bytes, output_pdf_path: str) -> None:
+    """Write pdf."""
+    with open(output_pdf_path, "wb") as output_file:
+        output_file.write(pdf)
+
+
+async def render_invoice_pdf(
+    html_template_name: str,
+    services: List[Dict[str, Any]],
+    context: Dict[str, Any],
+    output_pdf_path: str,
+) -> None:
+    """
+    Render the invoice template with context and write the PDF to
+    output_pdf_path.
+    """
+    output_text = await run_in_thread(
+        render_invoice, html_template_name, context, services
+    )
+    pdf = await get_renderer().render(output_text)
+    await run_in_thread(write_pdf, pdf, output_pdf_path)
+
+
 async def build_pdf(event: PdfToProcessEvent) -> bool:
     """Build pdf."""
     try:
@@ -62,236 +236,220 @@ async def build_pdf(event: PdfToProcessEvent) -> bool:
             "Building PDF from invoice data",
             extra={
                 "customer_id": event.current_user_id,
-                "invoice_id": event.invoice.id if event.invoice else None,
-                "file_id": event.file.id if event.file else None,
+                "invoice_id": event.invoice_id,
+                "file_id": event.file_id,
                 "event": "build_pdf",
             },
         )
-        with get_db_context() as connection:
-            input_html_path: str = os.path.join(
-                base, "templates/base/{}".format(event.html_template_name)
-            )
-            # Write modified template to temp directory instead of overwriting original
-            temp_templates_dir = os.path.join(base, "temp/templates")
-            os.makedirs(temp_templates_dir, exist_ok=True)
-            # Use unique filename to avoid conflicts with concurrent requests
-            unique_template_name = f"{event.invoice.id}_{event.file.id}_{uuid4()}_{event.html_template_name}"
-            output_html_path: str = os.path.join(
-                temp_templates_dir, unique_template_name
+        render_data = await run_in_thread(load_invoice_render_data, event)
+
+        log.info(
+            "Rendering PDF template",
+            extra={
+                "customer_id": event.current_user_id,
+                "invoice_id": render_data.invoice_id,
+                "file_id": render_data.file_id,
+                "template": event.html_template_name,
+                "event": "build_pdf",
+            },
+        )
+        output_pdf_path: str = "temp/pdf/{}".format(render_data.filename)
+        await render_invoice_pdf(
+            event.html_template_name,
+            render_data.services,
+            render_data.context,
+            output_pdf_path,
+        )
+        # The next step may run on another host: it reads the PDF from the storage.
+        try:
+            pdf_invoice_key = await run_in_thread(
+                store_invoice_part, render_data.filename, output_pdf_path
             )
-            event.file = crud.get_file(
-                db=connection,
+        finally:
+            remove_file(output_pdf_path)
+
+        if event.with_file:
+            data_event = GenerateFinalPDFWithFile(
                 current_user_id=event.current_user_id,
-                model_id=event.file.id,
+                xlsx_url=event.xlsx_url,
+                pdf_invoice_key=pdf_invoice_key,
+                filename=render_data.filename,
+                file_id=render_data.file_id,
+                with_tables=render_data.with_tables,
+                pages=event.pages,
             )
-            event.invoice = crud.get_invoice(
-                db=connection,
+        else:
+            data_event = GenerateFinalPDFNoFile(
                 current_user_id=event.current_user_id,
-                model_id=event.invoice.id,
+                pdf_invoice_key=pdf_invoice_key,
+                filename=render_data.filename,
+                file_id=render_data.file_id,
             )
-            with open(input_html_path) as fp:
-                soup = BeautifulSoup(fp, "html.parser")
-
-                # Expand the template table based on the number of services.
-                new_tag = soup.new_tag("div")
-                for index in range(0, len(event.file.services)):
-                    new_tr_tag = soup.new_tag("tr")
-                    for variable in [
-                        "service_id",
-                        "service_txt",
-                        "num_hours",
-                        "amount",
-                    ]:
-                        new_td_tag = soup.new_tag("td")
-                        new_td_tag.string = "{{" + variable + str(index) + "}}"
-                        new_tr_tag.append(new_td_tag)
-                    new_tag.append(new_tr_tag)
-                for comment in soup.find_all(string=lambda e: isinstance(e, bs4.Comment)):
-                    if "items" in comment:
-                        comment.replace_with(new_tag)
-
-                with open(output_html_path, "w") as file:
-                    file.write(str(soup))
-
-                log.debug(
-                    "Preparing PDF template data",
-                    extra={
-                        "customer_id": event.current_user_id,
-                        "invoice_id": event.invoice.id,
-                        "file_id": event.file.id,
-                        "template": event.html_template_name,
-                        "event": "build_pdf",
-                    },
-                )
-                top_info_data = {}
-                top_info = crud.get_topinfos(
-                    db=connection, current_user_id=event.current_user_id
-                )
-                if len(top_info) > 0:
-                    top_info = top_info[0]
-                    top_info_data["top_info_from"] = top_info.ti_from
-                    top_info_data["top_info_addr"] = top_info.addr
-                    top_info_data["top_info_phone"] = top_info.phone
-                    top_info_data["top_info_email"] = top_info.email
-
-                bill_to_data = {}
-                if event.file.bill_to:
-                    bill_to_data["to"] = event.file.bill_to.to
-                    bill_to_data["addr"] = event.file.bill_to.addr
-                    bill_to_data["phone"] = event.file.bill_to.phone
-                    bill_to_data["email"] = event.file.bill_to.email
-
-                service_data = {}
-                subtotal = 0
-                index = 0
-                service_info = None
-                # Contratos enviados sin archivo
-                for service in event.file.services:
-                    if not service_info:
-                        service_info = service
-                    service_data["service_id{}".format(index)] = index + 1
-                    service_data["service_txt{}".format(index)] = service.title
-                    service_data["num_hours{}".format(index)] = service.hours
-                    service_data["amount{}".format(index)] = service.amount
-                    subtotal += service.amount
-                    index += 1
-
-                if event.invoice.with_taxes:
-                    total_tax_1 = (event.invoice.tax_1 / 100) * subtotal
-                    total_tax_2 = (event.invoice.tax_2 / 100) * subtotal
-                    total = total_tax_1 + total_tax_2 + subtotal
-                else:
-                    total = subtotal
-
-                title_company = "-"
-                empresa_variable = crud.get_global(
-                    db=connection, identifier=3, current_user_id=event.current_user_id
-                )
-                if empresa_variable:
-                    title_company = empresa_variable.value
-
-                variables = crud.get_globals(
-                    db=connection, current_user_id=event.current_user_id
-                )
-                tps_name = "TPS -"
-                tvq_name = "TVQ -"
-                for variable in variables:
-                    if variable.identifier == 1:
-                        tps_name = variable.name
-                    elif variable.identifier == 2:
-                        tvq_name = variable.name
-
-                context = {
-                    "title_company": title_company,
-                    "invoice_date": event.invoice.created.strftime("%d-%m-%Y"),
-                    "invoice_id": event.invoice.number_id,
-                    "created": event.invoice.created,
-                    "total": round(total, 2),
-                }
-
-                if event.invoice.with_taxes:
-                    context["tps_name"] = tps_name
-                    context["tvq_name"] = tvq_name
-                    context["total_no_taxes"] = round(subtotal, 2)
-                    context["total_tax1"] = round(total_tax_1, 2)
-                    context["total_tax2"] = round(total_tax_2, 2)
-
-                # Combine base, bill-to, services, and company info into template context.
-                context |= bill_to_data
-                context |= service_data
-                context |= top_info_data
-
-                log.info(
-                    "Rendering PDF template",
-                    extra={
-                        "customer_id": event.current_user_id,
-                        "invoice_id": event.invoice.id,
-                        "file_id": event.file.id,
-                        "template": event.html_template_name,
-                        "event": "build_pdf",
-                    },
-                )
-                # Load template from temp directory where modified template was written
-                template_loader = jinja2.FileSystemLoader(temp_templates_dir)
-                template_env = jinja2.Environment(loader=template_loader)
-
-                template = template_env.get_template(unique_template_name)
-                output_text = template.render(context)
-                
-                # Clean up the temporary template file after rendering
-                try:
-                    os.remove(output_html_path)
-                except Exception as cleanup_error:
-                    log.warning(
-                        "Failed to clean up temporary template file",
-                        extra={
-                            "template_path": output_html_path,
-                            "error": str(cleanup_error),
-                            "event": "build_pdf",
-                        },
-                    )
-
-                # Build the initial invoice PDF from the rendered HTML.
-                if not service_info:
-                    searched_file = crud.get_file(
-                        db=connection,
-                        model_id=event.file.id,
-                        current_user_id=event.current_user_id,
-                    )
-                    if searched_file and len(searched_file.services) > 0:
-                        service_info = searched_file.services[0]
-                filename = f"facture_{event.invoice.number_id}_{service_info.title}_{event.invoice.created.strftime('%m_%Y')}-{str(uuid4())}.pdf"
-                filename = filename.replace(" ", "_")
-                output_pdf_path: str = "temp/pdf/{}".format(filename)
-                config = pdfkit.configuration(
-                    wkhtmltopdf=WKHTMLTOPDF_PATH
-                )  # TODO: Modificar en la máquina
-                pdfkit.from_string(output_text, output_pdf_path, configuration=config)
-
-                if event.with_file:
-                    data_event = GenerateFinalPDFWithFile(
-                        current_user_id=event.current_user_id,
-                        pdf_tables=f"temp/pdf_tables_{event.current_user_id}.pdf",
-                        xlsx_url=event.xlsx_url,
-                        pdf_invoice=output_pdf_path,
-                        filename=filename,
-                        file_id=event.file.id,
-                        with_tables=event.invoice.with_tables,
-                        pages=event.pages,
-                    )
-                else:
-                    data_event = GenerateFinalPDFNoFile(
-                        current_user_id=event.current_user_id,
-                        pdf_invoice=output_pdf_path,
-                        filename=filename,
-                        file_id=event.file.id,
-                    )
-                log.info(
-                    "Publishing final PDF event",
-                    extra={
-                        "customer_id": event.current_user_id,
-                        "invoice_id": event.invoice.id,
-                        "file_id": event.file.id,
-                        "event": "build_pdf",
-                    },
-                )
-                await publish(data_event)
-                return True
+        log.info(
+            "Publishing final PDF event",
+            extra={
+                "customer_id": event.current_user_id,
+                "invoice_id": render_data.invoice_id,
+                "file_id": render_data.file_id,
+                "event": "build_pdf",
+            },
+        )
+        await publish(data_event)
+        return True
     except Exception:
         log.exception(
             "Failed to build PDF",
             extra={
                 "customer_id": event.current_user_id,
-                "invoice_id": event.invoice.id if event.invoice else None,
-                "file_id": event.file.id if event.file else None,
+                "invoice_id": event.invoice_id,
+                "file_id": event.file_id,
                 "event": "build_pdf",
             },
         )
         raise
 
 
-def generate_invoice(event: GenerateFinalPDFWithFile) -> bool:
-    """Generate invoice."""
+def store_invoice_pdf(event: GenerateFinalPDF, pdf_path: str) -> str:
+    """Put the invoice PDF at pdf_path in the storage, opened as <invoice number>.pdf."""
+    return get_storage().put_file(
+        event.filename,
+        pdf_path,
+        content_type="application/pdf",
+        download_name="{}.pdf".format(event.filename.split("-")[0]),
+    )
+
+
+def remove_invoice_part(event: GenerateFinalPDF) -> None:
+    """Delete the rendered invoice of event from the storage, once it is stored merged."""
+    try:
+        get_storage().delete_many([event.pdf_invoice_key])
+    except Exception:
+        log.exception(
+            "Failed to delete rendered invoice",
+            extra={"file_id": event.file_id, "key": event.pdf_invoice_key},
+        )
+
+
+def build_tables_pdf(xlsx_path: str, pages: List[str], pdf_tables_path: str) -> None:
+    """Write one table per contract of the selected sheets to pdf_tables_path."""
+    # Define the page size
+    page_size = letter
+
+    # Define the table style
+    table_style = TableStyle(
+        [
+            ("BACKGROUND", (0, 0), (-1, 0), colors.HexColor("#333333")),
+            ("TEXTCOLOR", (0, 0), (-1, 0), colors.HexColor("#ffffff")),
+            ("ALIGN", (0, 0), (-1, -1), "CENTER"),
+            ("FONTNAME", (0, 0), (-1, 0), "Helvetica-Bold"),
+            ("FONTSIZE", (0, 0), (-1, 0), 12),
+            ("LEADING", (0, 0), (-1, -1), 12),
+            ("BOTTOMPADDING", (0, 0), (-1, 0), 6),
+            ("BACKGROUND", (0, 1), (-1, -1), colors.HexColor("#f2f2f2")),
+            ("GRID", (0, 0), (-1, -1), 1, colors.HexColor("#333333")),
+            ("GRID", (0, 0), (-1, 0), 2, colors.HexColor("#333333")),
+            ("GRID", (0, 1), (-1, -1), 1, colors.HexColor("#333333")),
+            ("VALIGN", (0, 0), (-1, -1), "MIDDLE"),
+        ]
+    )
+
+    # Create the PDF document
+    doc = SimpleDocTemplate(pdf_tables_path, pagesize=page_size)
+    elements = []
+
+    timesheet = load_parsed_timesheet(xlsx_path, select=lambda name: name in pages)
+    for sheet in timesheet.selected(lambda name: name in pages):
+        for contract in sheet.contracts:
+            # -1 because the headers
+            # Extract the table data as a list of rows
+            table_data = []
+            have_nom = False
+            for row in contract.rows(contract.start - 1, contract.end):
+                row_data = []
+                for index, cell in enumerate(row):
+                    if cell and isinstance(cell, str) and ("Nom, Prenom" in cell or "nom, prenom" in cell):
+                        have_nom = True
+                    if index == 1 and have_nom:
+                        continue
+                    if cell is None and index == 6:
+                        continue
+                    if isinstance(cell, datetime):
+                        cell_value = cell.strftime("%Y-%m-%d")
+                    elif isinstance(cell, float):
+                        cell_value = round(cell, 2)
+                    else:
+                        cell_value = cell
+                    row_data.append(cell_value)
+                table_data.append(row_data)
+
+            # Add the table to the PDF document
+            table = Table(table_data)
+            table.setStyle(table_style)
+            elements.append(table)
+
+            # Add a page break after the table
+            elements.append(PageBreak())
+
+    # Build and save the PDF document
+    doc.build(elements)
+
+
+def merge_invoice_pdf(
+    invoice_pdf_path: str,
+    xlsx_path: Optional[str],
+    pages: List[str],
+    pdf_tables_path: str,
+    output_pdf_path: str,
+) -> None:
+    """
+    Write the invoice followed by the tables of the xlsx, if any, to
+    output_pdf_path. The inputs stay as they are for a retry. Runs in the
+    process pool: it only reads and writes local files.
+    """
+    paths_to_merge = [invoice_pdf_path]
+    if xlsx_path is not None:
+        build_tables_pdf(xlsx_path, pages, pdf_tables_path)
+        paths_to_merge.append(pdf_tables_path)
+
+    merger = PdfMerger()
+    for pdf in paths_to_merge:
+        merger.append(pdf)
+    merger.write(output_pdf_path)
+    merger.close()
+
+
+def fetch_invoice_inputs(event: GenerateFinalPDFWithFile) -> Tuple[str, Optional[str]]:
+    """Local copies of the rendered invoice and, for its tables, of the xlsx."""
+    invoice_pdf_path = fetch_invoice_part(event)
+    if not event.with_tables:
+        return invoice_pdf_path, None
+    xlsx_path = "temp/xlsx/{}.xlsx".format(uuid4().hex)
+    try:
+        fetch_url(event.xlsx_url, xlsx_path)
+    except Exception:
+        remove_file(invoice_pdf_path)
+        raise
+    return invoice_pdf_path, xlsx_path
+
+
+def save_invoice_pdf(event: GenerateFinalPDF, pdf_path: str) -> None:
+    """Store the final invoice PDF and point the file to it."""
+    s3_pdf_url = store_invoice_pdf(event, pdf_path)
+    with get_db_context() as conn:
+        crud.patch_file(
+            db=conn,
+            model_id=event.file_id,
+            update_dict={"s3_pdf_url": s3_pdf_url},
+            current_user_id=event.current_user_id,
+        )
+    remove_invoice_part(event)
+
+
+async def generate_invoice(event: GenerateFinalPDFWithFile) -> bool:
+    """
+    Generate invoice. Only the tables and the merge run in the process pool;
+    the storage and the DB are used from the thread pool of this process.
+    """
     log.info(
         "Generating final invoice PDF",
         extra={
@@ -301,111 +459,32 @@ def generate_invoice(event: GenerateFinalPDFWithFile) -> bool:
             "event": "generate_invoice",
         },
     )
+    local_paths: List[Optional[str]] = []
     try:
-        paths_to_check = [event.path_pdf_invoice]
-        if event.with_tables:
-            paths_to_check.append(event.path_pdf_tables)
-            # Define the page size
-            page_size = letter
-
-            # Define the table style
-            table_style = TableStyle(
-                [
-                    ("BACKGROUND", (0, 0), (-1, 0), colors.HexColor("#333333")),
-                    ("TEXTCOLOR", (0, 0), (-1, 0), colors.HexColor("#ffffff")),
-                    ("ALIGN", (0, 0), (-1, -1), "CENTER"),
-                    ("FONTNAME", (0, 0), (-1, 0), "Helvetica-Bold"),
-                    ("FONTSIZE", (0, 0), (-1, 0), 12),
-                    ("LEADING", (0, 0), (-1, -1), 12),
-                    ("BOTTOMPADDING", (0, 0), (-1, 0), 6),
-                    ("BACKGROUND", (0, 1), (-1, -1), colors.HexColor("#f2f2f2")),
-                    ("GRID", (0, 0), (-1, -1), 1, colors.HexColor("#333333")),
-                    ("GRID", (0, 0), (-1, 0), 2, colors.HexColor("#333333")),
-                    ("GRID", (0, 1), (-1, -1), 1, colors.HexColor("#333333")),
-                    ("VALIGN", (0, 0), (-1, -1), "MIDDLE"),
-                ]
-            )
-
-            # Create the PDF document
-            doc = SimpleDocTemplate(event.path_pdf_tables, pagesize=page_size)
-            elements = []
-
-            # Load the Excel workbook
-            wb = load_workbook(filename=event.xlsx_url, data_only=True)
-
-            # Select the worksheet with the table
-            for sheet_name in wb.sheetnames:
-                if sheet_name not in event.pages:
-                    continue
-                ws = wb[sheet_name]
-
-                ranges = find_ranges(ws)
-                for range_of in ranges:
-                    (_, _, minrow, maxrow) = range_of
-
-                    # -1 because the headers
-                    # Extract the table data as a list of rows
-                    table_data = []
-                    have_nom = False
-                    for row in ws.iter_rows(
-                        min_row=minrow - 1, max_row=maxrow, max_col=7, values_only=True
-                    ):
-                        row_data = []
-                        for index, cell in enumerate(row):
-                            if cell and isinstance(cell, str) and ("Nom, Prenom" in cell or "nom, prenom" in cell):
-                                have_nom = True
-                            if index == 1 and have_nom:
-                                continue
-                            if cell is None and index == 6:
-                                continue
-                            if isinstance(cell, datetime):
-                                cell_value = cell.strftime("%Y-%m-%d")
-                            elif isinstance(cell, float):
-                                cell_value = round(cell, 2)
-                            else:
-                                cell_value = cell
-                            row_data.append(cell_value)
-                        table_data.append(row_data)
-
-                    # Add the table to the PDF document
-                    table = Table(table_data)
-                    table.setStyle(table_style)
-                    elements.append(table)
-
-                    # Add a page break after the table
-                    elements.append(PageBreak())
-
-            # Build and save the PDF document
-            doc.build(elements)
-
-        # Merge the base invoice PDF with the tables PDF if present.
-        merger = PdfMerger()
-        for pdf in paths_to_check:
-            merger.append(pdf)
-        merger.write(event.path_pdf_invoice)
-        merger.close()
+        invoice_pdf_path, xlsx_path = await run_in_thread(fetch_invoice_inputs, event)
+        pdf_tables_path = "temp/pdf/tables_{}.pdf".format(event.file_id)
+        output_pdf_path = "temp/pdf/final_{}".format(event.filename)
+        local_paths.extend(
+            [invoice_pdf_path, xlsx_path, pdf_tables_path, output_pdf_path]
+        )
+        await run_in_process(
+            merge_invoice_pdf,
+            invoice_pdf_path,
+            xlsx_path,
+            event.pages,
+            pdf_tables_path,
+            output_pdf_path,
+        )
 
         log.info(
-            "Uploading invoice PDF to S3",
+            "Storing invoice PDF",
             extra={
                 "customer_id": event.current_user_id,
                 "file_id": event.file_id,
                 "event": "generate_invoice",
             },
         )
-        s3_pdf_url = upload_file(
-            file_path=event.path_pdf_invoice,
-            file_name=event.filename,
-            is_pdf=True,
-            bucket=S3_BUCKET_NAME,
-        )
-        with get_db_context() as conn:
-            crud.patch_file(
-                db=conn,
-                model_id=event.file_id,
-                update_dict={"s3_pdf_url": s3_pdf_url},
-                current_user_id=event.current_user_id,
-            )
+        await run_in_thread(save_invoice_pdf, event, output_pdf_path)
         log.info(
             "Invoice PDF generated",
             extra={
@@ -425,6 +504,10 @@ def generate_invoice(event: GenerateFinalPDFWithFile) -> bool:
             },
         )
         raise
+    finally:
+        for path in local_paths:
+            if path is not None and os.path.exists(path):
+                os.remove(path)
 
 
 def generate_invoice_no_file(event: GenerateFinalPDFNoFile) -> bool:
@@ -439,26 +522,18 @@ def generate_invoice_no_file(event: GenerateFinalPDFNoFile) -> bool:
     )
     try:
         log.info(
-            "Uploading invoice PDF to S3",
+            "Storing invoice PDF",
             extra={
                 "customer_id": event.current_user_id,
                 "file_id": event.file_id,
                 "event": "generate_invoice_no_file",
             },
         )
-        s3_pdf_url = upload_file(
-            file_path=event.path_pdf_invoice,
-            file_name=event.filename,
-            is_pdf=True,
-            bucket=S3_BUCKET_NAME,
-        )
-        with get_db_context() as conn:
-            crud.patch_file(
-                db=conn,
-                model_id=event.file_id,
-                update_dict={"s3_pdf_url": s3_pdf_url},
-                current_user_id=event.current_user_id,
-            )
+        pdf_path = fetch_invoice_part(event)
+        try:
+            save_invoice_pdf(event, pdf_path)
+        finally:
+            remove_file(pdf_path)
         log.info(
             "Invoice PDF generated",
             extra={
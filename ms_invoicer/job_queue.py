@@ -0,0 +1,253 @@
+import asyncio
+import logging
+from contextvars import ContextVar
+from datetime import datetime, timedelta
+from typing import Iterable, List, Optional, Sequence
+
+from sqlalchemy.orm import Session
+
+from ms_invoicer.config import (
+    JOB_LEASE_SECONDS,
+    JOB_MAX_ATTEMPTS,
+    JOB_RETRY_BACKOFF_SECONDS,
+)
+from ms_invoicer.constants import JobStatus, LogEvent
+from ms_invoicer.db_pool import get_db_context
+from ms_invoicer.event_bus import Event, dispatch, event_class
+from ms_invoicer.sql_app import crud, models, schemas
+from ms_invoicer.utils import get_current_date
+
+log = logging.getLogger(__name__)
+
+# Job run by the current task, and the events its handlers published. They
+# are enqueued in the transaction that marks the job done, see complete_job.
+_running_job: ContextVar[Optional[schemas.Job]] = ContextVar("running_job", default=None)
+_next_events: ContextVar[Optional[List[Event]]] = ContextVar("next_events", default=None)
+
+
+def _new_job(event: Event, now: datetime) -> schemas.JobCreate:
+    """Pending job of the event."""
+    return schemas.JobCreate(
+        event_type=event.event_type(),
+        payload=event.to_payload(),
+        chain_key=event.job_key(),
+        status=JobStatus.PENDING.value,
+        attempts=0,
+        max_attempts=JOB_MAX_ATTEMPTS,
+        run_after=now,
+        created=now,
+        updated=now,
+        user_id=getattr(event, "current_user_id", None),
+    )
+
+
+def enqueue(event: Event, db: Optional[Session] = None) -> int:
+    """
+    Store the event as a pending job and return the job id. Given a db, the
+    job is staged in the caller's unit of work: workers only see it once the
+    caller commits, together with the rows it refers to.
+    """
+    if db is None:
+        with get_db_context() as db:
+            return enqueue(event, db=db)
+    job = _new_job(event, get_current_date())
+    new_job = crud.create_job(db=db, model=job)
+    log.info(
+        "Enqueued job",
+        extra={
+            "job_id": new_job.id,
+            "job_type": job.event_type,
+            "chain_key": job.chain_key,
+            "event": LogEvent.ENQUEUE_JOB.value,
+        },
+    )
+    return new_job.id
+
+
+def enqueue_many(events: List[Event], db: Optional[Session] = None) -> List[int]:
+    """Store the events as pending jobs with one INSERT, in order, like enqueue."""
+    if db is None:
+        with get_db_context() as db:
+            return enqueue_many(events, db=db)
+    now = get_current_date()
+    job_ids = crud.create_jobs_bulk(
+        db=db, model_list=[_new_job(event, now) for event in events]
+    )
+    log.info(
+        "Enqueued jobs",
+        extra={"job_count": len(job_ids), "event": LogEvent.ENQUEUE_JOB.value},
+    )
+    return job_ids
+
+
+def claim_next_job() -> Optional[schemas.Job]:
+    """Claim the next runnable job, if any."""
+    now = get_current_date()
+    with get_db_context() as db:
+        job = crud.claim_job(
+            db=db, now=now, locked_until=now + timedelta(seconds=JOB_LEASE_SECONDS)
+        )
+        if job is None:
+            return None
+        return schemas.Job.model_validate(job)
+
+
+def renew_lease(job: schemas.Job) -> bool:
+    """
+    Extend the lease of a job being run for another JOB_LEASE_SECONDS. False
+    when the job is no longer held by this attempt.
+    """
+    now = get_current_date()
+    with get_db_context() as db:
+        return bool(
+            crud.renew_job_lease(
+                db=db,
+                model_id=job.id,
+                attempts=job.attempts,
+                locked_until=now + timedelta(seconds=JOB_LEASE_SECONDS),
+                now=now,
+            )
+        )
+
+
+def retry_delay(attempts: int) -> timedelta:
+    """Exponential backoff before the next attempt of a failed job."""
+    return timedelta(seconds=JOB_RETRY_BACKOFF_SECONDS * 2 ** max(attempts - 1, 0))
+
+
+def _mark_failed(job: schemas.Job, error: str) -> None:
+    """Mark failed."""
+    now = get_current_date()
+    with get_db_context() as db:
+        if job.attempts < job.max_attempts:
+            crud.patch_job(
+                db=db,
+                model_id=job.id,
+                update_dict={
+                    "status": JobStatus.PENDING.value,
+                    "last_error": error,
+                    "run_after": now + retry_delay(job.attempts),
+                    "locked_until": None,
+                    "updated": now,
+                },
+            )
+            return
+        crud.patch_job(
+            db=db,
+            model_id=job.id,
+            update_dict={
+                "status": JobStatus.FAILED.value,
+                "last_error": error,
+                "locked_until": None,
+                "updated": now,
+            },
+        )
+        # Later steps of the same pipeline run can not succeed without this one.
+        if job.chain_key:
+            crud.fail_pending_jobs_by_chain(
+                db=db,
+                chain_key=job.chain_key,
+                update_dict={
+                    "status": JobStatus.FAILED.value,
+                    "last_error": "Previous job {} failed".format(job.id),
+                    "updated": now,
+                },
+            )
+
+
+def running_job() -> Optional[schemas.Job]:
+    """Job run by the current task, None outside of a worker."""
+    return _running_job.get()
+
+
+def defer(event: Event) -> bool:
+    """
+    Keep the event to enqueue it when the running job is marked done, so a
+    retried job does not enqueue it twice. False when no job is running.
+    """
+    events = _next_events.get()
+    if events is None:
+        return False
+    events.append(event)
+    return True
+
+
+def complete_job(db: Session, job: schemas.Job, events: Sequence[Event] = ()) -> None:
+    """
+    Mark the job done and enqueue the next events in db's unit of work. A
+    handler whose last write has to happen once calls it with that write.
+    """
+    crud.patch_job(
+        db=db,
+        model_id=job.id,
+        update_dict={
+            "status": JobStatus.DONE.value,
+            "locked_until": None,
+            "updated": get_current_date(),
+        },
+    )
+    if events:
+        enqueue_many(list(events), db=db)
+
+
+def _mark_done(job: schemas.Job, events: List[Event]) -> None:
+    """Mark done."""
+    with get_db_context() as db:
+        complete_job(db, job, events)
+
+
+async def run_job(job: schemas.Job) -> bool:
+    """
+    Dispatch the job event to its handlers and record the outcome. Recording
+    it runs in a thread like claim_next_job; its errors are raised.
+    """
+    log.info(
+        "Running job",
+        extra={
+            "job_id": job.id,
+            "job_type": job.event_type,
+            "attempt": job.attempts,
+            "event": LogEvent.RUN_JOB.value,
+        },
+    )
+    events: List[Event] = []
+    job_token = _running_job.set(job)
+    events_token = _next_events.set(events)
+    try:
+        event = event_class(job.event_type).from_payload(job.payload)
+        await dispatch(event)
+    except Exception as e:
+        log.exception(
+            "Job failed",
+            extra={
+                "job_id": job.id,
+                "job_type": job.event_type,
+                "attempt": job.attempts,
+                "max_attempts": job.max_attempts,
+                "event": LogEvent.RUN_JOB.value,
+            },
+        )
+        await asyncio.to_thread(_mark_failed, job, error=repr(e))
+        return False
+    finally:
+        _running_job.reset(job_token)
+        _next_events.reset(events_token)
+    await asyncio.to_thread(_mark_done, job, events)
+    return True
+
+
+def combined_status(statuses: Iterable[str]) -> str:
+    """Overall status of several jobs or pipeline runs."""
+    statuses = set(statuses)
+    if JobStatus.FAILED.value in statuses:
+        return JobStatus.FAILED.value
+    if statuses == {JobStatus.DONE.value}:
+        return JobStatus.DONE.value
+    if JobStatus.RUNNING.value in statuses or JobStatus.DONE.value in statuses:
+        return JobStatus.RUNNING.value
+    return JobStatus.PENDING.value
+
+
+def chain_status(jobs: List[models.Job]) -> str:
+    """Overall status of the jobs of one pipeline run."""
+    return combined_status(job.status for job in jobs)
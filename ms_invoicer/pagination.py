@@ -0,0 +1,54 @@
+"""Keyset pagination of the listings.
+
+A listing is sorted by a unique key (id, or number_id then id) and a page
+holds the rows after the key of the previous page's last row. The key is
+handed to clients as an opaque cursor in the X-Next-Cursor header, absent
+on the last page, and sent back as `after`.
+"""
+import base64
+import binascii
+import json
+from typing import Any, Callable, List, Optional, Tuple, TypeVar
+
+from fastapi import HTTPException, status
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+T = TypeVar("T")
+
+
+def encode_cursor(key: Tuple[int, ...]) -> str:
+    """Encode cursor."""
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: Optional[str], size: int) -> Optional[Tuple[int, ...]]:
+    """Key of a cursor of size values, None without cursor."""
+    if cursor is None:
+        return None
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        key = None
+    if (
+        not isinstance(key, list)
+        or len(key) != size
+        or not all(isinstance(value, int) for value in key)
+    ):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Cursor Invalido"
+        )
+    return tuple(key)
+
+
+def page(
+    rows: List[T], limit: int, key: Callable[[T], Tuple[Any, ...]]
+) -> Tuple[List[T], Optional[str]]:
+    """
+    First limit rows of rows, fetched with limit + 1, and the cursor of the
+    next page (None when there is no other row).
+    """
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(key(rows[-1]))
@@ -0,0 +1,381 @@
+"""HTML to PDF renderers.
+
+PDF_RENDERER selects how invoices are rendered:
+
+- "pdfkit" (default): one wkhtmltopdf run per invoice, started by pdfkit.
+- "pool": a pool of long-lived renderer processes. Each one loads its engine
+  once, receives HTML over a pipe and sends the PDF bytes back, so no process
+  is started per invoice. The pool has a bounded wait queue, pings renderers
+  that were idle for a while and replaces a renderer after
+  PDF_RENDERER_MAX_JOBS jobs or when it stops answering.
+
+PDF_RENDERER_ENGINE is the engine used by the pool processes. It has to
+render inside the process: "weasyprint" is the only such engine. The pool
+refuses "wkhtmltopdf", which starts the binary for every invoice.
+"""
+import asyncio
+import logging
+import multiprocessing
+import signal
+import time
+from multiprocessing.connection import Connection
+from typing import Any, Callable, Dict, Optional, Set, Tuple
+
+import pdfkit
+
+from ms_invoicer.config import (
+    PDF_RENDERER,
+    PDF_RENDERER_ENGINE,
+    PDF_RENDERER_HEALTH_CHECK_SECONDS,
+    PDF_RENDERER_MAX_JOBS,
+    PDF_RENDERER_POOL_SIZE,
+    PDF_RENDERER_QUEUE_SIZE,
+    PDF_RENDERER_TIMEOUT_SECONDS,
+    WKHTMLTOPDF_PATH,
+)
+from ms_invoicer.constants import LogEvent, PdfEngine, PdfRendererKind
+from ms_invoicer.executors import run_in_thread
+
+log = logging.getLogger(__name__)
+
+PING_TIMEOUT_SECONDS = 5
+
+# Engines rendering inside the process that loaded them, usable by the pool.
+IN_PROCESS_ENGINES = {PdfEngine.WEASYPRINT.value}
+
+
+def load_engine(engine: str, wkhtmltopdf_path: str) -> Callable[[str], bytes]:
+    """Function rendering HTML to PDF bytes with the given engine."""
+    if engine == PdfEngine.WEASYPRINT:
+        import weasyprint
+
+        return lambda html: weasyprint.HTML(string=html).write_pdf()
+    configuration = pdfkit.configuration(wkhtmltopdf=wkhtmltopdf_path)
+    return lambda html: pdfkit.from_string(html, False, configuration=configuration)
+
+
+def serve(conn: Connection, engine: str, wkhtmltopdf_path: str) -> None:
+    """Main loop of a renderer process."""
+    # Stopping is up to the parent, it closes the pipe or sends "stop".
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    try:
+        render = load_engine(engine, wkhtmltopdf_path)
+        load_error = None
+    except Exception as e:
+        load_error = "Failed to load PDF engine {}: {!r}".format(engine, e)
+
+    while True:
+        try:
+            command, payload = conn.recv()
+        except EOFError:
+            break
+        if command == "stop":
+            break
+        if load_error:
+            conn.send(("error", load_error))
+        elif command == "ping":
+            conn.send(("pong", None))
+        else:
+            try:
+                conn.send(("ok", render(payload)))
+            except Exception as e:
+                conn.send(("error", repr(e)))
+    conn.close()
+
+
+class RendererProcess:
+    """A renderer process and the parent end of its pipe. Calls block."""
+
+    def __init__(self, engine: str) -> None:
+        """Initialize instance."""
+        context = multiprocessing.get_context("spawn")
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=serve,
+            args=(child_conn, engine, WKHTMLTOPDF_PATH),
+            name="invoicer-pdf-renderer",
+            daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+        self.jobs = 0
+        self.last_used = time.monotonic()
+
+    def request(self, command: str, payload: Any, timeout: float) -> Tuple[str, Any]:
+        """Send a command and wait for its answer."""
+        self.conn.send((command, payload))
+        if not self.conn.poll(timeout):
+            raise TimeoutError("PDF renderer did not answer in {}s".format(timeout))
+        return self.conn.recv()
+
+    def render(self, html: str, timeout: float) -> bytes:
+        """Render."""
+        status, data = self.request("render", html, timeout)
+        self.jobs += 1
+        self.last_used = time.monotonic()
+        if status != "ok":
+            raise RuntimeError(data)
+        return data
+
+    def ping(self) -> bool:
+        """Whether the process is alive and answers."""
+        if not self.process.is_alive():
+            return False
+        try:
+            status, _ = self.request("ping", None, PING_TIMEOUT_SECONDS)
+        except (OSError, EOFError, TimeoutError):
+            return False
+        self.last_used = time.monotonic()
+        return status == "pong"
+
+    def close(self) -> None:
+        """Stop the process, killing it if it does not exit."""
+        try:
+            self.conn.send(("stop", None))
+        except OSError:
+            pass
+        self.process.join(timeout=PING_TIMEOUT_SECONDS)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+
+class PdfRenderer:
+    """
+    Base class of the renderers.
+    """
+
+    async def render(self, html: str) -> bytes:
+        """Render HTML to PDF bytes."""
+        raise NotImplementedError
+
+    def health(self) -> Dict[str, Any]:
+        """Health."""
+        return {"renderer": PdfRendererKind.PDFKIT.value}
+
+    def shutdown(self) -> None:
+        """Shutdown."""
+
+
+class PdfkitRenderer(PdfRenderer):
+    """One wkhtmltopdf run per invoice."""
+
+    def __init__(self) -> None:
+        """Initialize instance."""
+        self._render = load_engine(PdfEngine.WKHTMLTOPDF.value, WKHTMLTOPDF_PATH)
+
+    async def render(self, html: str) -> bytes:
+        """Render."""
+        return await run_in_thread(self._render, html)
+
+
+class PooledRenderer(PdfRenderer):
+    """
+    Pool of long-lived renderer processes, started on demand up to size.
+
+    At most queue_size renders wait for a free process, later ones fail
+    right away. State is only changed from the event loop thread.
+    """
+
+    def __init__(
+        self,
+        engine: str,
+        size: int,
+        queue_size: int,
+        max_jobs: int,
+        timeout: float,
+        health_check_seconds: float,
+    ) -> None:
+        """Initialize instance."""
+        if engine not in IN_PROCESS_ENGINES:
+            raise ValueError(
+                "PDF renderer pool needs an in-process engine, not {}".format(engine)
+            )
+        self.engine = engine
+        self.size = size
+        self.queue_size = queue_size
+        self.max_jobs = max_jobs
+        self.timeout = timeout
+        self.health_check_seconds = health_check_seconds
+        self.waiting = 0
+        self.rendered = 0
+        self.failed = 0
+        self.recycled = 0
+        # Started processes plus the ones being started.
+        self._count = 0
+        self._processes: Set[RendererProcess] = set()
+        self._idle: Optional[asyncio.Queue] = None
+
+    async def _start(self) -> RendererProcess:
+        """Start a renderer process in a slot reserved by the caller."""
+        try:
+            renderer = await run_in_thread(RendererProcess, self.engine)
+        except Exception:
+            self._count -= 1
+            raise
+        self._processes.add(renderer)
+        log.info(
+            "Started PDF renderer",
+            extra={"pid": renderer.process.pid, "event": LogEvent.RENDER_PDF.value},
+        )
+        return renderer
+
+    async def _discard(self, renderer: RendererProcess) -> None:
+        """Stop a renderer process and free its slot."""
+        self._count -= 1
+        self._processes.discard(renderer)
+        await run_in_thread(renderer.close)
+
+    async def _refill(self) -> None:
+        """
+        Start a renderer in a freed slot when renders are waiting, they would
+        otherwise wait for their timeout.
+        """
+        if not self.waiting or self._count >= self.size:
+            return
+        self._count += 1
+        try:
+            renderer = await self._start()
+        except Exception:
+            log.exception(
+                "Failed to start PDF renderer",
+                extra={"event": LogEvent.RENDER_PDF.value},
+            )
+            return
+        self._idle.put_nowait(renderer)
+
+    async def _checkout(self) -> RendererProcess:
+        """Take an idle renderer, start one or wait for one."""
+        if self._idle is None:
+            self._idle = asyncio.Queue()
+        if self._idle.empty():
+            if self._count < self.size:
+                self._count += 1
+                return await self._start()
+            if self.waiting >= self.queue_size:
+                raise RuntimeError(
+                    "PDF renderer queue is full ({} waiting)".format(self.waiting)
+                )
+        self.waiting += 1
+        try:
+            return await asyncio.wait_for(self._idle.get(), timeout=self.timeout)
+        finally:
+            self.waiting -= 1
+
+    async def _checkin(self, renderer: RendererProcess) -> None:
+        """Return a renderer to the pool, replacing it when it is used up."""
+        if renderer.jobs >= self.max_jobs:
+            self.recycled += 1
+            await self._discard(renderer)
+            self._count += 1
+            try:
+                renderer = await self._start()
+            except Exception:
+                log.exception(
+                    "Failed to replace PDF renderer",
+                    extra={"event": LogEvent.RENDER_PDF.value},
+                )
+                await self._refill()
+                return
+        self._idle.put_nowait(renderer)
+
+    async def _healthy(self, renderer: RendererProcess) -> RendererProcess:
+        """The renderer if it answers, otherwise a new one in its place."""
+        idle_for = time.monotonic() - renderer.last_used
+        if renderer.process.is_alive() and (
+            idle_for < self.health_check_seconds or await run_in_thread(renderer.ping)
+        ):
+            return renderer
+        log.warning(
+            "Replacing unhealthy PDF renderer",
+            extra={"pid": renderer.process.pid, "event": LogEvent.RENDER_PDF.value},
+        )
+        self.recycled += 1
+        await self._discard(renderer)
+        self._count += 1
+        return await self._start()
+
+    async def render(self, html: str) -> bytes:
+        """Render."""
+        try:
+            renderer = await self._healthy(await self._checkout())
+        except Exception:
+            self.failed += 1
+            # A replacement that failed to start freed its slot.
+            await self._refill()
+            raise
+        try:
+            pdf = await run_in_thread(renderer.render, html, self.timeout)
+        except RuntimeError:
+            # The engine failed on this document, the process is fine.
+            self.failed += 1
+            await self._checkin(renderer)
+            raise
+        except Exception:
+            self.failed += 1
+            await self._discard(renderer)
+            await self._refill()
+            raise
+        self.rendered += 1
+        await self._checkin(renderer)
+        return pdf
+
+    def health(self) -> Dict[str, Any]:
+        """Health."""
+        return {
+            "renderer": PdfRendererKind.POOL.value,
+            "engine": self.engine,
+            "size": self.size,
+            "processes": [
+                {
+                    "pid": renderer.process.pid,
+                    "alive": renderer.process.is_alive(),
+                    "jobs": renderer.jobs,
+                }
+                for renderer in self._processes
+            ],
+            "idle": self._idle.qsize() if self._idle else 0,
+            "waiting": self.waiting,
+            "queue_size": self.queue_size,
+            "rendered": self.rendered,
+            "failed": self.failed,
+            "recycled": self.recycled,
+        }
+
+    def shutdown(self) -> None:
+        """Shutdown."""
+        for renderer in list(self._processes):
+            renderer.close()
+        self._processes.clear()
+        self._count = 0
+        self._idle = None
+
+
+_renderer: Optional[PdfRenderer] = None
+
+
+def get_renderer() -> PdfRenderer:
+    """Renderer selected by PDF_RENDERER, created on first use."""
+    global _renderer
+    if _renderer is None:
+        if PDF_RENDERER == PdfRendererKind.POOL:
+            _renderer = PooledRenderer(
+                engine=PDF_RENDERER_ENGINE,
+                size=PDF_RENDERER_POOL_SIZE,
+                queue_size=PDF_RENDERER_QUEUE_SIZE,
+                max_jobs=PDF_RENDERER_MAX_JOBS,
+                timeout=PDF_RENDERER_TIMEOUT_SECONDS,
+                health_check_seconds=PDF_RENDERER_HEALTH_CHECK_SECONDS,
+            )
+        else:
+            _renderer = PdfkitRenderer()
+    return _renderer
+
+
+def shutdown_renderer() -> None:
+    """Shutdown renderer."""
+    global _renderer
+    if _renderer is not None:
+        _renderer.shutdown()
+        _renderer = None
@@ -3,7 +3,7 @@ from typing import Optional
 from fastapi import APIRouter, Depends, status
 from sqlalchemy.orm import Session
 
-from ms_invoicer.db_pool import get_db
+from ms_invoicer.db_pool import get_db, transaction
 from ms_invoicer.security_helper import get_current_user
 from ms_invoicer.sql_app import crud, schemas
 
@@ -28,7 +28,8 @@ def create_bill_to(
     """
     obj_dict = model.model_dump()
     obj_dict["user_id"] = current_user.id
-    return crud.create_billto(db=db, model=schemas.BillToCreate(**obj_dict))
+    with transaction(db):
+        return crud.create_billto(db=db, model=schemas.BillToCreate(**obj_dict))
 
 
 @router.get("/bill_to", response_model=list[schemas.BillTo])
@@ -63,12 +64,13 @@ def update_billTo(
     }
     """
     update_dict = model.model_dump(exclude_unset=True)
-    result = crud.patch_billto(
-        db=db,
-        model_id=model_id,
-        current_user_id=current_user.id,
-        update_dict=update_dict,
-    )
+    with transaction(db):
+        result = crud.patch_billto(
+            db=db,
+            model_id=model_id,
+            current_user_id=current_user.id,
+            update_dict=update_dict,
+        )
     if result:
         return crud.get_billto(
             db=db, model_id=model_id, current_user_id=current_user.id
@@ -88,4 +90,5 @@ def delete_bill_to(
     Example request:
     DELETE /bill_to/123
     """
-    return crud.patch_billto(db=db, model_id=model_id, current_user_id=current_user.id, update_dict={"user_id": None})
+    with transaction(db):
+        return crud.patch_billto(db=db, model_id=model_id, current_user_id=current_user.id, update_dict={"user_id": None})
@@ -1,34 +1,58 @@
 from typing import Dict, List, Optional, Union
 
-from fastapi import APIRouter, Depends, status, Query
+from fastapi import APIRouter, BackgroundTasks, Depends, Response, status, Query
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from ms_invoicer.config import S3_BUCKET_NAME
+from ms_invoicer.constants import TotalMode
 
-from ms_invoicer.db_pool import get_db
+from ms_invoicer.db_pool import get_async_db, get_db, transaction
+from ms_invoicer.pagination import NEXT_CURSOR_HEADER, decode_cursor, page
 from ms_invoicer.security_helper import get_current_user
-from ms_invoicer.sql_app import crud, schemas
-from ms_invoicer.utils import delete_file_from_s3, s3_key_from_url
+from ms_invoicer.sql_app import async_crud, crud, schemas
+from ms_invoicer.storage import get_storage
 
 router = APIRouter()
 
 
 @router.get("/customer", response_model=schemas.TotalAndCustomer)
 async def get_customers(
+    response: Response,
+    after: Optional[str] = None,
+    limit: int = Query(1000, ge=1, le=1000),
+    total: TotalMode = TotalMode.APPROXIMATE,
     current_user: schemas.User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ) -> schemas.TotalAndCustomer:
-    """List customers with invoice counts.
+    """List customers with invoice counts, by id.
+
+    The total is the database's estimate of the number of customers, set on
+    every page; `total=exact` counts them and `total=none` skips it (total is
+    then null). The cursor of the next page is in the X-Next-Cursor header,
+    pass it as `after`.
 
     Example request:
-    GET /customer
+    GET /customer?limit=100&after=WzEwMF0
     """
-    start = 0
-    return schemas.TotalAndCustomer(
-        total=crud.get_total_customers(db=db, current_user_id=current_user.id),
-        customers=crud.get_customers(
-            db=db, current_user_id=current_user.id, skip=start
+    customers, next_cursor = page(
+        await async_crud.get_customers(
+            db=db,
+            current_user_id=current_user.id,
+            after=decode_cursor(after, 1),
+            limit=limit + 1,
         ),
+        limit,
+        key=lambda customer: (customer["id"],),
     )
+    count = None
+    if total != TotalMode.NONE:
+        count = await async_crud.get_total_customers(
+            db=db,
+            current_user_id=current_user.id,
+            approximate=total == TotalMode.APPROXIMATE,
+        )
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return schemas.TotalAndCustomer(total=count, customers=customers)
 
 
 @router.get("/customer/{model_id}", response_model=Union[schemas.CustomerFull, None])
@@ -47,28 +71,43 @@ def get_customer(
 
 @router.get("/customer/{model_id}/invoices", response_model=schemas.TotalAndInvoices)
 def get_customer_invoices(
+    response: Response,
     model_id: int,
+    after: Optional[str] = None,
+    limit: int = Query(1000, ge=1, le=1000),
+    total: TotalMode = TotalMode.APPROXIMATE,
     current_user: schemas.User = Depends(get_current_user),
     db: Session = Depends(get_db),
 ) -> schemas.TotalAndInvoices:
-    """List invoices for a customer.
+    """List invoices for a customer, newest number first.
+
+    Paged like GET /customer.
 
     Example request:
-    GET /customer/1/invoices
+    GET /customer/1/invoices?limit=50&after=WzEwMDEsIDEwXQ
     """
-    start = 0
-    result =  schemas.TotalAndInvoices(
-        total=crud.get_total_invoices_by_customer(
-            db=db, model_id=model_id, current_user_id=current_user.id
-        ),
-        invoices=crud.get_invoices_by_customer(
+    invoices, next_cursor = page(
+        crud.get_invoices_by_customer(
             db=db,
             model_id=model_id,
             current_user_id=current_user.id,
-            skip=start,
+            after=decode_cursor(after, 2),
+            limit=limit + 1,
         ),
+        limit,
+        key=crud.invoice_page_key,
     )
-    return result
+    count = None
+    if total != TotalMode.NONE:
+        count = crud.get_total_invoices_by_customer(
+            db=db,
+            model_id=model_id,
+            current_user_id=current_user.id,
+            approximate=total == TotalMode.APPROXIMATE,
+        )
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return schemas.TotalAndInvoices(total=count, invoices=invoices)
 
 
 @router.patch("/customer/{model_id}", response_model=Union[schemas.Customer, None])
@@ -86,12 +125,13 @@ def patch_customer(
     }
     """
     update_dict = model_update.model_dump(exclude_unset=True)
-    result = crud.patch_customer(
-        db=db,
-        model_id=model_id,
-        current_user_id=current_user.id,
-        update_dict=update_dict,
-    )
+    with transaction(db):
+        result = crud.patch_customer(
+            db=db,
+            model_id=model_id,
+            current_user_id=current_user.id,
+            update_dict=update_dict,
+        )
     if result:
         return crud.get_customer(
             db=db, model_id=model_id, current_user_id=current_user.id
@@ -103,6 +143,7 @@ def patch_customer(
 @router.delete("/customer/{customer_id}", status_code=status.HTTP_200_OK)
 def delete_customer(
     customer_id: int,
+    background_tasks: BackgroundTasks,
     current_user: schemas.User = Depends(get_current_user),
     db: Session = Depends(get_db),
 ) -> int:
@@ -111,32 +152,25 @@ def delete_customer(
     Example request:
     DELETE /customer/1
     """
-    invoices = crud.get_invoices_by_customer(
-        db=db, model_id=customer_id, current_user_id=current_user.id, skip=0,
-    )
-    files_to_delete: List[str] = []
-    for invoice in invoices:
-        files = crud.get_files_by_invoice(
-            db=db, model_id=invoice.id, current_user_id=current_user.id
-        )
-        for file in files:
-            crud.delete_services_by_file(
-                db=db, model_id=file.id, current_user_id=current_user.id
+    storage = get_storage()
+    with transaction(db):
+        files_to_delete: List[str] = [
+            key
+            for urls in crud.get_cascade_file_urls(
+                db=db, current_user_id=current_user.id, customer_id=customer_id
             )
-            for url in (file.s3_pdf_url, file.s3_xlsx_url):
-                key = s3_key_from_url(url)
-                if key:
-                    files_to_delete.append(key)
-        crud.delete_files_by_invoice(
-            db=db, model_id=invoice.id, current_user_id=current_user.id
+            for key in map(storage.key_from_url, urls)
+            if key
+        ]
+        crud.delete_invoices_cascade(
+            db=db, current_user_id=current_user.id, customer_id=customer_id
         )
-    crud.delete_invoices_by_customer(
-        db=db, model_id=customer_id, current_user_id=current_user.id
-    )
-    delete_file_from_s3(file_names=files_to_delete, bucket_name=S3_BUCKET_NAME)
-    return crud.delete_customer(
-        db=db, model_id=customer_id, current_user_id=current_user.id
-    )
+        result = crud.delete_customer(
+            db=db, model_id=customer_id, current_user_id=current_user.id
+        )
+    # Only once the rows are gone, a failed delete keeps the files.
+    background_tasks.add_task(storage.delete_many, files_to_delete)
+    return result
 
 
 @router.post("/customer", response_model=schemas.Customer)
@@ -154,7 +188,8 @@ def post_customer(
     """
     obj_dict = customer.model_dump()
     obj_dict["user_id"] = current_user.id
-    return crud.create_customer(db=db, model=schemas.CustomerCreate(**obj_dict))
+    with transaction(db):
+        return crud.create_customer(db=db, model=schemas.CustomerCreate(**obj_dict))
 
 
 @router.get("/get_all_customer", response_model=list[schemas.Customer])
@@ -162,14 +197,14 @@ async def get_all_customers(
     current_user: schemas.User = Depends(get_current_user),
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ) -> list[schemas.Customer]:
     """List all customers (admin use).
 
     Example request:
     GET /get_all_customer?skip=0&limit=100
     """
-    return crud.get_all_customers(db=db, skip=skip, limit=limit)
+    return await async_crud.get_all_customers(db=db, skip=skip, limit=limit)
 
 
 @router.patch("/update_customer_data")
@@ -186,15 +221,16 @@ def patch_invoice(
     """
     model_update = {"user_id": new_user_id}
 
-    result = crud.patch_all_customer_by_user_id(
-        db=db,
-        user_id=current_user.id,
-        update_dict=model_update,
-    )
-    result = crud.patch_all_invoice_by_customer_user_id(
-        db=db,
-        customer_id=customer_id,
-        user_id=current_user.id,
-        update_dict=model_update,
-    )
+    with transaction(db):
+        result = crud.patch_all_customer_by_user_id(
+            db=db,
+            user_id=current_user.id,
+            update_dict=model_update,
+        )
+        result = crud.patch_all_invoice_by_customer_user_id(
+            db=db,
+            customer_id=customer_id,
+            user_id=current_user.id,
+            update_dict=model_update,
+        )
     return {"rows affected": result}
@@ -4,19 +4,30 @@ import json
 from typing import Dict, List, Optional, Union
 from pydantic import BaseModel
 
-from fastapi import APIRouter, Depends, Form, UploadFile, status, HTTPException, Body
+from fastapi import APIRouter, BackgroundTasks, Depends, Form, Query, Response, UploadFile, status, HTTPException, Body
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from ms_invoicer.constants import LogEvent
-from ms_invoicer.db_pool import get_db
+from ms_invoicer.config import BATCH_MAX_ITEMS
+from ms_invoicer.constants import JobStatus, LogEvent
+from ms_invoicer.db_pool import async_transaction, get_async_db, get_db, transaction
+from ms_invoicer.event_bus import DispatchError
+from ms_invoicer.executors import run_in_thread
 from ms_invoicer.file_helpers import (
+    create_upload,
     extract_pages,
+    extract_sheets,
     generate_summary_by_date,
+    get_batch_status,
+    process_batch,
     process_file,
     process_pdf,
+    remove_failed_files,
 )
+from ms_invoicer.pagination import NEXT_CURSOR_HEADER, decode_cursor, page
 from ms_invoicer.security_helper import get_current_user
-from ms_invoicer.sql_app import crud, schemas
+from ms_invoicer.sql_app import async_crud, crud, schemas
+from ms_invoicer.storage import get_storage
 from ms_invoicer.utils import get_current_date
 
 router = APIRouter()
@@ -46,15 +57,33 @@ def get_file(
 
 @router.get("/files", response_model=list[schemas.File])
 def get_files(
+    response: Response,
+    after: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000),
     current_user: schemas.User = Depends(get_current_user),
     db: Session = Depends(get_db),
 ) -> list[schemas.File]:
-    """List files for the current user.
+    """List files for the current user, by id.
+
+    The cursor of the next page is in the X-Next-Cursor header, pass it as
+    `after`.
 
     Example request:
-    GET /files
+    GET /files?limit=100&after=WzEwMF0
     """
-    return crud.get_files(db=db, current_user_id=current_user.id)
+    files, next_cursor = page(
+        crud.get_files(
+            db=db,
+            current_user_id=current_user.id,
+            after=decode_cursor(after, 1),
+            limit=limit + 1,
+        ),
+        limit,
+        key=lambda file: (file.id,),
+    )
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return files
 
 
 @router.patch("/files/{model_id}", response_model=Union[schemas.File, None])
@@ -72,12 +101,13 @@ def patch_file(
     }
     """
     update_dict = model_update.model_dump(exclude_unset=True)
-    result = crud.patch_file(
-        db=db,
-        model_id=model_id,
-        update_dict=update_dict,
-        current_user_id=current_user.id,
-    )
+    with transaction(db):
+        result = crud.patch_file(
+            db=db,
+            model_id=model_id,
+            update_dict=update_dict,
+            current_user_id=current_user.id,
+        )
     if result:
         return crud.get_file(db=db, model_id=model_id, current_user_id=current_user.id)
     else:
@@ -96,10 +126,11 @@ def delete_file(
     DELETE /files/1
     """
     file = crud.get_file(db=db, model_id=model_id, current_user_id=current_user.id)
-    crud.delete_services_by_file(
-        db=db, model_id=file.id, current_user_id=current_user.id
-    )
-    return crud.delete_file(db=db, model_id=model_id, current_user_id=current_user.id)
+    with transaction(db):
+        crud.delete_services_by_file(
+            db=db, model_id=file.id, current_user_id=current_user.id
+        )
+        return crud.delete_file(db=db, model_id=model_id, current_user_id=current_user.id)
 
 
 class SummaryRequest(BaseModel):
@@ -112,7 +143,7 @@ class SummaryRequest(BaseModel):
 async def generate_summary(
     summary_request: SummaryRequest = Body(...),
     current_user: schemas.User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ) -> Dict[str, str]:
     """Generate a summary report for a customer and date range.
 
@@ -141,27 +172,118 @@ async def generate_summary(
     return {"s3_file_path": file_path}
 
 
-@router.post("/get_pages", response_model=Dict[str, List[str]])
+@router.post("/get_pages", response_model=schemas.Pages, response_model_exclude_none=True)
 async def get_pages(
     file: UploadFile = Form(),
+    details: bool = False,
     current_user: schemas.User = Depends(get_current_user)
-) -> Dict[str, List[str]]:
+) -> schemas.Pages:
     """Extract sheet names from an uploaded xlsx.
 
+    Only the workbook part of the xlsx is read. With ?details=true every
+    sheet is scanned for its contracts and hours column.
+
     Example response:
     {
       "pages": ["Sheet1", "Sheet2"]
     }
+    Example response with details:
+    {
+      "pages": ["Sheet1"],
+      "sheets": [{"name": "Sheet1", "contracts": 2, "hours_column": "F"}]
+    }
+    """
+    if details:
+        sheets = await run_in_thread(
+            extract_sheets, uploaded_file=file, current_user_id=current_user.id
+        )
+        return schemas.Pages(pages=[sheet.name for sheet in sheets], sheets=sheets)
+    response = await run_in_thread(
+        extract_pages, uploaded_file=file, current_user_id=current_user.id
+    )
+    return schemas.Pages(pages=response)
+
+
+@router.post("/upload", response_model=schemas.Upload)
+async def post_upload(
+    file: UploadFile = Form(),
+    current_user: schemas.User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+) -> schemas.Upload:
+    """Upload an xlsx once: list its sheets, then pass the returned id as
+    upload_id to /generate_pdf instead of sending the file again.
+
+    Example response:
+    {
+      "id": "3f2c9e0a5b7d4c1e8f6a2b9d0c7e4f1a",
+      "sha256": "9f86d081884c7d659a2feaa0c55ad015a3bf4f1b2b0b822cd15d6c15b0f00a08",
+      "size": 48213,
+      "filename": "timesheet.xlsx",
+      "pages": ["Sheet1", "Sheet2"],
+      "created": "2026-01-01T00:00:00"
+    }
+    """
+    return await create_upload(db=db, file=file, current_user_id=current_user.id)
+
+
+@router.get("/upload/{upload_id}", response_model=schemas.Upload)
+async def get_upload(
+    upload_id: str,
+    current_user: schemas.User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+) -> schemas.Upload:
+    """Get an upload.
+
+    Example request:
+    GET /upload/3f2c9e0a5b7d4c1e8f6a2b9d0c7e4f1a
     """
-    response = extract_pages(uploaded_file=file, current_user_id=current_user.id)
-    return {"pages": response}
+    upload = await async_crud.get_upload(
+        db=db, model_id=upload_id, current_user_id=current_user.id
+    )
+    if upload is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Archivo no encontrado"
+        )
+    return upload
+
+
+@router.delete("/upload/{upload_id}", status_code=status.HTTP_200_OK)
+async def delete_upload(
+    upload_id: str,
+    background_tasks: BackgroundTasks,
+    current_user: schemas.User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+) -> int:
+    """Delete an upload. Its xlsx is kept while an invoice file uses it.
+
+    Example request:
+    DELETE /upload/3f2c9e0a5b7d4c1e8f6a2b9d0c7e4f1a
+    """
+    upload = await async_crud.get_upload(
+        db=db, model_id=upload_id, current_user_id=current_user.id
+    )
+    if upload is None:
+        return 0
+    async with async_transaction(db):
+        used = await async_crud.is_xlsx_url_used(
+            db=db, url=upload.s3_xlsx_url, current_user_id=current_user.id
+        )
+        result = await async_crud.delete_upload(
+            db=db, model_id=upload_id, current_user_id=current_user.id
+        )
+    if not used:
+        storage = get_storage()
+        background_tasks.add_task(
+            storage.delete_many, [storage.key_from_url(upload.s3_xlsx_url)]
+        )
+    return result
 
 
 @router.post("/file", response_model=schemas.File)
 async def create_file(
     file: schemas.FileCreate,
     current_user: schemas.User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ) -> schemas.File:
     """Create a file record.
 
@@ -177,8 +299,12 @@ async def create_file(
     """
     obj_dict = file.model_dump()
     obj_dict["user_id"] = current_user.id
-    return crud.create_file(
-        db=db, model=schemas.FileCreate(**obj_dict), current_user_id=current_user.id
+    async with async_transaction(db):
+        new_file = await async_crud.create_file(
+            db=db, model=schemas.FileCreate(**obj_dict)
+        )
+    return await async_crud.get_file_with_relations(
+        db=db, model_id=new_file.id, current_user_id=current_user.id
     )
 
 
@@ -193,11 +319,17 @@ async def generate_pdf(
     invoice: Optional[str] = Form(None),
     contracts: str = Form(),
     pages: str = Form(),
+    upload_id: Optional[str] = Form(None),
     current_user: schemas.User = Depends(get_current_user),
-    db: Session = Depends(get_db),
-) -> schemas.File:
+    db: AsyncSession = Depends(get_async_db),
+) -> schemas.FileWithJob:
     """Generate an invoice PDF (multipart form).
 
+    The PDF is built by the job worker; poll GET /jobs/{job_id} with the
+    returned job_id until it is done, then read s3_pdf_url from the file.
+    The xlsx is the file field or, instead, the upload_id returned by
+    POST /upload.
+
     Example JSON (fields inside the form):
     invoice: {
       "number_id": 1001,
@@ -217,6 +349,7 @@ async def generate_pdf(
     """
     result = None
     new_invoice = None
+    invoice_created = False
 
     try:
         if invoice:
@@ -245,8 +378,18 @@ async def generate_pdf(
     except json.JSONDecodeError:
         raise HTTPException(status_code=400, detail="JSON Invalido")
 
+    upload = None
+    if file is None and upload_id is not None:
+        upload = await async_crud.get_upload(
+            db=db, model_id=upload_id, current_user_id=current_user.id
+        )
+        if upload is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND, detail="Archivo no encontrado"
+            )
+
     if invoice:
-        result = crud.get_invoices_by_number_id(
+        result = await async_crud.get_invoices_by_number_id(
             db=db,
             number_id=invoice.number_id,
             customer_id=invoice.customer_id,
@@ -254,54 +397,61 @@ async def generate_pdf(
         )
 
     if not result:
-        invoice_created = False
         try:
-            if (
-                not invoice
-                and invoice_customer_id is not None
-                and invoice_number_id is not None
-            ):
-                new_invoice = crud.get_invoices_by_number_id(
-                    db=db,
-                    number_id=invoice_number_id,
-                    customer_id=invoice_customer_id,
-                    current_user_id=current_user.id,
-                )
-                if with_taxes is not None and with_tables is not None:
-                    crud.patch_invoice(
+            # One unit of work: the invoice, file, services and jobs are
+            # committed together or not at all.
+            async with async_transaction(db):
+                if (
+                    not invoice
+                    and invoice_customer_id is not None
+                    and invoice_number_id is not None
+                ):
+                    new_invoice = await async_crud.get_invoices_by_number_id(
                         db=db,
-                        model_id=new_invoice.id,
+                        number_id=invoice_number_id,
+                        customer_id=invoice_customer_id,
                         current_user_id=current_user.id,
-                        update_dict={"with_taxes": with_taxes, "with_tables": with_tables},
                     )
-                    new_invoice.with_taxes = with_taxes
-                    new_invoice.with_tables = with_tables
-            else:
-                obj_dict = invoice.model_dump(exclude_unset=True)
-                obj_dict["user_id"] = current_user.id
-                new_invoice = crud.create_invoice(
-                    db=db, model=schemas.InvoiceCreate(**obj_dict)
+                    if with_taxes is not None and with_tables is not None:
+                        await async_crud.patch_invoice(
+                            db=db,
+                            model_id=new_invoice.id,
+                            current_user_id=current_user.id,
+                            update_dict={"with_taxes": with_taxes, "with_tables": with_tables},
+                        )
+                        new_invoice.with_taxes = with_taxes
+                        new_invoice.with_tables = with_tables
+                else:
+                    obj_dict = invoice.model_dump(exclude_unset=True)
+                    obj_dict["user_id"] = current_user.id
+                    new_invoice = await async_crud.create_invoice(
+                        db=db, model=schemas.InvoiceCreate(**obj_dict)
+                    )
+                    invoice_created = True
+
+                file_created, xlsx_url = await process_file(
+                    db=db,
+                    file=file,
+                    invoice_id=int(new_invoice.id),
+                    bill_to_id=int(bill_to_id),
+                    current_user_id=current_user.id,
+                    pages=pages_formatted,
+                    upload=upload,
                 )
-                invoice_created = True
-
-            file_created, xlsx_local_path = await process_file(
-                file=file,
-                invoice_id=int(new_invoice.id),
-                bill_to_id=int(bill_to_id),
-                current_user_id=current_user.id,
-                pages=pages_formatted,
-            )
 
-            return await process_pdf(
-                db=db,
-                invoice=new_invoice,
-                bill_to_id=bill_to_id,
-                contracts=contracts,
-                current_user=current_user,
-                new_file_obj=file_created,
-                xlsx_local_path=xlsx_local_path,
-                pages=pages_formatted,
-            )
+                file_with_job = await process_pdf(
+                    db=db,
+                    invoice=new_invoice,
+                    bill_to_id=bill_to_id,
+                    contracts=contracts,
+                    current_user=current_user,
+                    new_file_obj=file_created,
+                    xlsx_url=xlsx_url,
+                    pages=pages_formatted,
+                )
+            return file_with_job
+        except HTTPException:
+            raise
         except Exception as e:
             log.exception(
                 "Failed to generate invoice from upload",
@@ -311,19 +461,13 @@ async def generate_pdf(
                     "event": LogEvent.CREATE_INVOICE_FROM_FILE.value,
                 },
             )
-            files = crud.get_files_by_invoice(
-                db=db, model_id=new_invoice.id, current_user_id=current_user.id
-            )
-            files = sorted(files, key=lambda x: x.created, reverse=True)
-            if len(files) > 0:
-                crud.delete_services_by_file(
-                    db=db, model_id=files[0].id, current_user_id=current_user.id
-                )
-                crud.delete_file(db=db, model_id=files[0].id, current_user_id=current_user.id)
-
-            if invoice_created:
-                crud.delete_invoice(
-                    db=db, model_id=new_invoice.id, current_user_id=current_user.id
+            if isinstance(e, DispatchError):
+                # Handled in-process after the commit: undo what was created.
+                await run_in_thread(
+                    remove_failed_files,
+                    e.events,
+                    current_user.id,
+                    [new_invoice.id] if invoice_created else [],
                 )
             raise HTTPException(
                 status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
@@ -335,3 +479,134 @@ async def generate_pdf(
             status_code=status.HTTP_409_CONFLICT,
             detail="Existe una factura con ese numéro de factura",
         )
+
+
+@router.post("/generate_pdf/batch", response_model=schemas.BatchResult)
+async def generate_pdf_batch(
+    items: str = Form(),
+    files: Optional[List[UploadFile]] = Form(None),
+    current_user: schemas.User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+) -> schemas.BatchResult:
+    """Generate many invoice PDFs (multipart form).
+
+    Each item creates a new invoice. file_index points to one of the uploaded
+    files, several items can share a file. Every item gets its own result;
+    poll GET /generate_pdf/batch/{batch_id} until the batch is done.
+
+    Example JSON (fields inside the form):
+    items: [
+      {
+        "number_id": 1001,
+        "reason": "Monthly services",
+        "tax_1": 5.0,
+        "tax_2": 9.975,
+        "with_taxes": true,
+        "with_tables": true,
+        "customer_id": 1,
+        "bill_to_id": 1,
+        "contracts": [],
+        "pages": ["Sheet1"],
+        "file_index": 0
+      },
+      {
+        "number_id": 1002,
+        "reason": "Consulting",
+        "with_taxes": false,
+        "customer_id": 2,
+        "bill_to_id": 3,
+        "contracts": [
+          {"title": "Service A", "amount": 100, "currency": "CAD", "hours": 2, "price_unit": 50}
+        ]
+      }
+    ]
+
+    Example response:
+    {
+      "batch_id": "9f1c0e7a51d84c44b6a1f1c3d2e8b7a0",
+      "items": [
+        {"index": 0, "status": "pending", "invoice_id": 10, "file_id": 21, "job_id": 301, "detail": null},
+        {"index": 1, "status": "failed", "invoice_id": null, "file_id": null, "job_id": null,
+         "detail": "Existe una factura con ese numéro de factura"}
+      ]
+    }
+    """
+    try:
+        raw_items = json.loads(items)
+    except json.JSONDecodeError:
+        raise HTTPException(status_code=400, detail="JSON Invalido")
+    if not isinstance(raw_items, list):
+        raise HTTPException(status_code=400, detail="JSON Invalido")
+    if len(raw_items) > BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail="Maximo {} facturas por lote".format(BATCH_MAX_ITEMS),
+        )
+
+    result = None
+    try:
+        async with async_transaction(db):
+            result = await process_batch(
+                db=db, raw_items=raw_items, files=files or [], current_user=current_user
+            )
+        return result
+    except DispatchError as e:
+        # Handled in-process after the commit: undo the invoices that failed
+        # and report them in their items, the others are built.
+        log.exception(
+            "Failed to build invoices of batch",
+            extra={
+                "customer_id": current_user.id,
+                "batch_id": result.batch_id,
+                "failed": len({event.file_id for event in e.events}),
+                "event": LogEvent.CREATE_INVOICE_FROM_FILE.value,
+            },
+        )
+        await run_in_thread(
+            remove_failed_files,
+            e.events,
+            current_user.id,
+            [event.invoice_id for event in e.events if hasattr(event, "invoice_id")],
+        )
+        failed_file_ids = {event.file_id for event in e.events}
+        for item in result.items:
+            if item.file_id in failed_file_ids:
+                item.status = JobStatus.FAILED.value
+                item.detail = "Error al generar la factura"
+                item.invoice_id = None
+                item.file_id = None
+        return result
+    except Exception:
+        log.exception(
+            "Failed to generate invoice batch",
+            extra={
+                "customer_id": current_user.id,
+                "item_count": len(raw_items),
+                "event": LogEvent.CREATE_INVOICE_FROM_FILE.value,
+            },
+        )
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="Error al generar las facturas",
+        )
+
+
+@router.get("/generate_pdf/batch/{batch_id}", response_model=Union[schemas.BatchStatus, None])
+def get_generate_pdf_batch(
+    batch_id: str,
+    current_user: schemas.User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+) -> Optional[schemas.BatchStatus]:
+    """Get the status of every invoice of a batch.
+
+    Example response:
+    {
+      "batch_id": "9f1c0e7a51d84c44b6a1f1c3d2e8b7a0",
+      "status": "running",
+      "items": [
+        {"file_id": 21, "invoice_id": 10, "status": "done", "s3_pdf_url": "https://bucket.s3.amazonaws.com/facture_1001.pdf"},
+        {"file_id": 22, "invoice_id": 11, "status": "pending", "s3_pdf_url": null}
+      ]
+    }
+    """
+    return get_batch_status(db=db, batch_id=batch_id, current_user_id=current_user.id)
@@ -4,7 +4,7 @@ from typing import Optional
 from fastapi import APIRouter, Depends
 from sqlalchemy.orm import Session
 
-from ms_invoicer.db_pool import get_db
+from ms_invoicer.db_pool import get_db, transaction
 from ms_invoicer.security_helper import get_current_user
 from ms_invoicer.sql_app import crud, schemas
 from ms_invoicer.utils import get_current_date
@@ -62,9 +62,10 @@ def update_global(
     )
     if global_var and (global_var.identifier == 1 or global_var.identifier == 2):
         model["value"] = model["value"].replace(",", ".")
-    result = crud.patch_global(
-        db=db, model_id=model_id, current_user_id=current_user.id, update_dict=model
-    )
+    with transaction(db):
+        result = crud.patch_global(
+            db=db, model_id=model_id, current_user_id=current_user.id, update_dict=model
+        )
     if result:
         return crud.get_globals(db=db, current_user_id=current_user.id)
     else:
@@ -1,13 +1,13 @@
 from typing import List, Optional, Union
 
-from fastapi import APIRouter, Depends, status, HTTPException
+from fastapi import APIRouter, BackgroundTasks, Depends, Query, Response, status, HTTPException
 from sqlalchemy.orm import Session
-from ms_invoicer.config import S3_BUCKET_NAME
 
-from ms_invoicer.db_pool import get_db
+from ms_invoicer.db_pool import get_db, transaction
+from ms_invoicer.pagination import NEXT_CURSOR_HEADER, decode_cursor, page
 from ms_invoicer.security_helper import get_current_user
 from ms_invoicer.sql_app import crud, schemas
-from ms_invoicer.utils import delete_file_from_s3, s3_key_from_url
+from ms_invoicer.storage import get_storage
 
 router = APIRouter()
 
@@ -42,7 +42,8 @@ def post_invoice(
     if not result:
         obj_dict = invoice.model_dump()
         obj_dict["user_id"] = current_user.id
-        return crud.create_invoice(db=db, model=schemas.InvoiceCreate(**obj_dict))
+        with transaction(db):
+            return crud.create_invoice(db=db, model=schemas.InvoiceCreate(**obj_dict))
     raise HTTPException(
         status_code=status.HTTP_409_CONFLICT,
         detail="Existe una factura con ese numéro de factura",
@@ -72,12 +73,13 @@ def patch_invoice(
             status_code=status.HTTP_406_NOT_ACCEPTABLE,
             detail="El número de factura debe ser un número",
         )
-    result = crud.patch_invoice(
-        db=db,
-        model_id=model_id,
-        update_dict=update_dict,
-        current_user_id=current_user.id,
-    )
+    with transaction(db):
+        result = crud.patch_invoice(
+            db=db,
+            model_id=model_id,
+            update_dict=update_dict,
+            current_user_id=current_user.id,
+        )
     if result:
         return crud.get_invoice(
             db=db, model_id=model_id, current_user_id=current_user.id
@@ -102,20 +104,38 @@ def get_invoice(
 
 @router.get("/invoice", response_model=List[schemas.Invoice])
 def get_invoice(
+    response: Response,
+    after: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000),
     current_user: schemas.User = Depends(get_current_user),
     db: Session = Depends(get_db),
 ) -> List[schemas.Invoice]:
-    """List invoices for the current user.
+    """List invoices for the current user, newest number first.
+
+    Paged like GET /files.
 
     Example request:
-    GET /invoice
+    GET /invoice?limit=100&after=WzEwMDEsIDEwXQ
     """
-    return crud.get_invoices(db=db, current_user_id=current_user.id)
+    invoices, next_cursor = page(
+        crud.get_invoices(
+            db=db,
+            current_user_id=current_user.id,
+            after=decode_cursor(after, 2),
+            limit=limit + 1,
+        ),
+        limit,
+        key=crud.invoice_page_key,
+    )
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return invoices
 
 
 @router.delete("/invoice/{model_id}", status_code=status.HTTP_200_OK)
 def delete_invoice(
     model_id: int,
+    background_tasks: BackgroundTasks,
     current_user: schemas.User = Depends(get_current_user),
     db: Session = Depends(get_db),
 ) -> int:
@@ -124,22 +144,19 @@ def delete_invoice(
     Example request:
     DELETE /invoice/1
     """
-    files = crud.get_files_by_invoice(
-        db=db, model_id=model_id, current_user_id=current_user.id
-    )
-    files_to_delete: List[str] = []
-    for file in files:
-        crud.delete_services_by_file(
-            db=db, model_id=file.id, current_user_id=current_user.id
+    storage = get_storage()
+    with transaction(db):
+        files_to_delete: List[str] = [
+            key
+            for urls in crud.get_cascade_file_urls(
+                db=db, current_user_id=current_user.id, invoice_id=model_id
+            )
+            for key in map(storage.key_from_url, urls)
+            if key
+        ]
+        result = crud.delete_invoices_cascade(
+            db=db, current_user_id=current_user.id, invoice_id=model_id
         )
-        for url in (file.s3_pdf_url, file.s3_xlsx_url):
-            key = s3_key_from_url(url)
-            if key:
-                files_to_delete.append(key)
-    crud.delete_files_by_invoice(
-        db=db, model_id=model_id, current_user_id=current_user.id
-    )
-    delete_file_from_s3(file_names=files_to_delete, bucket_name=S3_BUCKET_NAME)
-    return crud.delete_invoice(
-        db=db, model_id=model_id, current_user_id=current_user.id
-    )
+    # Only once the rows are gone, a failed delete keeps the files.
+    background_tasks.add_task(storage.delete_many, files_to_delete)
+    return result
@@ -0,0 +1,40 @@
+from typing import Optional, Union
+
+from fastapi import APIRouter, Depends
+from sqlalchemy.orm import Session
+
+from ms_invoicer.db_pool import get_db
+from ms_invoicer.job_queue import chain_status
+from ms_invoicer.security_helper import get_current_user
+from ms_invoicer.sql_app import crud, schemas
+
+router = APIRouter()
+
+
+@router.get("/jobs/{job_id}", response_model=Union[schemas.JobChainStatus, None])
+def get_job_status(
+    job_id: int,
+    current_user: schemas.User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+) -> Optional[schemas.JobChainStatus]:
+    """Get the status of a job and of the jobs chained to it.
+
+    Example request:
+    GET /jobs/1
+
+    Example response:
+    {
+      "id": 1,
+      "status": "running",
+      "steps": [{"id": 1, "event_type": "...PdfToProcessEvent", "status": "done", ...}]
+    }
+    """
+    job = crud.get_job(db=db, model_id=job_id, current_user_id=current_user.id)
+    if not job:
+        return None
+    steps = [job]
+    if job.chain_key:
+        steps = crud.get_jobs_by_chain(
+            db=db, chain_key=job.chain_key, current_user_id=current_user.id
+        )
+    return schemas.JobChainStatus(id=job.id, status=chain_status(steps), steps=steps)
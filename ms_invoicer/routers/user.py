@@ -4,9 +4,10 @@ from typing import List
 from pydantic import BaseModel
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 
-from ms_invoicer.db_pool import get_db
+from ms_invoicer.db_pool import get_db, transaction
 from ms_invoicer.security_helper import (
     authenticate_user,
     create_access_token,
@@ -80,14 +81,23 @@ def create_user(model: dict, db: Session = Depends(get_db)) -> schemas.User:
       "password": "username123"
     }
     """
+    user_exists_exception = HTTPException(
+        status_code=status.HTTP_409_CONFLICT, detail="Usuario ya existe"
+    )
     user = crud.get_user_by_username(db=db, username=model["username"])
+    if user:
+        raise user_exists_exception
     current_date = get_current_date()
-    if not user:
-        model["hashpass"] = get_password_hash(model["password"])
-        model["created"] = current_date
-        model["updated"] = current_date
-        del model["password"]
-    return crud.create_user(db=db, model=schemas.UserCreate(**model))
+    model["hashpass"] = get_password_hash(model["password"])
+    model["created"] = current_date
+    model["updated"] = current_date
+    del model["password"]
+    try:
+        with transaction(db):
+            return crud.create_user(db=db, model=schemas.UserCreate(**model))
+    except IntegrityError:
+        # Created by a concurrent request, see ix_invoicer_user_username.
+        raise user_exists_exception
 
 
 @router.get("/get_all_users", response_model=List[schemas.User])
@@ -1,13 +1,12 @@
-from typing import Any, Dict, Union
+from typing import Any, Dict, List
 
-from fastapi import Depends, APIRouter
+from fastapi import Depends, APIRouter, HTTPException, status
 from sqlalchemy.orm import Session
 
-from ms_invoicer.cache_manager import get_cached_data
+from ms_invoicer.cache_manager import get_cached_data, user_key
 from ms_invoicer.db_pool import get_db
 from ms_invoicer.security_helper import get_current_user
-from ms_invoicer.sql_app import crud, models, schemas
-from ms_invoicer.utils import BreadCrumbs
+from ms_invoicer.sql_app import crud, schemas
 
 
 router = APIRouter()
@@ -26,27 +25,50 @@ def get_default() -> Dict[str, list[Dict[str, object]]]:
     }
 
 
-def object_to_object(
-    object: Union[models.File, models.Invoice, Dict[str, Any]]
-) -> BreadCrumbs:
-    """Object to object."""
-    if isinstance(object, models.File):
-        return BreadCrumbs(
-            value="Contratos",
-            href="/files/{}".format(object.id),
-            required_id=object.invoice_id,
+# First segment of the paths with breadcrumbs, e.g. /files/3.
+PAGE_KINDS = ("customer", "invoice", "files")
+
+
+def resolve_breadcrumbs(
+    db: Session, kind: str, model_id: str, current_user_id: int
+) -> List[Dict[str, object]]:
+    """Options of the page of kind with id model_id, the page being active."""
+    chain = None
+    if model_id.isdigit():
+        chain = crud.get_breadcrumb_chain(
+            db=db, kind=kind, model_id=int(model_id), current_user_id=current_user_id
         )
-    elif isinstance(object, dict):
-        return BreadCrumbs(
-            href="/customer/{}".format(object["id"]),
-            value=object["name"],
+    if chain is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Ruta no encontrada"
         )
-    elif isinstance(object, models.Invoice):
-        return BreadCrumbs(
-            value="Factura {}".format(object.number_id),
-            href="/invoice/{}".format(object.id),
-            required_id=object.customer_id,
+
+    options: List[Dict[str, object]] = [
+        {"value": "Clientes", "href": "/customer", "active": False},
+        {
+            "value": chain["customer_name"],
+            "href": "/customer/{}".format(chain["customer_id"]),
+            "active": False,
+        },
+    ]
+    if "invoice_id" in chain:
+        options.append(
+            {
+                "value": "Factura {}".format(chain["invoice_number"]),
+                "href": "/invoice/{}".format(chain["invoice_id"]),
+                "active": False,
+            }
         )
+    if "file_id" in chain:
+        options.append(
+            {
+                "value": "Contratos",
+                "href": "/files/{}".format(chain["file_id"]),
+                "active": False,
+            }
+        )
+    options[-1]["active"] = True
+    return options
 
 
 @router.post("/breadcrumbs")
@@ -63,124 +85,22 @@ def get_breadcrumbs(
     }
     """
     current_path = data.get("current_path", None)
-    default_result = {
-        "options": [
-            {
-                "value": "Clientes",
-                "href": "/customer",
-                "active": True,
-            },
-        ]
-    }
-
-    key = "default"
+    default_result = get_default()
     if current_path:
         parts = current_path.split("/")[1:]
         if len(parts) == 2:
-            for option in default_result["options"]:
-                option["active"] = False
-            if parts[0] == "customer":
-                key = "user_{}_customer_{}".format(current_user.id, parts[1])
-                breadcrumb = get_cached_data(
-                    key,
-                    fetch_function=lambda: object_to_object(
-                        crud.get_customer(
-                            db=db, model_id=parts[1], current_user_id=current_user.id
-                        )
-                    ),
-                )
-
-                next_option = {
-                    "value": breadcrumb.value,
-                    "href": breadcrumb.href,
-                    "active": True,
-                }
-                default_result["options"].append(next_option)
-            elif parts[0] == "files":
-                key = "user_{}_file_{}".format(current_user.id, parts[1])
-                breadcrumb = get_cached_data(
-                    key,
-                    fetch_function=lambda: object_to_object(
-                        crud.get_file(
-                            db=db, model_id=parts[1], current_user_id=current_user.id
-                        )
-                    ),
-                )
-                next_option3 = {
-                    "value": breadcrumb.value,
-                    "href": breadcrumb.href,
-                    "active": True,
-                }
-
-                key = "user_{}_invoice_{}".format(current_user.id, breadcrumb.required_id)
-                breadcrumb = get_cached_data(
-                    key,
-                    fetch_function=lambda: object_to_object(
-                        crud.get_invoice(
-                            db=db,
-                            model_id=breadcrumb.required_id,
-                            current_user_id=current_user.id,
-                        )
-                    ),
-                )
-                next_option2 = {
-                    "value": breadcrumb.value,
-                    "href": breadcrumb.href,
-                    "active": False,
-                }
-
-                key = "user_{}_customer_{}".format(current_user.id, breadcrumb.required_id)
-                breadcrumb = get_cached_data(
-                    key,
-                    fetch_function=lambda: object_to_object(
-                        crud.get_customer(
-                            db=db,
-                            model_id=breadcrumb.required_id,
-                            current_user_id=current_user.id,
-                        )
-                    ),
-                )
-
-                next_option1 = {
-                    "value": breadcrumb.value,
-                    "href": breadcrumb.href,
-                    "active": False,
-                }
-                default_result["options"].append(next_option1)
-                default_result["options"].append(next_option2)
-                default_result["options"].append(next_option3)
-            elif parts[0] == "invoice":
-                key = "user_{}_invoice_{}".format(current_user.id, parts[1])
-                breadcrumb = get_cached_data(
-                    key,
-                    fetch_function=lambda: object_to_object(
-                        crud.get_invoice(
-                            db=db, model_id=parts[1], current_user_id=current_user.id
-                        )
-                    ),
-                )
-                next_option2 = {
-                    "value": breadcrumb.value,
-                    "href": breadcrumb.href,
-                    "active": True,
-                }
-
-                key = "user_{}_customer_{}".format(current_user.id, breadcrumb.required_id)
-                breadcrumb = get_cached_data(
+            if parts[0] not in PAGE_KINDS:
+                for option in default_result["options"]:
+                    option["active"] = False
+                return default_result
+            # The whole chain is one entry, dropped when the user changes data.
+            key = user_key(current_user.id, "breadcrumbs", parts[0], parts[1])
+            return {
+                "options": get_cached_data(
                     key,
-                    fetch_function=lambda: object_to_object(
-                        crud.get_customer(
-                            db=db,
-                            model_id=breadcrumb.required_id,
-                            current_user_id=current_user.id,
-                        )
+                    fetch_function=lambda: resolve_breadcrumbs(
+                        db, parts[0], parts[1], current_user.id
                     ),
                 )
-                next_option1 = {
-                    "value": breadcrumb.value,
-                    "href": breadcrumb.href,
-                    "active": False,
-                }
-                default_result["options"].append(next_option1)
-                default_result["options"].append(next_option2)
+            }
     return default_result
@@ -0,0 +1,62 @@
+import threading
+from typing import Any, Optional
+
+import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+
+from ms_invoicer.config import (
+    S3_ACCESS_KEY,
+    S3_ENDPOINT_URL,
+    S3_MAX_CONCURRENCY,
+    S3_MAX_POOL_CONNECTIONS,
+    S3_MULTIPART_CHUNKSIZE_MB,
+    S3_MULTIPART_THRESHOLD_MB,
+    S3_SECRET_ACCESS_KEY,
+)
+
+MB = 1024 * 1024
+
+# Multipart settings of upload_fileobj/download_file, shared by every transfer.
+transfer_config = TransferConfig(
+    multipart_threshold=S3_MULTIPART_THRESHOLD_MB * MB,
+    multipart_chunksize=S3_MULTIPART_CHUNKSIZE_MB * MB,
+    max_concurrency=S3_MAX_CONCURRENCY,
+)
+
+_client: Optional[Any] = None
+_lock = threading.Lock()
+
+
+def get_s3_client() -> Any:
+    """
+    S3 client of the process, created on first use.
+
+    boto3 clients are thread-safe, so the thread pool, the background tasks
+    and the transfer threads share its credentials and connection pool.
+    """
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                _client = boto3.session.Session().client(
+                    "s3",
+                    aws_access_key_id=S3_ACCESS_KEY,
+                    aws_secret_access_key=S3_SECRET_ACCESS_KEY,
+                    # S3-compatible servers are addressed by path.
+                    endpoint_url=S3_ENDPOINT_URL or None,
+                    config=Config(
+                        max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+                        s3={"addressing_style": "path"} if S3_ENDPOINT_URL else None,
+                    ),
+                )
+    return _client
+
+
+def close_s3_client() -> None:
+    """Close the connections of the client."""
+    global _client
+    with _lock:
+        if _client is not None:
+            _client.close()
+            _client = None
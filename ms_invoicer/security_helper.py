@@ -1,5 +1,5 @@
 from datetime import datetime, timedelta
-from typing import Any, Dict, Union
+from typing import Any, Dict, Optional, Union
 
 from fastapi import Depends, Header, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
@@ -7,6 +7,7 @@ from jose import JWTError, jwt
 from passlib.context import CryptContext
 from sqlalchemy.orm import Session
 
+from ms_invoicer.cache_manager import get_principal
 from ms_invoicer.config import ALGORITHM, SECRET_KEY
 from ms_invoicer.db_pool import get_db
 from ms_invoicer.sql_app import crud, schemas
@@ -54,10 +55,22 @@ def get_payload_from_header(authorization: str = Header(...)) -> Dict[str, Any]:
     return payload
 
 
+def load_principal(db: Session, username: str) -> Optional[Dict[str, Any]]:
+    """Id and username of the user, None if it does not exist."""
+    user = crud.get_user_by_username(db=db, username=username)
+    if user is None:
+        return None
+    return {"id": user.id, "username": user.username}
+
+
 def get_current_user(
     token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)
 ) -> schemas.User:
-    """Get current user."""
+    """
+    Get current user. The user of a subject is cached for a short time, see
+    cache_manager, so most requests do not query the database to
+    authenticate; the session of db is not connected until it is used.
+    """
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -69,10 +82,13 @@ def get_current_user(
         if username is None:
             raise credentials_exception
         token_data = schemas.TokenData(username=username)
-        user = crud.get_user_by_username(db=db, username=token_data.username)
-        if user is None:
+        principal = get_principal(
+            token_data.username,
+            lambda: load_principal(db=db, username=token_data.username),
+        )
+        if principal is None:
             raise credentials_exception
-        return user
+        return schemas.User(**principal)
     except JWTError:
         raise credentials_exception
 
@@ -0,0 +1,307 @@
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import delete, desc, func, insert, select, tuple_, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload, selectinload
+
+from ms_invoicer.cache_manager import invalidate_user_on_commit
+from ms_invoicer.sql_app import models, schemas
+from ms_invoicer.sql_app.crud import (
+    customers_with_invoice_count,
+    estimate_statement,
+    plan_rows,
+)
+
+# Same functions as ms_invoicer.sql_app.crud for the async endpoints. Writes
+# are only flushed, the caller commits them once with
+# ms_invoicer.db_pool.async_transaction. An AsyncSession can not lazy load,
+# relationships that are serialized are loaded with the query.
+
+
+# Customer ----------------------------------------------------------
+async def get_customer(
+    db: AsyncSession, model_id: int, current_user_id: int
+) -> Optional[Dict[str, Any]]:
+    """Get customer."""
+    query_results = (
+        await db.execute(
+            customers_with_invoice_count(current_user_id).filter(
+                models.Customer.id == model_id
+            )
+        )
+    ).first()
+    if query_results is None:
+        return None
+    return {
+        "id": query_results.id,
+        "name": query_results.name,
+        "num_invoices": query_results.num_invoices,
+    }
+
+
+async def get_customers(
+    db: AsyncSession,
+    current_user_id: int,
+    after: Optional[Tuple[int]] = None,
+    limit: int = 1000,
+) -> List[Dict[str, Any]]:
+    """Get customers, by id."""
+    statement = customers_with_invoice_count(current_user_id)
+    if after:
+        statement = statement.filter(models.Customer.id > after[0])
+    query_results = await db.execute(
+        statement.order_by(models.Customer.id).limit(limit)
+    )
+    return [
+        {"id": id, "name": name, "num_invoices": num_invoices}
+        for id, name, num_invoices in query_results
+    ]
+
+
+async def get_total_customers(
+    db: AsyncSession, current_user_id: int, approximate: bool = False
+) -> int:
+    """Get total customers, estimated by the planner when approximate."""
+    statement = select(models.Customer.id).filter(
+        models.Customer.user_id == current_user_id
+    )
+    estimate = (
+        estimate_statement(statement, db.get_bind().dialect) if approximate else None
+    )
+    if estimate is not None:
+        return plan_rows(await db.scalar(estimate))
+    return await db.scalar(statement.with_only_columns(func.count()))
+
+
+async def get_all_customers(
+    db: AsyncSession, skip: int = 0, limit: int = 100
+) -> List[models.Customer]:
+    """Get all customers."""
+    result = await db.scalars(select(models.Customer).offset(skip).limit(limit))
+    return list(result)
+
+
+# File ----------------------------------------------------------
+async def get_file(
+    db: AsyncSession, model_id: int, current_user_id: int
+) -> Optional[models.File]:
+    """Get file."""
+    return await db.scalar(
+        select(models.File).filter(
+            models.File.id == model_id, models.File.user_id == current_user_id
+        )
+    )
+
+
+async def get_file_with_relations(
+    db: AsyncSession, model_id: int, current_user_id: int
+) -> Optional[models.File]:
+    """Get file with the bill_to and services of schemas.File."""
+    return await db.scalar(
+        select(models.File)
+        .options(
+            selectinload(models.File.services),
+            joinedload(models.File.bill_to),
+        )
+        .filter(models.File.id == model_id, models.File.user_id == current_user_id)
+    )
+
+
+async def create_file(db: AsyncSession, model: schemas.FileCreate) -> models.File:
+    """Create file."""
+    db_model = models.File(**model.model_dump())
+    db.add(db_model)
+    await db.flush()
+    return db_model
+
+
+async def create_files_bulk(
+    db: AsyncSession, model_list: List[schemas.FileCreate]
+) -> List[int]:
+    """Create files with a single INSERT, returning their ids in the order given."""
+    if not model_list:
+        return []
+    result = await db.scalars(
+        insert(models.File).returning(models.File.id, sort_by_parameter_order=True),
+        [model.model_dump() for model in model_list],
+    )
+    return list(result)
+
+
+# Service ----------------------------------------------------------
+async def create_services_bulk(
+    db: AsyncSession, model_list: List[schemas.ServiceCreate]
+) -> List[int]:
+    """Create services with a single INSERT, returning their ids in the order given."""
+    if not model_list:
+        return []
+    result = await db.scalars(
+        insert(models.Service).returning(models.Service.id, sort_by_parameter_order=True),
+        [model.model_dump() for model in model_list],
+    )
+    return list(result)
+
+
+# Invoice ----------------------------------------------------------
+async def get_summary_files(
+    db: AsyncSession,
+    customer_id: int,
+    current_user_id: int,
+    start_date: datetime,
+    end_date: datetime,
+) -> List[models.File]:
+    """
+    Latest file of each invoice of the customer created in the date range,
+    by invoice id, in one query.
+    """
+    latest = (
+        select(
+            models.File.id,
+            func.row_number()
+            .over(
+                partition_by=models.File.invoice_id,
+                order_by=(desc(models.File.created), desc(models.File.id)),
+            )
+            .label("position"),
+        )
+        .join(models.Invoice, models.File.invoice_id == models.Invoice.id)
+        .filter(
+            models.Invoice.customer_id == customer_id,
+            models.Invoice.user_id == current_user_id,
+            models.Invoice.created.between(start_date, end_date),
+            models.File.user_id == current_user_id,
+        )
+        .subquery()
+    )
+    result = await db.scalars(
+        select(models.File)
+        .join(latest, models.File.id == latest.c.id)
+        .filter(latest.c.position == 1)
+        .order_by(models.File.invoice_id)
+    )
+    return list(result)
+
+
+async def get_invoices_by_number_id(
+    db: AsyncSession, number_id: int, customer_id: int, current_user_id: int
+) -> Optional[models.Invoice]:
+    """Get invoices by number id."""
+    result = await db.scalars(
+        select(models.Invoice).filter(
+            models.Invoice.number_id == number_id,
+            models.Invoice.user_id == current_user_id,
+            models.Invoice.customer_id == customer_id,
+        )
+    )
+    return result.first()
+
+
+async def get_invoices_by_number_ids(
+    db: AsyncSession, keys: List[Tuple[int, int]], current_user_id: int
+) -> List[models.Invoice]:
+    """Get the invoices matching any of the (customer_id, number_id) keys."""
+    if not keys:
+        return []
+    result = await db.scalars(
+        select(models.Invoice).filter(
+            models.Invoice.user_id == current_user_id,
+            tuple_(models.Invoice.customer_id, models.Invoice.number_id).in_(keys),
+        )
+    )
+    return list(result)
+
+
+async def patch_invoice(
+    db: AsyncSession, model_id: int, current_user_id: int, update_dict: dict
+) -> int:
+    """Patch invoice."""
+    invalidate_user_on_commit(db.sync_session, current_user_id)
+    result = await db.execute(
+        update(models.Invoice)
+        .filter(
+            models.Invoice.id == model_id, models.Invoice.user_id == current_user_id
+        )
+        .values(update_dict)
+    )
+    return result.rowcount
+
+
+async def create_invoice(
+    db: AsyncSession, model: schemas.InvoiceCreate
+) -> models.Invoice:
+    """Create invoice."""
+    db_model = models.Invoice(**model.model_dump())
+    db.add(db_model)
+    await db.flush()
+    return db_model
+
+
+async def create_invoices_bulk(
+    db: AsyncSession, model_list: List[schemas.InvoiceCreate]
+) -> List[int]:
+    """Create invoices with a single INSERT, returning their ids in the order given."""
+    if not model_list:
+        return []
+    result = await db.scalars(
+        insert(models.Invoice).returning(models.Invoice.id, sort_by_parameter_order=True),
+        [model.model_dump() for model in model_list],
+    )
+    return list(result)
+
+
+# Upload ----------------------------------------------------------
+async def get_upload(
+    db: AsyncSession, model_id: str, current_user_id: int
+) -> Optional[models.Upload]:
+    """Get upload."""
+    return await db.scalar(
+        select(models.Upload).filter(
+            models.Upload.id == model_id, models.Upload.user_id == current_user_id
+        )
+    )
+
+
+async def get_upload_by_sha256(
+    db: AsyncSession, sha256: str, current_user_id: int
+) -> Optional[models.Upload]:
+    """Get upload by sha256."""
+    return await db.scalar(
+        select(models.Upload).filter(
+            models.Upload.sha256 == sha256, models.Upload.user_id == current_user_id
+        )
+    )
+
+
+async def create_upload(db: AsyncSession, model: schemas.UploadCreate) -> models.Upload:
+    """Create upload."""
+    db_model = models.Upload(**model.model_dump())
+    db.add(db_model)
+    await db.flush()
+    return db_model
+
+
+async def delete_upload(db: AsyncSession, model_id: str, current_user_id: int) -> int:
+    """Delete upload."""
+    result = await db.execute(
+        delete(models.Upload).filter(
+            models.Upload.id == model_id, models.Upload.user_id == current_user_id
+        )
+    )
+    return result.rowcount
+
+
+async def is_xlsx_url_used(db: AsyncSession, url: str, current_user_id: int) -> bool:
+    """Whether a file of the user still points at the xlsx url."""
+    return bool(
+        await db.scalar(
+            select(
+                select(models.File.id)
+                .filter(
+                    models.File.s3_xlsx_url == url,
+                    models.File.user_id == current_user_id,
+                )
+                .exists()
+            )
+        )
+    )
@@ -1,11 +1,50 @@
+import json
 from datetime import datetime
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
-from sqlalchemy.orm import Session, joinedload
-from sqlalchemy import desc, func
+from sqlalchemy.engine import Dialect
+from sqlalchemy.orm import Query, Session, aliased, joinedload
+from sqlalchemy import Select, TextClause, and_, case, desc, func, insert, or_, select, text, tuple_
 
+from ms_invoicer.cache_manager import invalidate_user_on_commit
+from ms_invoicer.constants import JobStatus
 from ms_invoicer.sql_app import models, schemas
 
+# Writes are only flushed, the caller commits them once with
+# ms_invoicer.db_pool.transaction (or get_db_context).
+# Listings are paged by key: `after` is the sort key of the last row of the
+# previous page, see ms_invoicer.pagination.
+
+
+# Counts ----------------------------------------------------------
+def estimate_statement(statement: Select, dialect: Dialect) -> Optional[TextClause]:
+    """
+    EXPLAIN of statement, its plan holds the planner's estimate of the number
+    of rows. None when the database gives no estimate.
+    """
+    if dialect.name != "postgresql":
+        return None
+    compiled = statement.compile(dialect=dialect, compile_kwargs={"literal_binds": True})
+    return text("EXPLAIN (FORMAT JSON) {}".format(compiled))
+
+
+def plan_rows(plan: Any) -> int:
+    """Estimated rows of an EXPLAIN (FORMAT JSON) result."""
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+def count(db: Session, query: Query, approximate: bool = False) -> int:
+    """Number of rows of query, estimated by the planner when approximate."""
+    estimate = (
+        estimate_statement(query.statement, db.get_bind().dialect)
+        if approximate
+        else None
+    )
+    if estimate is not None:
+        return plan_rows(db.execute(estimate).scalar())
+    return query.order_by(None).with_entities(func.count()).scalar()
 
 # Template ----------------------------------------------------------
 def get_templates(db: Session, current_user_id: int) -> List[models.Template]:
@@ -32,8 +71,7 @@ def create_template(db: Session, model: schemas.TemplateCreate) -> models.Templa
     """Create template."""
     db_model = models.Template(**model.model_dump())
     db.add(db_model)
-    db.commit()
-    db.refresh(db_model)
+    db.flush()
     return db_model
 
 
@@ -56,7 +94,6 @@ def patch_topinfo(
         )
         .update(update_dict)
     )
-    db.commit()
     return result
 
 
@@ -64,8 +101,7 @@ def create_topinfo(db: Session, model: schemas.TopInfoCreate) -> models.TopInfo:
     """Create topinfo."""
     db_model = models.TopInfo(**model.model_dump())
     db.add(db_model)
-    db.commit()
-    db.refresh(db_model)
+    db.flush()
     return db_model
 
 
@@ -113,7 +149,6 @@ def patch_global(
         )
         .update(update_dict)
     )
-    db.commit()
     return result
 
 
@@ -121,73 +156,97 @@ def create_global(db: Session, model: schemas.GlobalCreate) -> models.Globals:
     """Create global."""
     db_model = models.Globals(**model.model_dump())
     db.add(db_model)
-    db.commit()
-    db.refresh(db_model)
+    db.flush()
     return db_model
 
 
 # Customer ----------------------------------------------------------
-def get_customer(db: Session, model_id: int, current_user_id: int) -> Dict[str, Any]:
-    """Get customer."""
-    invoice_count_subquery = (
-        db.query(
-            models.Invoice.customer_id,
-            func.count(models.Invoice.id).label("num_invoices"),
-        )
-        .group_by(models.Invoice.customer_id)
-        .subquery()
+def customers_with_invoice_count(current_user_id: int) -> Select:
+    """
+    Id, name and number of invoices of the customers of the user. The count
+    is a correlated subquery, so only the invoices of the selected customers
+    are counted (through ix_invoices_customer_id).
+    """
+    num_invoices = (
+        select(func.count(models.Invoice.id))
+        .filter(models.Invoice.customer_id == models.Customer.id)
+        .correlate(models.Customer)
+        .scalar_subquery()
     )
+    return select(
+        models.Customer.id,
+        models.Customer.name,
+        num_invoices.label("num_invoices"),
+    ).filter(models.Customer.user_id == current_user_id)
 
-    query_results = (
-        db.query(
-            models.Customer.id,
-            models.Customer.name,
-            func.coalesce(invoice_count_subquery.c.num_invoices, 0).label(
-                "num_invoices"
-            ),
-        )
-        .outerjoin(
-            invoice_count_subquery,
-            models.Customer.id == invoice_count_subquery.c.customer_id,
+
+def get_customer(
+    db: Session, model_id: int, current_user_id: int
+) -> Optional[Dict[str, Any]]:
+    """Get customer."""
+    query_results = db.execute(
+        customers_with_invoice_count(current_user_id).filter(
+            models.Customer.id == model_id
         )
-        .filter(models.Customer.user_id == current_user_id, models.Customer.id == model_id)
-        .first()
-    )
+    ).first()
+    if query_results is None:
+        return None
     return {"id": query_results.id, "name": query_results.name, "num_invoices": query_results.num_invoices}
-    
+
+
+def get_breadcrumb_chain(
+    db: Session, kind: str, model_id: int, current_user_id: int
+) -> Optional[Dict[str, Any]]:
+    """
+    Customer, invoice and file above a page of kind "customer", "invoice" or
+    "files", in one joined query. Only the levels of the page are returned,
+    e.g. an invoice gives customer_id, customer_name, invoice_id and
+    invoice_number.
+    """
+    columns = [
+        models.Customer.id.label("customer_id"),
+        models.Customer.name.label("customer_name"),
+    ]
+    if kind == "customer":
+        statement = select(*columns).filter(models.Customer.id == model_id)
+    else:
+        columns += [
+            models.Invoice.id.label("invoice_id"),
+            models.Invoice.number_id.label("invoice_number"),
+        ]
+        if kind == "invoice":
+            statement = (
+                select(*columns)
+                .select_from(models.Invoice)
+                .filter(models.Invoice.id == model_id)
+            )
+        else:
+            statement = (
+                select(*columns, models.File.id.label("file_id"))
+                .select_from(models.File)
+                .join(models.Invoice, models.File.invoice_id == models.Invoice.id)
+                .filter(models.File.id == model_id)
+            )
+        statement = statement.join(
+            models.Customer, models.Invoice.customer_id == models.Customer.id
+        )
+    row = db.execute(
+        statement.filter(models.Customer.user_id == current_user_id)
+    ).first()
+    return None if row is None else row._asdict()
 
 
 def get_customers(
-    db: Session, current_user_id: int, skip: int = 0, limit: int = 1000
+    db: Session,
+    current_user_id: int,
+    after: Optional[Tuple[int]] = None,
+    limit: int = 1000,
 ) -> List[Dict[str, Any]]:
-    # Define the subquery for counting invoices
-    """Get customers."""
-    invoice_count_subquery = (
-        db.query(
-            models.Invoice.customer_id,
-            func.count(models.Invoice.id).label("num_invoices"),
-        )
-        .group_by(models.Invoice.customer_id)
-        .subquery()
-    )
-
-    query_results = (
-        db.query(
-            models.Customer.id,
-            models.Customer.name,
-            func.coalesce(invoice_count_subquery.c.num_invoices, 0).label(
-                "num_invoices"
-            ),
-        )
-        .outerjoin(
-            invoice_count_subquery,
-            models.Customer.id == invoice_count_subquery.c.customer_id,
-        )
-        .filter(models.Customer.user_id == current_user_id)
-        .offset(skip)
-        .limit(limit)
-        .all()
-    )
+    """Get customers, by id."""
+    statement = customers_with_invoice_count(current_user_id)
+    if after:
+        statement = statement.filter(models.Customer.id > after[0])
+    query_results = db.execute(statement.order_by(models.Customer.id).limit(limit))
     # Transform query results into a list of dictionaries
     return [
         {"id": id, "name": name, "num_invoices": num_invoices}
@@ -195,12 +254,14 @@ def get_customers(
     ]
 
 
-def get_total_customers(db: Session, current_user_id: int) -> int:
+def get_total_customers(
+    db: Session, current_user_id: int, approximate: bool = False
+) -> int:
     """Get total customers."""
-    return (
-        db.query(func.count(models.Customer.id))
-        .filter(models.Customer.user_id == current_user_id)
-        .scalar()
+    return count(
+        db,
+        db.query(models.Customer.id).filter(models.Customer.user_id == current_user_id),
+        approximate=approximate,
     )
 
 
@@ -215,6 +276,7 @@ def patch_customer(
     db: Session, model_id: int, current_user_id: int, update_dict: dict
 ) -> int:
     """Patch customer."""
+    invalidate_user_on_commit(db, current_user_id)
     result = (
         db.query(models.Customer)
         .filter(
@@ -222,7 +284,6 @@ def patch_customer(
         )
         .update(update_dict)
     )
-    db.commit()
     return result
 
 
@@ -230,17 +291,18 @@ def patch_all_customer_by_user_id(
     db: Session, user_id: int, update_dict: dict
 ) -> int:
     """Patch all customer by user id."""
+    invalidate_user_on_commit(db, user_id)
     result = (
         db.query(models.Customer)
         .filter(models.Customer.user_id == user_id)
         .update(update_dict)
     )
-    db.commit()
     return result
 
 
 def delete_customer(db: Session, model_id: int, current_user_id: int) -> int:
     """Delete customer."""
+    invalidate_user_on_commit(db, current_user_id)
     result = (
         db.query(models.Customer)
         .filter(
@@ -248,7 +310,6 @@ def delete_customer(db: Session, model_id: int, current_user_id: int) -> int:
         )
         .delete()
     )
-    db.commit()
     return result
 
 
@@ -256,8 +317,7 @@ def create_customer(db: Session, model: schemas.CustomerCreate) -> Dict[str, Any
     """Create customer."""
     db_model = models.Customer(**model.model_dump())
     db.add(db_model)
-    db.commit()
-    db.refresh(db_model)
+    db.flush()
     return {"id": db_model.id, "name": db_model.name, "num_invoices": 0}
 
 
@@ -287,19 +347,50 @@ def get_file_with_relations(
     )
 
 
-def get_files(
-    db: Session, current_user_id: int, skip: int = 0, limit: int = 100
-) -> List[models.File]:
-    """Get files."""
+def get_file_render_data(
+    db: Session, file_id: int, invoice_id: int, current_user_id: int
+) -> Optional[Tuple[models.File, models.Invoice, Optional[models.TopInfo]]]:
+    """
+    File with its bill_to and services, its invoice and the first top info of
+    the user, in one query.
+    """
+    first_topinfo_id = (
+        select(func.min(models.TopInfo.id))
+        .filter(models.TopInfo.user_id == current_user_id)
+        .scalar_subquery()
+    )
     return (
-        db.query(models.File)
-        .filter(models.File.user_id == current_user_id)
-        .offset(skip)
-        .limit(limit)
-        .all()
+        db.query(models.File, models.Invoice, models.TopInfo)
+        .select_from(models.File)
+        .options(
+            joinedload(models.File.services),
+            joinedload(models.File.bill_to),
+        )
+        .join(models.Invoice, models.Invoice.id == models.File.invoice_id)
+        .outerjoin(models.TopInfo, models.TopInfo.id == first_topinfo_id)
+        .filter(
+            models.File.id == file_id,
+            models.File.user_id == current_user_id,
+            models.Invoice.id == invoice_id,
+            models.Invoice.user_id == current_user_id,
+        )
+        .first()
     )
 
 
+def get_files(
+    db: Session,
+    current_user_id: int,
+    after: Optional[Tuple[int]] = None,
+    limit: int = 100,
+) -> List[models.File]:
+    """Get files, by id."""
+    query = db.query(models.File).filter(models.File.user_id == current_user_id)
+    if after:
+        query = query.filter(models.File.id > after[0])
+    return query.order_by(models.File.id).limit(limit).all()
+
+
 def get_files_by_invoice(
     db: Session, model_id: int, current_user_id: int
 ) -> List[models.File]:
@@ -318,12 +409,12 @@ def patch_file(
     db: Session, model_id: int, current_user_id: int, update_dict: dict
 ) -> int:
     """Patch file."""
+    invalidate_user_on_commit(db, current_user_id)
     result = (
         db.query(models.File)
         .filter(models.File.id == model_id, models.File.user_id == current_user_id)
         .update(update_dict)
     )
-    db.commit()
     return result
 
 
@@ -331,28 +422,29 @@ def patch_all_files_by_invoice_user_id(
     db: Session, user_id: int, invoice_id: int, update_dict: dict
 ) -> int:
     """Patch all files by invoice user id."""
+    invalidate_user_on_commit(db, user_id)
     result = (
         db.query(models.File)
         .filter(models.File.user_id == user_id, models.File.invoice_id == invoice_id)
         .update(update_dict)
     )
-    db.commit()
     return result
 
 
 def delete_file(db: Session, model_id: int, current_user_id: int) -> int:
     """Delete file."""
+    invalidate_user_on_commit(db, current_user_id)
     result = (
         db.query(models.File)
         .filter(models.File.id == model_id, models.File.user_id == current_user_id)
         .delete()
     )
-    db.commit()
     return result
 
 
 def delete_files_by_invoice(db: Session, model_id: int, current_user_id: int) -> int:
     """Delete files by invoice."""
+    invalidate_user_on_commit(db, current_user_id)
     return (
         db.query(models.File)
         .filter(
@@ -366,11 +458,37 @@ def create_file(db: Session, model: schemas.FileCreate) -> models.File:
     """Create file."""
     db_model = models.File(**model.model_dump())
     db.add(db_model)
-    db.commit()
-    db.refresh(db_model)
+    db.flush()
     return db_model
 
 
+def create_files_bulk(
+    db: Session, model_list: List[schemas.FileCreate]
+) -> List[int]:
+    """Create files with a single INSERT, returning their ids in the order given."""
+    if not model_list:
+        return []
+    result = db.scalars(
+        insert(models.File).returning(models.File.id, sort_by_parameter_order=True),
+        [model.model_dump() for model in model_list],
+    ).all()
+    return list(result)
+
+
+def get_files_by_batch(
+    db: Session, batch_id: str, current_user_id: int
+) -> List[models.File]:
+    """Get files by batch."""
+    return (
+        db.query(models.File)
+        .filter(
+            models.File.batch_id == batch_id, models.File.user_id == current_user_id
+        )
+        .order_by(models.File.id)
+        .all()
+    )
+
+
 # Bill_to ----------------------------------------------------------
 def get_billto(
     db: Session, model_id: int, current_user_id: int
@@ -411,7 +529,6 @@ def patch_billto(
         .update(update_dict)
     )
 
-    db.commit()
     return result
 
 
@@ -422,7 +539,6 @@ def delete_billto(db: Session, model_id: int, current_user_id: int) -> int:
         .filter(models.BillTo.id == model_id, models.BillTo.user_id == current_user_id)
         .delete()
     )
-    db.commit()
     return result
 
 
@@ -430,8 +546,7 @@ def create_billto(db: Session, model: schemas.BillToCreate) -> models.BillTo:
     """Create billto."""
     db_model = models.BillTo(**model.model_dump())
     db.add(db_model)
-    db.commit()
-    db.refresh(db_model)
+    db.flush()
     return db_model
 
 
@@ -450,14 +565,31 @@ def get_service(
 
 
 def get_services(
-    db: Session, current_user_id: int, skip: int = 0, limit: int = 100
+    db: Session,
+    current_user_id: int,
+    after: Optional[Tuple[int]] = None,
+    limit: int = 100,
+) -> List[models.Service]:
+    """Get services, by id."""
+    query = db.query(models.Service).filter(models.Service.user_id == current_user_id)
+    if after:
+        query = query.filter(models.Service.id > after[0])
+    return query.order_by(models.Service.id).limit(limit).all()
+
+
+def get_services_by_ids(
+    db: Session, model_ids: List[int], current_user_id: int
 ) -> List[models.Service]:
-    """Get services."""
+    """Get services by ids, ordered by id."""
+    if not model_ids:
+        return []
     return (
         db.query(models.Service)
-        .filter(models.Service.user_id == current_user_id)
-        .offset(skip)
-        .limit(limit)
+        .filter(
+            models.Service.id.in_(model_ids),
+            models.Service.user_id == current_user_id,
+        )
+        .order_by(models.Service.id)
         .all()
     )
 
@@ -502,11 +634,23 @@ def create_service(db: Session, model: schemas.ServiceCreate) -> models.Service:
     """Create service."""
     db_model = models.Service(**model.model_dump())
     db.add(db_model)
-    db.commit()
-    db.refresh(db_model)
+    db.flush()
     return db_model
 
 
+def create_services_bulk(
+    db: Session, model_list: List[schemas.ServiceCreate]
+) -> List[int]:
+    """Create services with a single INSERT, returning their ids in the order given."""
+    if not model_list:
+        return []
+    result = db.scalars(
+        insert(models.Service).returning(models.Service.id, sort_by_parameter_order=True),
+        [model.model_dump() for model in model_list],
+    ).all()
+    return list(result)
+
+
 # Invoice ----------------------------------------------------------
 def get_invoice(
     db: Session, model_id: int, current_user_id: int
@@ -521,36 +665,75 @@ def get_invoice(
     )
 
 
-def get_invoices_by_customer(
-    db: Session, model_id: int, current_user_id: int, skip: int, limit: int = 1000
+# number_id of the invoices without one in the page keys, they are listed last.
+NULL_NUMBER_ID = -1
+
+
+def invoice_page_key(invoice: models.Invoice) -> Tuple[int, int]:
+    """Key of an invoice in the listings, see _invoices_after."""
+    number_id = invoice.number_id if invoice.number_id is not None else NULL_NUMBER_ID
+    return number_id, invoice.id
+
+
+def _invoices_after(
+    query: Query, after: Optional[Tuple[int, int]], limit: int
 ) -> List[models.Invoice]:
-    """Get invoices by customer."""
-    query_results = (
-        db.query(models.Invoice)
-        .filter(
-            models.Invoice.customer_id == model_id,
-            models.Invoice.user_id == current_user_id,
+    """
+    limit invoices of query after the key, by number_id then id, both
+    descending, and the invoices without number_id last, by id. Each part is
+    its own query on plain number_id so it is read in index order: the
+    numbered invoices first, then the NULL tail when the page is not full.
+    """
+    invoices: List[models.Invoice] = []
+    if after is None or after[0] != NULL_NUMBER_ID:
+        numbered = query.filter(models.Invoice.number_id.isnot(None))
+        if after:
+            numbered = numbered.filter(
+                tuple_(models.Invoice.number_id, models.Invoice.id) < tuple_(*after)
+            )
+        invoices = (
+            numbered.order_by(desc(models.Invoice.number_id), desc(models.Invoice.id))
+            .limit(limit)
+            .all()
         )
-        .order_by(desc(models.Invoice.number_id))
-        .offset(skip)
-        .limit(limit)
-        .all()
-    )
+    if len(invoices) < limit:
+        unnumbered = query.filter(models.Invoice.number_id.is_(None))
+        if after and after[0] == NULL_NUMBER_ID:
+            unnumbered = unnumbered.filter(models.Invoice.id < after[1])
+        invoices += (
+            unnumbered.order_by(desc(models.Invoice.id))
+            .limit(limit - len(invoices))
+            .all()
+        )
+    return invoices
+
 
-    return query_results
+def get_invoices_by_customer(
+    db: Session,
+    model_id: int,
+    current_user_id: int,
+    after: Optional[Tuple[int, int]] = None,
+    limit: int = 1000,
+) -> List[models.Invoice]:
+    """Get invoices by customer, newest number first."""
+    query = db.query(models.Invoice).filter(
+        models.Invoice.customer_id == model_id,
+        models.Invoice.user_id == current_user_id,
+    )
+    return _invoices_after(query, after, limit)
 
 
 def get_total_invoices_by_customer(
-    db: Session, model_id: int, current_user_id: int
+    db: Session, model_id: int, current_user_id: int, approximate: bool = False
 ) -> int:
     """Get total invoices by customer."""
-    return (
-        db.query(func.count(models.Invoice.id))
-        .filter(
+    return count(
+        db,
+        db.query(models.Invoice.id).filter(
             models.Invoice.customer_id == model_id,
             models.Invoice.user_id == current_user_id,
-        )
-        .scalar()
+        ),
+        approximate=approximate,
     )
 
 
@@ -588,24 +771,38 @@ def get_invoices_by_number_id(
     )
 
 
-def get_invoices(
-    db: Session, current_user_id: int, skip: int = 0, limit: int = 100
+def get_invoices_by_number_ids(
+    db: Session, keys: List[Tuple[int, int]], current_user_id: int
 ) -> List[models.Invoice]:
-    """Get invoices."""
+    """Get the invoices matching any of the (customer_id, number_id) keys."""
+    if not keys:
+        return []
     return (
         db.query(models.Invoice)
-        .order_by(desc(models.Invoice.number_id))
-        .filter(models.Invoice.user_id == current_user_id)
-        .offset(skip)
-        .limit(limit)
+        .filter(
+            models.Invoice.user_id == current_user_id,
+            tuple_(models.Invoice.customer_id, models.Invoice.number_id).in_(keys),
+        )
         .all()
     )
 
 
+def get_invoices(
+    db: Session,
+    current_user_id: int,
+    after: Optional[Tuple[int, int]] = None,
+    limit: int = 100,
+) -> List[models.Invoice]:
+    """Get invoices, newest number first."""
+    query = db.query(models.Invoice).filter(models.Invoice.user_id == current_user_id)
+    return _invoices_after(query, after, limit)
+
+
 def patch_invoice(
     db: Session, model_id: int, current_user_id: int, update_dict: dict
 ) -> int:
     """Patch invoice."""
+    invalidate_user_on_commit(db, current_user_id)
     result = (
         db.query(models.Invoice)
         .filter(
@@ -613,7 +810,6 @@ def patch_invoice(
         )
         .update(update_dict)
     )
-    db.commit()
     return result
 
 
@@ -621,6 +817,7 @@ def patch_all_invoice_by_customer_user_id(
     db: Session, customer_id: int, user_id: int, update_dict: dict
 ) -> int:
     """Patch all invoice by customer user id."""
+    invalidate_user_on_commit(db, user_id)
     result = (
         db.query(models.Invoice)
         .filter(
@@ -628,12 +825,12 @@ def patch_all_invoice_by_customer_user_id(
         )
         .update(update_dict)
     )
-    db.commit()
     return result
 
 
 def delete_invoice(db: Session, model_id: int, current_user_id: int) -> int:
     """Delete invoice."""
+    invalidate_user_on_commit(db, current_user_id)
     result = (
         db.query(models.Invoice)
         .filter(
@@ -641,12 +838,12 @@ def delete_invoice(db: Session, model_id: int, current_user_id: int) -> int:
         )
         .delete()
     )
-    db.commit()
     return result
 
 
 def delete_invoices_by_customer(db: Session, model_id: int, current_user_id: int) -> int:
     """Delete invoices by customer."""
+    invalidate_user_on_commit(db, current_user_id)
     return (
         db.query(models.Invoice)
         .filter(
@@ -657,22 +854,118 @@ def delete_invoices_by_customer(db: Session, model_id: int, current_user_id: int
     )
 
 
+def _cascade_invoice_ids(
+    current_user_id: int, customer_id: Optional[int], invoice_id: Optional[int]
+) -> Select:
+    """Ids of the invoices of the customer, or of the invoice."""
+    statement = select(models.Invoice.id).filter(models.Invoice.user_id == current_user_id)
+    if customer_id is not None:
+        statement = statement.filter(models.Invoice.customer_id == customer_id)
+    if invoice_id is not None:
+        statement = statement.filter(models.Invoice.id == invoice_id)
+    return statement
+
+
+def get_cascade_file_urls(
+    db: Session,
+    current_user_id: int,
+    customer_id: Optional[int] = None,
+    invoice_id: Optional[int] = None,
+) -> List[Tuple[Optional[str], Optional[str]]]:
+    """
+    (s3_pdf_url, s3_xlsx_url) of the files delete_invoices_cascade removes.
+    An xlsx still used by an upload or by a file that stays is None here.
+    """
+    invoice_ids = _cascade_invoice_ids(current_user_id, customer_id, invoice_id)
+    other_file = aliased(models.File)
+    shared = or_(
+        select(models.Upload.id)
+        .filter(
+            models.Upload.s3_xlsx_url == models.File.s3_xlsx_url,
+            models.Upload.user_id == models.File.user_id,
+        )
+        .exists(),
+        select(other_file.id)
+        .filter(
+            other_file.s3_xlsx_url == models.File.s3_xlsx_url,
+            other_file.user_id == models.File.user_id,
+            other_file.invoice_id.not_in(invoice_ids),
+        )
+        .exists(),
+    )
+    return [
+        tuple(row)
+        for row in db.query(
+            models.File.s3_pdf_url,
+            case((shared, None), else_=models.File.s3_xlsx_url),
+        ).filter(
+            models.File.invoice_id.in_(invoice_ids),
+            models.File.user_id == current_user_id,
+        )
+    ]
+
+
+def delete_invoices_cascade(
+    db: Session,
+    current_user_id: int,
+    customer_id: Optional[int] = None,
+    invoice_id: Optional[int] = None,
+) -> int:
+    """
+    Delete the invoices of the customer (or the invoice) with their files and
+    services, one statement per table. Returns the number of invoices.
+    """
+    invalidate_user_on_commit(db, current_user_id)
+    invoice_ids = _cascade_invoice_ids(current_user_id, customer_id, invoice_id)
+    file_ids = select(models.File.id).filter(
+        models.File.invoice_id.in_(invoice_ids),
+        models.File.user_id == current_user_id,
+    )
+    db.query(models.Service).filter(
+        or_(
+            models.Service.file_id.in_(file_ids),
+            models.Service.invoice_id.in_(invoice_ids),
+        ),
+        models.Service.user_id == current_user_id,
+    ).delete(synchronize_session=False)
+    db.query(models.File).filter(
+        models.File.invoice_id.in_(invoice_ids),
+        models.File.user_id == current_user_id,
+    ).delete(synchronize_session=False)
+    return (
+        db.query(models.Invoice)
+        .filter(models.Invoice.id.in_(invoice_ids))
+        .delete(synchronize_session=False)
+    )
+
+
 def create_invoice(db: Session, model: schemas.InvoiceCreate) -> models.Invoice:
     """Create invoice."""
     db_model = models.Invoice(**model.model_dump())
     db.add(db_model)
-    db.commit()
-    db.refresh(db_model)
+    db.flush()
     return db_model
 
 
+def create_invoices_bulk(
+    db: Session, model_list: List[schemas.InvoiceCreate]
+) -> List[int]:
+    """Create invoices with a single INSERT, returning their ids in the order given."""
+    if not model_list:
+        return []
+    result = db.scalars(
+        insert(models.Invoice).returning(models.Invoice.id, sort_by_parameter_order=True),
+        [model.model_dump() for model in model_list],
+    ).all()
+    return list(result)
+
+
 # User -----------------------------------
 def create_user(db: Session, model: schemas.UserCreate) -> models.User:
     """Create user."""
     db_model = models.User(**model.model_dump())
     db.add(db_model)
-    db.commit()
-    db.refresh(db_model)
+    db.flush()
     return db_model
 
 
@@ -688,6 +981,7 @@ def get_users(db: Session) -> List[models.User]:
 
 def delete_user(db: Session, model_id: int) -> int:
     """Delete user."""
+    invalidate_user_on_commit(db, model_id)
     result = (
         db.query(models.User)
         .filter(
@@ -695,5 +989,170 @@ def delete_user(db: Session, model_id: int) -> int:
         )
         .delete()
     )
-    db.commit()
-    return result
\ No newline at end of file
+    return result
+
+# Job -----------------------------------
+def create_job(db: Session, model: schemas.JobCreate) -> models.Job:
+    """Create job."""
+    db_model = models.Job(**model.model_dump())
+    db.add(db_model)
+    db.flush()
+    return db_model
+
+
+def create_jobs_bulk(db: Session, model_list: List[schemas.JobCreate]) -> List[int]:
+    """Create jobs with a single INSERT, returning their ids in the order given."""
+    if not model_list:
+        return []
+    result = db.scalars(
+        insert(models.Job).returning(models.Job.id, sort_by_parameter_order=True),
+        [model.model_dump() for model in model_list],
+    ).all()
+    return list(result)
+
+
+def get_job(db: Session, model_id: int, current_user_id: int) -> Optional[models.Job]:
+    """Get job."""
+    return (
+        db.query(models.Job)
+        .filter(models.Job.id == model_id, models.Job.user_id == current_user_id)
+        .first()
+    )
+
+
+def get_jobs_by_chain(
+    db: Session, chain_key: str, current_user_id: int
+) -> List[models.Job]:
+    """Get jobs by chain."""
+    return (
+        db.query(models.Job)
+        .filter(
+            models.Job.chain_key == chain_key, models.Job.user_id == current_user_id
+        )
+        .order_by(models.Job.id)
+        .all()
+    )
+
+
+def get_jobs_by_chains(
+    db: Session, chain_keys: List[str], current_user_id: int
+) -> List[models.Job]:
+    """Get jobs by chains."""
+    if not chain_keys:
+        return []
+    return (
+        db.query(models.Job)
+        .filter(
+            models.Job.chain_key.in_(chain_keys), models.Job.user_id == current_user_id
+        )
+        .order_by(models.Job.id)
+        .all()
+    )
+
+
+def claim_job(
+    db: Session, now: datetime, locked_until: datetime
+) -> Optional[models.Job]:
+    """Claim the oldest runnable job and mark it as running.
+
+    A job is runnable when it is pending and due, or when it is running but its
+    lease expired (the worker holding it died). Jobs sharing a chain_key run in
+    insertion order, so a job is skipped while an older job of its chain is
+    still pending or running. Rows locked by another worker are skipped.
+
+    A job whose lease expired after its last attempt (it crashed its worker
+    every time) is marked failed with the pending jobs of its chain instead.
+    """
+    previous = aliased(models.Job)
+    blocked = (
+        db.query(previous.id)
+        .filter(
+            previous.chain_key == models.Job.chain_key,
+            previous.id < models.Job.id,
+            previous.status.in_([JobStatus.PENDING.value, JobStatus.RUNNING.value]),
+        )
+        .exists()
+    )
+    runnable = (
+        db.query(models.Job)
+        .filter(
+            or_(
+                and_(
+                    models.Job.status == JobStatus.PENDING.value,
+                    models.Job.run_after <= now,
+                ),
+                and_(
+                    models.Job.status == JobStatus.RUNNING.value,
+                    models.Job.locked_until < now,
+                ),
+            ),
+            ~blocked,
+        )
+        .order_by(models.Job.id)
+        .with_for_update(skip_locked=True)
+    )
+    while True:
+        db_model = runnable.first()
+        if db_model is None:
+            return None
+        if db_model.attempts < db_model.max_attempts:
+            break
+        db_model.status = JobStatus.FAILED.value
+        db_model.last_error = "Lease expired after {} attempts".format(
+            db_model.attempts
+        )
+        db_model.locked_until = None
+        db_model.updated = now
+        if db_model.chain_key:
+            fail_pending_jobs_by_chain(
+                db=db,
+                chain_key=db_model.chain_key,
+                update_dict={
+                    "status": JobStatus.FAILED.value,
+                    "last_error": "Previous job {} failed".format(db_model.id),
+                    "updated": now,
+                },
+            )
+        db.flush()
+    db_model.status = JobStatus.RUNNING.value
+    db_model.attempts = db_model.attempts + 1
+    db_model.locked_until = locked_until
+    db_model.updated = now
+    db.flush()
+    return db_model
+
+
+def patch_job(db: Session, model_id: int, update_dict: dict) -> int:
+    """Patch job."""
+    result = (
+        db.query(models.Job).filter(models.Job.id == model_id).update(update_dict)
+    )
+    return result
+
+
+def renew_job_lease(
+    db: Session, model_id: int, attempts: int, locked_until: datetime, now: datetime
+) -> int:
+    """Extend the lease of a running job, unless its attempt was reclaimed or ended."""
+    return (
+        db.query(models.Job)
+        .filter(
+            models.Job.id == model_id,
+            models.Job.status == JobStatus.RUNNING.value,
+            models.Job.attempts == attempts,
+        )
+        .update({"locked_until": locked_until, "updated": now})
+    )
+
+
+def fail_pending_jobs_by_chain(db: Session, chain_key: str, update_dict: dict) -> int:
+    """Fail pending jobs by chain."""
+    result = (
+        db.query(models.Job)
+        .filter(
+            models.Job.chain_key == chain_key,
+            models.Job.status == JobStatus.PENDING.value,
+        )
+        .update(update_dict)
+    )
+    return result
@@ -1,10 +1,13 @@
 import logging
 
 from sqlalchemy import create_engine, text
-from sqlalchemy.engine import make_url
+from sqlalchemy.engine import URL, make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import declarative_base, sessionmaker
 
 from ms_invoicer.config import (
+    ASYNC_POOL_MAX_OVERFLOW,
+    ASYNC_POOL_SIZE,
     POOL_MAX_OVERFLOW,
     POOL_PRE_PING,
     POOL_RECYCLE,
@@ -26,6 +29,30 @@ engine = create_engine(
 )
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Async drivers for the sync ones of URL_CONNECTION.
+ASYNC_DRIVERS = {"postgresql": "asyncpg", "sqlite": "aiosqlite"}
+
+
+def async_url(url_connection: str) -> URL:
+    """URL_CONNECTION with its async driver."""
+    url = make_url(url_connection)
+    backend = url.get_backend_name()
+    return url.set(drivername="{}+{}".format(backend, ASYNC_DRIVERS[backend]))
+
+
+async_engine = create_async_engine(
+    async_url(URL_CONNECTION),
+    pool_size=ASYNC_POOL_SIZE,
+    max_overflow=ASYNC_POOL_MAX_OVERFLOW,
+    pool_timeout=POOL_TIMEOUT,
+    pool_recycle=POOL_RECYCLE,
+    pool_pre_ping=POOL_PRE_PING,
+)
+# Objects stay loaded after commit, an AsyncSession can not lazy load them.
+AsyncSessionLocal = async_sessionmaker(
+    autoflush=False, expire_on_commit=False, bind=async_engine
+)
+
 Base = declarative_base()
 
 
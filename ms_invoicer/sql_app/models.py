@@ -1,9 +1,30 @@
-from sqlalchemy import Column, DateTime, Double, ForeignKey, Integer, String, Boolean, select, func
+from datetime import datetime, timezone
+from typing import Any, Optional
+
+from sqlalchemy import JSON, Column, DateTime, Double, ForeignKey, Index, Integer, String, Boolean, select, func
 from sqlalchemy.orm import relationship
+from sqlalchemy.types import TypeDecorator
 
 from ms_invoicer.sql_app.database import Base
 
 
+class NaiveUTCDateTime(TypeDecorator):
+    """
+    timestamp without time zone holding UTC. Aware datetimes, such as the ones
+    of get_current_date, are stored as naive UTC: asyncpg rejects them for
+    these columns and psycopg2 would store them in the server's time zone.
+    """
+
+    impl = DateTime
+    cache_ok = True
+
+    def process_bind_param(self, value: Optional[datetime], dialect: Any) -> Optional[datetime]:
+        """Naive UTC of an aware value, naive values are stored as they are."""
+        if value is not None and value.tzinfo is not None:
+            return value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value
+
+
 class Customer(Base):
     __tablename__ = "customers"
 
@@ -16,17 +37,22 @@ class Customer(Base):
 
 class Invoice(Base):
     __tablename__ = "invoices"
+    __table_args__ = (
+        # Invoices of a customer by number (listing) and by date (summary).
+        Index("ix_invoices_user_id_customer_id_number_id", "user_id", "customer_id", "number_id"),
+        Index("ix_invoices_user_id_customer_id_created", "user_id", "customer_id", "created"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     number_id = Column(Integer)
     reason = Column(String)
     tax_1 = Column(Double)
     tax_2 = Column(Double)
-    created = Column(DateTime)
-    updated = Column(DateTime)
+    created = Column(NaiveUTCDateTime)
+    updated = Column(NaiveUTCDateTime)
     with_taxes = Column(Boolean)
     with_tables = Column(Boolean)
-    customer_id = Column(Integer, ForeignKey("customers.id"))
+    customer_id = Column(Integer, ForeignKey("customers.id"), index=True)
     user_id = Column(Integer, ForeignKey("invoicer_user.id"), index=True)
 
     customer = relationship("Customer", back_populates="invoices", uselist=False)
@@ -53,8 +79,8 @@ class Service(Base):
     currency = Column(String)
     hours = Column(Double)
     price_unit = Column(Double)
-    file_id = Column(Integer, ForeignKey("files.id"))
-    invoice_id = Column(Integer, ForeignKey("invoices.id"))
+    file_id = Column(Integer, ForeignKey("files.id"), index=True)
+    invoice_id = Column(Integer, ForeignKey("invoices.id"), index=True)
     user_id = Column(Integer, ForeignKey("invoicer_user.id"))
 
 
@@ -71,21 +97,39 @@ class TopInfo(Base):
 
 class File(Base):
     __tablename__ = "files"
+    # Files of an invoice, newest first.
+    __table_args__ = (Index("ix_files_invoice_id_created", "invoice_id", "created"),)
 
     id = Column(Integer, primary_key=True, index=True)
     s3_xlsx_url = Column(String)
     s3_pdf_url = Column(String)
     pages_xlsx = Column(String)
-    created = Column(DateTime)
+    created = Column(NaiveUTCDateTime)
     invoice_id = Column(Integer, ForeignKey("invoices.id"))
     bill_to_id = Column(Integer, ForeignKey("billto.id"))
     user_id = Column(Integer, ForeignKey("invoicer_user.id"), index=True)
+    batch_id = Column(String(32), index=True)
 
     bill_to = relationship("BillTo", uselist=False)
     services = relationship("Service")
     invoice = relationship("Invoice")
 
 
+class Upload(Base):
+    __tablename__ = "uploads"
+    # An xlsx is stored once per user, under its content hash.
+    __table_args__ = (Index("ix_uploads_user_id_sha256", "user_id", "sha256", unique=True),)
+
+    id = Column(String(32), primary_key=True)
+    sha256 = Column(String(64))
+    size = Column(Integer)
+    filename = Column(String)
+    pages = Column(JSON)
+    s3_xlsx_url = Column(String)
+    created = Column(NaiveUTCDateTime)
+    user_id = Column(Integer, ForeignKey("invoicer_user.id"))
+
+
 class Globals(Base):
     __tablename__ = "global"
 
@@ -93,8 +137,8 @@ class Globals(Base):
     identifier = Column(Integer)
     name = Column(String, index=True)
     value = Column(String)
-    created = Column(DateTime)
-    updated = Column(DateTime)
+    created = Column(NaiveUTCDateTime)
+    updated = Column(NaiveUTCDateTime)
     user_id = Column(Integer, ForeignKey("invoicer_user.id"), index=True)
 
 
@@ -102,10 +146,10 @@ class User(Base):
     __tablename__ = "invoicer_user"
 
     id = Column(Integer, primary_key=True, index=True)
-    username = Column(String)
+    username = Column(String, unique=True, index=True)
     hashpass = Column(String)
-    created = Column(DateTime)
-    updated = Column(DateTime)
+    created = Column(NaiveUTCDateTime)
+    updated = Column(NaiveUTCDateTime)
 
 
 class Template(Base):
@@ -114,5 +158,24 @@ class Template(Base):
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String)
     user_id = Column(Integer, ForeignKey("invoicer_user.id"), nullable=True)
-    created = Column(DateTime)
-    updated = Column(DateTime)
+    created = Column(NaiveUTCDateTime)
+    updated = Column(NaiveUTCDateTime)
+
+
+class Job(Base):
+    __tablename__ = "jobs"
+    __table_args__ = (Index("ix_jobs_status_run_after", "status", "run_after"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    event_type = Column(String)
+    payload = Column(JSON)
+    chain_key = Column(String, index=True)
+    status = Column(String)
+    attempts = Column(Integer)
+    max_attempts = Column(Integer)
+    last_error = Column(String)
+    run_after = Column(NaiveUTCDateTime)
+    locked_until = Column(NaiveUTCDateTime)
+    created = Column(NaiveUTCDateTime)
+    updated = Column(NaiveUTCDateTime)
+    user_id = Column(Integer, ForeignKey("invoicer_user.id"), index=True)
@@ -1,5 +1,5 @@
 from datetime import datetime
-from typing import List, Union, Optional
+from typing import Any, Dict, List, Union, Optional
 
 from pydantic import BaseModel, ConfigDict
 
@@ -160,6 +160,7 @@ class FileBase(BaseModel):
 
 class FileCreate(FileBase):
     user_id: int
+    batch_id: Optional[str] = None
 
 
 class FileUpdate(BaseModel):
@@ -228,6 +229,42 @@ class File(FileBase):
     model_config = ConfigDict(from_attributes=True)
 
 
+class FileWithJob(File):
+    job_id: Optional[int] = None
+
+
+class SheetInfo(BaseModel):
+    name: str
+    # Contracts found in the scanned window of the sheet.
+    contracts: int
+    hours_column: Optional[str] = None
+
+
+class Pages(BaseModel):
+    pages: List[str]
+    sheets: Optional[List[SheetInfo]] = None
+
+
+class UploadBase(BaseModel):
+    sha256: str
+    size: int
+    filename: Optional[str] = None
+    pages: List[str]
+    created: datetime
+
+
+class UploadCreate(UploadBase):
+    id: str
+    s3_xlsx_url: str
+    user_id: int
+
+
+class Upload(UploadBase):
+    id: str
+
+    model_config = ConfigDict(from_attributes=True)
+
+
 class FileLite(FileBase):
     id: int
 
@@ -258,10 +295,84 @@ class CustomerFull(CustomerBase):
 
 # TOTALS
 class TotalAndCustomer(BaseModel):
-    total: int
+    # Set on every page, None only when the client asks for total=none.
+    total: Optional[int]
     customers: List[Customer]
 
 
 class TotalAndInvoices(BaseModel):
-    total: int
+    total: Optional[int]
     invoices: List[Invoice]
+
+
+# JOB -------------------------------------------------------------
+class JobBase(BaseModel):
+    event_type: str
+    payload: Dict[str, Any]
+    chain_key: Optional[str]
+    status: str
+    attempts: int
+    max_attempts: int
+    created: datetime
+    updated: datetime
+
+
+class JobCreate(JobBase):
+    run_after: datetime
+    user_id: Optional[int]
+
+
+class Job(JobBase):
+    id: int
+    last_error: Optional[str] = None
+
+    model_config = ConfigDict(from_attributes=True)
+
+
+class JobChainStatus(BaseModel):
+    id: int
+    status: str
+    steps: List[Job]
+
+
+# BATCH -------------------------------------------------------------
+class BatchInvoiceItem(BaseModel):
+    number_id: int
+    reason: str
+    tax_1: Optional[float] = None
+    tax_2: Optional[float] = None
+    with_taxes: Optional[bool] = None
+    with_tables: Optional[bool] = None
+    customer_id: int
+    bill_to_id: int
+    contracts: List[ServiceCreateNoFile] = []
+    pages: List[str] = []
+    # Index of the xlsx in the uploaded files, None for invoices without file.
+    file_index: Optional[int] = None
+
+
+class BatchItemResult(BaseModel):
+    index: int
+    status: str
+    invoice_id: Optional[int] = None
+    file_id: Optional[int] = None
+    job_id: Optional[int] = None
+    detail: Optional[str] = None
+
+
+class BatchResult(BaseModel):
+    batch_id: str
+    items: List[BatchItemResult]
+
+
+class BatchFileStatus(BaseModel):
+    file_id: int
+    invoice_id: int
+    status: str
+    s3_pdf_url: Optional[str] = None
+
+
+class BatchStatus(BaseModel):
+    batch_id: str
+    status: str
+    items: List[BatchFileStatus]
@@ -0,0 +1,374 @@
+"""Storage of the uploaded xlsx, the invoice PDFs and the summaries.
+
+STORAGE_BACKEND selects where the files are kept:
+
+- "s3": the S3_BUCKET_NAME bucket, through the shared client of s3_client.
+  Set S3_ENDPOINT_URL to use an S3-compatible server instead of AWS.
+- "local": files under STORAGE_LOCAL_ROOT (a shared volume when several
+  nodes run), served by the API under STORAGE_BASE_URL.
+- "memory": a dict of the process, for tests and benchmarks without I/O.
+
+Files are addressed by key; the url of a key is what the database keeps.
+The temp/ folders stay local scratch space of the process.
+"""
+import hashlib
+import logging
+import os
+import shutil
+import threading
+from typing import BinaryIO, Dict, Iterator, List, Optional
+from urllib.parse import urlparse
+
+from fastapi import HTTPException
+
+from ms_invoicer.config import (
+    S3_BUCKET_NAME,
+    S3_ENDPOINT_URL,
+    STORAGE_BACKEND,
+    STORAGE_BASE_URL,
+    STORAGE_LOCAL_ROOT,
+)
+from ms_invoicer.constants import LogEvent, StorageKind
+from ms_invoicer.s3_client import get_s3_client, transfer_config
+
+log = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+PRESIGN_EXPIRES_SECONDS = 3600
+
+# Most keys a DeleteObjects request accepts.
+S3_DELETE_BATCH = 1000
+
+
+class Storage:
+    """
+    Base class of the storage backends.
+    """
+
+    def url(self, key: str) -> str:
+        """Url of key."""
+        raise NotImplementedError
+
+    def put(
+        self,
+        key: str,
+        file: BinaryIO,
+        content_type: Optional[str] = None,
+        download_name: Optional[str] = None,
+    ) -> str:
+        """
+        Store the content of file under key and return its url. download_name
+        is the file name browsers show when the file is opened inline.
+        """
+        raise NotImplementedError
+
+    def get(self, key: str, file_path: str) -> None:
+        """Write the content of key to file_path."""
+        with open(file_path, "wb") as output_file:
+            for chunk in self.stream(key):
+                output_file.write(chunk)
+
+    def get_with_etag(self, key: str, file_path: str) -> str:
+        """Write the content of key to file_path and return its etag."""
+        etag = self.etag(key)
+        self.get(key, file_path)
+        return etag
+
+    def etag(self, key: str) -> str:
+        """Tag of the current content of key, it changes when key is replaced."""
+        raise NotImplementedError
+
+    def stream(self, key: str, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        """Content of key in chunks of chunk_size bytes."""
+        raise NotImplementedError
+
+    def delete_many(self, keys: List[str]) -> None:
+        """Delete keys, missing ones are ignored."""
+        raise NotImplementedError
+
+    def presign(self, key: str, expires: int = PRESIGN_EXPIRES_SECONDS) -> str:
+        """Url to read key for expires seconds."""
+        return self.url(key)
+
+    def put_file(
+        self,
+        key: str,
+        file_path: str,
+        content_type: Optional[str] = None,
+        download_name: Optional[str] = None,
+    ) -> str:
+        """Store the file at file_path under key and return its url."""
+        with open(file_path, "rb") as file:
+            return self.put(
+                key, file, content_type=content_type, download_name=download_name
+            )
+
+    def key_from_url(self, url: Optional[str]) -> Optional[str]:
+        """Key of a url returned by put, or the path of an older url."""
+        if not url:
+            return None
+        prefix = self.url("")
+        if url.startswith(prefix):
+            return url[len(prefix) :] or None
+        return urlparse(url).path.lstrip("/") or None
+
+
+class S3Storage(Storage):
+    """Objects of an S3 bucket, readable by their url."""
+
+    def __init__(self, bucket: str, endpoint_url: Optional[str] = None) -> None:
+        """Initialize instance."""
+        self.bucket = bucket
+        self.endpoint_url = endpoint_url
+
+    def url(self, key: str) -> str:
+        """Url."""
+        if self.endpoint_url:
+            return "{}/{}/{}".format(self.endpoint_url.rstrip("/"), self.bucket, key)
+        return "https://" + self.bucket + ".s3.amazonaws.com/" + key
+
+    def put(
+        self,
+        key: str,
+        file: BinaryIO,
+        content_type: Optional[str] = None,
+        download_name: Optional[str] = None,
+    ) -> str:
+        """Put."""
+        args = {"ACL": "public-read"}
+        if content_type:
+            args["ContentType"] = content_type
+        if download_name:
+            args["ContentDisposition"] = 'inline; filename="{}"'.format(download_name)
+        try:
+            get_s3_client().upload_fileobj(
+                file, self.bucket, key, ExtraArgs=args, Config=transfer_config
+            )
+        except HTTPException:
+            # Raised by the reader of an upload, such as the 413 of UploadReader.
+            raise
+        except Exception:
+            log.exception(
+                "Failed to upload file to S3",
+                extra={
+                    "bucket": self.bucket,
+                    "object_name": key,
+                    "event": LogEvent.UPLOAD_FILE.value,
+                },
+            )
+            raise Exception("Failure uploading file")
+        return self.url(key)
+
+    def get(self, key: str, file_path: str) -> None:
+        """Get."""
+        try:
+            get_s3_client().download_file(
+                self.bucket, key, file_path, Config=transfer_config
+            )
+            if not os.path.exists(file_path):
+                raise Exception("Failure downloading file")
+        except Exception:
+            log.exception(
+                "Failed to download file from S3",
+                extra={
+                    "bucket": self.bucket,
+                    "file_path_s3": key,
+                    "path_to_save": file_path,
+                    "event": LogEvent.DOWNLOAD_FILE.value,
+                },
+            )
+            raise Exception("Failure downloading file")
+
+    def get_with_etag(self, key: str, file_path: str) -> str:
+        """
+        Get with etag. One GET returns the content and its etag, so they
+        always match even if the object is replaced meanwhile.
+        """
+        response = get_s3_client().get_object(Bucket=self.bucket, Key=key)
+        body = response["Body"]
+        try:
+            with open(file_path, "wb") as output_file:
+                for chunk in body.iter_chunks(CHUNK_SIZE):
+                    output_file.write(chunk)
+        finally:
+            body.close()
+        return response["ETag"]
+
+    def etag(self, key: str) -> str:
+        """Etag."""
+        return get_s3_client().head_object(Bucket=self.bucket, Key=key)["ETag"]
+
+    def stream(self, key: str, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        """Stream."""
+        body = get_s3_client().get_object(Bucket=self.bucket, Key=key)["Body"]
+        try:
+            yield from body.iter_chunks(chunk_size)
+        finally:
+            body.close()
+
+    def delete_many(self, keys: List[str]) -> None:
+        """Delete keys, S3_DELETE_BATCH per request."""
+        if not keys:
+            return
+        try:
+            s3_client = get_s3_client()
+            for start in range(0, len(keys), S3_DELETE_BATCH):
+                batch = keys[start : start + S3_DELETE_BATCH]
+                response = s3_client.delete_objects(
+                    Bucket=self.bucket,
+                    Delete={"Objects": [{"Key": key} for key in batch], "Quiet": True},
+                )
+                for error in response.get("Errors", []):
+                    log.error(
+                        "Failed to delete file from S3",
+                        extra={
+                            "bucket": self.bucket,
+                            "file_name": error.get("Key"),
+                            "error": error.get("Message"),
+                            "event": LogEvent.DELETE_FILE.value,
+                        },
+                    )
+        except Exception:
+            log.exception(
+                "Failed to delete file(s) from S3",
+                extra={
+                    "bucket": self.bucket,
+                    "file_names": keys,
+                    "event": LogEvent.DELETE_FILE.value,
+                },
+            )
+            raise Exception("Failure deleting file")
+
+    def presign(self, key: str, expires: int = PRESIGN_EXPIRES_SECONDS) -> str:
+        """Presign."""
+        return get_s3_client().generate_presigned_url(
+            "get_object",
+            Params={"Bucket": self.bucket, "Key": key},
+            ExpiresIn=expires,
+        )
+
+
+class LocalStorage(Storage):
+    """Files under a root folder, served under base_url."""
+
+    def __init__(self, root: str, base_url: str) -> None:
+        """Initialize instance."""
+        self.root = root
+        self.base_url = base_url
+
+    def path(self, key: str) -> str:
+        """Path of key, which can not leave the root folder."""
+        path = os.path.realpath(os.path.join(self.root, key))
+        if not path.startswith(os.path.realpath(self.root) + os.sep):
+            raise ValueError("Invalid key {}".format(key))
+        return path
+
+    def url(self, key: str) -> str:
+        """Url."""
+        return "{}/{}".format(self.base_url.rstrip("/"), key)
+
+    def put(
+        self,
+        key: str,
+        file: BinaryIO,
+        content_type: Optional[str] = None,
+        download_name: Optional[str] = None,
+    ) -> str:
+        """
+        Put. The content is written to a temporary file first, readers of
+        the shared folder never see a partial file.
+        """
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        partial_path = "{}.{}.partial".format(path, threading.get_ident())
+        try:
+            with open(partial_path, "wb") as output_file:
+                shutil.copyfileobj(file, output_file, CHUNK_SIZE)
+            os.replace(partial_path, path)
+        finally:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+        return self.url(key)
+
+    def get(self, key: str, file_path: str) -> None:
+        """Get."""
+        shutil.copyfile(self.path(key), file_path)
+
+    def etag(self, key: str) -> str:
+        """Etag, from the modification time and size of the file."""
+        stat = os.stat(self.path(key))
+        return "{:x}-{:x}".format(stat.st_mtime_ns, stat.st_size)
+
+    def stream(self, key: str, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        """Stream."""
+        with open(self.path(key), "rb") as file:
+            while chunk := file.read(chunk_size):
+                yield chunk
+
+    def delete_many(self, keys: List[str]) -> None:
+        """Delete many."""
+        for key in keys:
+            path = self.path(key)
+            if os.path.isfile(path):
+                os.remove(path)
+
+
+class MemoryStorage(Storage):
+    """Files kept in memory by the process."""
+
+    def __init__(self) -> None:
+        """Initialize instance."""
+        self.files: Dict[str, bytes] = {}
+        self._lock = threading.Lock()
+
+    def url(self, key: str) -> str:
+        """Url."""
+        return "memory://" + key
+
+    def put(
+        self,
+        key: str,
+        file: BinaryIO,
+        content_type: Optional[str] = None,
+        download_name: Optional[str] = None,
+    ) -> str:
+        """Put."""
+        content = file.read()
+        with self._lock:
+            self.files[key] = content
+        return self.url(key)
+
+    def etag(self, key: str) -> str:
+        """Etag."""
+        with self._lock:
+            content = self.files[key]
+        return hashlib.md5(content).hexdigest()
+
+    def stream(self, key: str, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        """Stream."""
+        with self._lock:
+            content = self.files[key]
+        for start in range(0, len(content), chunk_size):
+            yield content[start : start + chunk_size]
+
+    def delete_many(self, keys: List[str]) -> None:
+        """Delete many."""
+        with self._lock:
+            for key in keys:
+                self.files.pop(key, None)
+
+
+_storage: Optional[Storage] = None
+
+
+def get_storage() -> Storage:
+    """Storage selected by STORAGE_BACKEND, created on first use."""
+    global _storage
+    if _storage is None:
+        if STORAGE_BACKEND == StorageKind.LOCAL:
+            _storage = LocalStorage(STORAGE_LOCAL_ROOT, STORAGE_BASE_URL)
+        elif STORAGE_BACKEND == StorageKind.MEMORY:
+            _storage = MemoryStorage()
+        else:
+            _storage = S3Storage(S3_BUCKET_NAME, S3_ENDPOINT_URL or None)
+    return _storage
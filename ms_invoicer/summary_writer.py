@@ -0,0 +1,160 @@
+"""Write-only builder of the summary workbooks.
+
+A summary has one sheet per contract sheet, laid out as the "01" sheet of
+scripts/summary_template.xlsx. The template is read once per process. Each
+summary sheet starts from the template rows, which are shared and only
+copied where a value is set, and is then streamed to a write-only workbook.
+The memory of a summary does not grow with its number of sheets.
+
+The sheets hold what copy_worksheet of the template gave: values, styles,
+column widths, row heights, merged cells and page setup. delete_row shifts
+the cells below up and, as openpyxl's delete_rows, leaves formulas, merged
+cells and row heights as they are.
+"""
+from copy import copy
+from typing import Any, Dict, List, Optional
+
+import openpyxl
+from openpyxl.cell.cell import Cell
+from openpyxl.utils.indexed_list import IndexedList
+from openpyxl.workbook import Workbook
+from openpyxl.worksheet._write_only import WriteOnlyWorksheet
+
+TEMPLATE_PATH = "scripts/summary_template.xlsx"
+TEMPLATE_SHEET = "01"
+
+# Cells of a row by 0-based column, None where the template has no cell.
+Row = List[Optional[Cell]]
+
+
+class SummaryTemplate:
+    """Template sheet of the summaries, read once."""
+
+    def __init__(self, path: str = TEMPLATE_PATH) -> None:
+        """Initialize instance."""
+        self.workbook = openpyxl.load_workbook(path)
+        self.sheet = self.workbook[TEMPLATE_SHEET]
+
+    def rows(self, parent: WriteOnlyWorksheet) -> List[Row]:
+        """
+        Cells of the template sheet (index 0 unused, then one Row per sheet
+        row) for parent, whose workbook has the styles of the template.
+        """
+        rows: List[Row] = [[] for _ in range(self.sheet.max_row + 1)]
+        for (row, column), source in sorted(self.sheet._cells.items()):
+            cells = rows[row]
+            cells.extend([None] * (column - len(cells)))
+            style = source._style if source.has_style else None
+            # Merged cells other than the top left one have no value.
+            value = getattr(source, "_value", None)
+            cells[column - 1] = Cell(
+                parent, row=row, column=column, value=value, style_array=style
+            )
+        return rows
+
+    def setup(self, sheet: WriteOnlyWorksheet) -> None:
+        """Copy the dimensions, merged cells and page setup of the template to sheet."""
+        for attr in ("row_dimensions", "column_dimensions"):
+            target = getattr(sheet, attr)
+            for key, dimension in getattr(self.sheet, attr).items():
+                target[key] = copy(dimension)
+                target[key].worksheet = sheet
+        sheet.sheet_format = copy(self.sheet.sheet_format)
+        sheet.sheet_properties = copy(self.sheet.sheet_properties)
+        sheet.merged_cells = copy(self.sheet.merged_cells)
+        sheet.page_margins = copy(self.sheet.page_margins)
+        sheet.page_setup = copy(self.sheet.page_setup)
+        sheet.print_options = copy(self.sheet.print_options)
+
+
+def _copy_styles(source: Workbook, target: Workbook) -> None:
+    """Give target the styles of source, so their style arrays mean the same."""
+    for attr in (
+        "_fonts",
+        "_fills",
+        "_borders",
+        "_alignments",
+        "_protections",
+        "_number_formats",
+        "_cell_styles",
+    ):
+        setattr(target, attr, IndexedList(getattr(source, attr)))
+    target._date_formats = copy(source._date_formats)
+    target._timedelta_formats = copy(source._timedelta_formats)
+    target._named_styles = source._named_styles
+    target._differential_styles = source._differential_styles
+    target.loaded_theme = source.loaded_theme
+
+
+class SummarySheet:
+    """Sheet of a summary, kept as rows until it is written."""
+
+    def __init__(self, worksheet: WriteOnlyWorksheet, rows: List[Row]) -> None:
+        """Initialize instance."""
+        self.worksheet = worksheet
+        # Shared with the template until a row is set.
+        self.rows = list(rows)
+
+    def set_values(self, row: int, values: Dict[int, Any]) -> None:
+        """Set the values of row by 1-based column, keeping the styles of the cells."""
+        while len(self.rows) <= row:
+            self.rows.append([])
+        cells = list(self.rows[row])
+        cells.extend([None] * (max(values) - len(cells)))
+        for column, value in values.items():
+            current = cells[column - 1]
+            style = current._style if current is not None and current.has_style else None
+            cells[column - 1] = Cell(
+                self.worksheet, row=row, column=column, value=value, style_array=style
+            )
+        self.rows[row] = cells
+
+    def set_value(self, row: int, column: int, value: Any) -> None:
+        """Set value."""
+        self.set_values(row, {column: value})
+
+    def delete_row(self, row: int) -> None:
+        """Delete row, the rows below move up and the last one is left empty."""
+        if row < len(self.rows):
+            del self.rows[row]
+            self.rows.append([])
+
+    def write(self) -> None:
+        """Stream the rows to the workbook, the sheet can not change afterwards."""
+        for cells in self.rows[1:]:
+            self.worksheet.append(cells)
+        self.rows = []
+
+
+class SummaryWriter:
+    """Write-only summary workbook, written sheet by sheet."""
+
+    def __init__(self, template: SummaryTemplate) -> None:
+        """Initialize instance."""
+        self.template = template
+        self.workbook = Workbook(write_only=True)
+        _copy_styles(template.workbook, self.workbook)
+        self._rows: Optional[List[Row]] = None
+
+    def add_sheet(self, title: str) -> SummarySheet:
+        """New sheet laid out as the template, written by its write()."""
+        worksheet = self.workbook.create_sheet(title)
+        self.template.setup(worksheet)
+        if self._rows is None:
+            self._rows = self.template.rows(worksheet)
+        return SummarySheet(worksheet, self._rows)
+
+    def save(self, path: str) -> None:
+        """Save."""
+        self.workbook.save(path)
+
+
+_template: Optional[SummaryTemplate] = None
+
+
+def get_summary_template() -> SummaryTemplate:
+    """Template of the process, read on first use."""
+    global _template
+    if _template is None:
+        _template = SummaryTemplate()
+    return _template
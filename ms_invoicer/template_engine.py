@@ -0,0 +1,83 @@
+"""Invoice HTML templates.
+
+The base templates in templates/base mark the place of the service rows with
+an `<!-- items -->` comment. The loader swaps that comment for a Jinja loop
+over `services`, so each template is compiled once per process (and its
+bytecode cached on disk) and re-compiled only when the file changes.
+"""
+import os
+import re
+from typing import Any, Callable, Dict, List, Tuple
+
+import jinja2
+
+base = os.path.dirname(os.path.dirname(__file__))
+
+TEMPLATES_DIR = os.path.join(base, "templates/base")
+BYTECODE_CACHE_DIR = "temp/jinja"
+
+ITEMS_COMMENT = re.compile(r"<!--(?:(?!-->).)*items(?:(?!-->).)*-->", re.DOTALL)
+SERVICE_ROWS = (
+    "<div>{% for service in services %}<tr>"
+    "<td>{{ service.service_id }}</td>"
+    "<td>{{ service.service_txt }}</td>"
+    "<td>{{ service.num_hours }}</td>"
+    "<td>{{ service.amount }}</td>"
+    "</tr>{% endfor %}</div>"
+)
+
+
+class InvoiceTemplateLoader(jinja2.BaseLoader):
+    """Loads the base invoice templates with the service rows loop in place."""
+
+    def __init__(self, searchpath: str) -> None:
+        """Initialize instance."""
+        self.searchpath = searchpath
+
+    def get_source(
+        self, environment: jinja2.Environment, template: str
+    ) -> Tuple[str, str, Callable[[], bool]]:
+        """Get source."""
+        path = os.path.join(self.searchpath, template)
+        if not os.path.isfile(path):
+            raise jinja2.TemplateNotFound(template)
+        mtime = os.path.getmtime(path)
+        with open(path, encoding="utf-8") as file:
+            source = ITEMS_COMMENT.sub(SERVICE_ROWS, file.read())
+
+        def uptodate() -> bool:
+            """Uptodate."""
+            try:
+                return os.path.getmtime(path) == mtime
+            except OSError:
+                return False
+
+        return source, path, uptodate
+
+    def list_templates(self) -> List[str]:
+        """List templates."""
+        return sorted(name for name in os.listdir(self.searchpath) if name.endswith(".html"))
+
+
+environment = jinja2.Environment(
+    loader=InvoiceTemplateLoader(TEMPLATES_DIR),
+    bytecode_cache=jinja2.FileSystemBytecodeCache(BYTECODE_CACHE_DIR),
+    auto_reload=True,
+)
+
+
+def precompile_templates() -> None:
+    """Compile every base template so the first invoice does not pay for it."""
+    for name in environment.list_templates():
+        environment.get_template(name)
+
+
+def render_invoice(
+    template_name: str, context: Dict[str, Any], services: List[Dict[str, Any]]
+) -> str:
+    """
+    Render a base invoice template. Each service is a dict with service_id,
+    service_txt, num_hours and amount.
+    """
+    template = environment.get_template(template_name)
+    return template.render(context, services=services)
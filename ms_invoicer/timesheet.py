@@ -0,0 +1,353 @@
+"""Parsed representation of the timesheet workbooks.
+
+A workbook is parsed once (read-only, one pass over each sheet) into a
+ParsedTimesheet, which is cached on disk under its content hash. The data
+extraction, the PDF tables and the summary all read from it instead of
+opening the xlsx again. The cache is bounded to PARSED_CACHE_MAX_MB, the
+least recently used entries are deleted first; every process of a node
+shares it, so the file times are the index.
+"""
+import hashlib
+import logging
+import os
+import pickle
+import posixpath
+import zipfile
+from typing import Any, BinaryIO, Callable, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+from uuid import uuid4
+from xml.etree import ElementTree
+
+import openpyxl
+from openpyxl.utils import get_column_letter
+
+from ms_invoicer.config import PARSED_CACHE_MAX_MB
+
+log = logging.getLogger(__name__)
+
+PARSED_CACHE_DIR = "temp/parsed"
+# Bump when the parsed classes change so stale cache entries are ignored.
+PARSED_FORMAT_VERSION = 1
+PARSED_CACHE_SUFFIX = ".pickle"
+
+# Every contract of a timesheet fits in this window of the sheet.
+SCAN_MAX_ROW = 200
+SCAN_MAX_COL = 30
+# Columns A..G of a contract are kept (date, names, times and hours).
+CONTRACT_COLUMNS = 7
+
+WORKBOOK_XML = "xl/workbook.xml"
+# Larger workbook parts are not read by read_sheet_names.
+WORKBOOK_XML_MAX_BYTES = 16 * 1024 * 1024
+
+Row = Sequence[Any]
+
+
+def _label(value: Any) -> Optional[str]:
+    """Lower-cased text of a label cell, None when it is not text."""
+    if value and isinstance(value, str):
+        return value.lower()
+    return None
+
+
+def contract_ranges(rows: Sequence[Row]) -> List[Tuple[int, int, int, int]]:
+    """
+    Row ranges of the contracts in the rows of a sheet (1-based row numbers).
+
+    Each tuple holds the "NOM CONTRAT" row, the last info row (2 rows below),
+    the first data row (the one after the "Date" header) and the "Total" row.
+    """
+    result = []
+    start_num_info = None
+    start_num = None
+    end_num = None
+    for row_num, row in enumerate(rows, start=1):
+        label = _label(row[0]) if row else None
+        if label:
+            if label.startswith("nom contrat") or label.startswith("nom"):
+                start_num_info = row_num
+            elif label.startswith("total"):
+                end_num = row_num
+            elif label.startswith("date"):
+                start_num = row_num + 1
+
+        if start_num_info and end_num and start_num:
+            result.append((start_num_info, start_num_info + 2, start_num, end_num))
+            start_num_info = None
+            end_num = None
+    return result
+
+
+def hours_column(rows: Sequence[Row]) -> Optional[int]:
+    """0-based index of the "Heures" column of the first "Date" header row."""
+    for row in rows:
+        label = _label(row[0]) if row else None
+        if label and label.startswith("date"):
+            for index, value in enumerate(row[:SCAN_MAX_COL]):
+                header = _label(value)
+                if header and header.startswith("heures"):
+                    return index
+    return None
+
+
+class ParsedContract:
+    """
+    One contract of a sheet. Cells are stored per column (A..G) for the rows
+    from the "Date" header row down to the "Total" row.
+    """
+
+    def __init__(
+        self,
+        info_start: int,
+        info_end: int,
+        start: int,
+        end: int,
+        info: List[Tuple[Any, Any]],
+        columns: List[List[Any]],
+        hours: Optional[float],
+    ) -> None:
+        """Initialize instance."""
+        self.info_start = info_start
+        self.info_end = info_end
+        self.start = start
+        self.end = end
+        # (label in column A, value in column C) of the info rows.
+        self.info = info
+        self.columns = columns
+        # None when the sheet has no hours column or a non numeric hour.
+        self.hours = hours
+
+    def info_value(self, match: Callable[[str], bool]) -> Any:
+        """Value of the last info row whose label matches."""
+        result = None
+        for label, value in self.info:
+            if label and isinstance(label, str) and match(label):
+                result = value
+        return result
+
+    def cell(self, row: int, column: int) -> Any:
+        """Value at a 1-based sheet row and 0-based column."""
+        return self.columns[column][row - (self.start - 1)]
+
+    def rows(self, min_row: int, max_row: int, max_col: int = CONTRACT_COLUMNS) -> Iterator[Tuple]:
+        """Values of the rows min_row..max_row (inclusive, 1-based)."""
+        first = min_row - (self.start - 1)
+        last = max_row - (self.start - 1) + 1
+        return zip(*(column[first:last] for column in self.columns[:max_col]))
+
+    @property
+    def date_value(self) -> Any:
+        """Cell A of the row above "Total", used as the invoice date."""
+        return self.cell(self.end - 1, 0)
+
+
+class ParsedSheet:
+    def __init__(
+        self, name: str, hours_letter: Optional[str], contracts: List[ParsedContract]
+    ) -> None:
+        """Initialize instance."""
+        self.name = name
+        self.hours_letter = hours_letter
+        self.contracts = contracts
+
+
+class ParsedTimesheet:
+    def __init__(self, content_hash: str, sheet_names: List[str]) -> None:
+        """Initialize instance."""
+        self.content_hash = content_hash
+        self.sheet_names = sheet_names
+        # Only the sheets requested so far are parsed.
+        self.sheets: Dict[str, ParsedSheet] = {}
+
+    def selected(self, select: Callable[[str], bool]) -> List[ParsedSheet]:
+        """Parsed sheets matching select, in workbook order."""
+        return [
+            self.sheets[name]
+            for name in self.sheet_names
+            if select(name) and name in self.sheets
+        ]
+
+
+def _sum_hours(rows: Sequence[Row], start: int, end: int, column: Optional[int]) -> Optional[float]:
+    """Sum of the hours of rows start..end-1, each rounded to 2 decimals."""
+    if column is None:
+        return None
+    hours: float = 0
+    try:
+        for row in rows[start - 1 : end - 1]:
+            hours += float(round(row[column], 2))
+    except (TypeError, ValueError):
+        return None
+    return hours
+
+
+def parse_sheet(name: str, rows: Sequence[Row]) -> ParsedSheet:
+    """Contracts, hours column and summed hours of the rows of a sheet."""
+    hours_index = hours_column(rows)
+    contracts = []
+    for (minrowinfo, maxrowinfo, minrow, maxrow) in contract_ranges(rows):
+        info = [(row[0], row[2]) for row in rows[minrowinfo - 1 : maxrowinfo]]
+        table = rows[minrow - 2 : maxrow]
+        columns = [[row[index] for row in table] for index in range(CONTRACT_COLUMNS)]
+        contracts.append(
+            ParsedContract(
+                info_start=minrowinfo,
+                info_end=maxrowinfo,
+                start=minrow,
+                end=maxrow,
+                info=info,
+                columns=columns,
+                hours=_sum_hours(rows, minrow, maxrow, hours_index),
+            )
+        )
+    hours_letter = get_column_letter(hours_index + 1) if hours_index is not None else None
+    return ParsedSheet(name=name, hours_letter=hours_letter, contracts=contracts)
+
+
+def read_rows(worksheet: Any) -> List[Row]:
+    """Values of the scanned window of a worksheet, one padded tuple per row."""
+    rows = []
+    for row in worksheet.iter_rows(
+        max_row=SCAN_MAX_ROW, max_col=SCAN_MAX_COL, values_only=True
+    ):
+        if len(row) < SCAN_MAX_COL:
+            row = tuple(row) + (None,) * (SCAN_MAX_COL - len(row))
+        rows.append(row)
+    return rows
+
+
+def _local_name(tag: str) -> str:
+    """Tag without its namespace (transitional and strict OOXML differ)."""
+    return tag.rsplit("}", 1)[-1]
+
+
+def _workbook_part(archive: zipfile.ZipFile) -> str:
+    """Path of the workbook part, from the package relationships if needed."""
+    if WORKBOOK_XML in archive.namelist():
+        return WORKBOOK_XML
+    with archive.open("_rels/.rels") as rels:
+        for _, element in ElementTree.iterparse(rels):
+            if _local_name(element.tag) == "Relationship" and element.get(
+                "Type", ""
+            ).endswith("/officeDocument"):
+                return posixpath.normpath(element.get("Target", "").lstrip("/"))
+    raise KeyError(WORKBOOK_XML)
+
+
+def read_sheet_names(xlsx: Union[str, BinaryIO]) -> List[str]:
+    """
+    Sheet names of an xlsx (path or seekable file) in workbook order. Only
+    the workbook part of the zip is read, no sheet is opened.
+    """
+    with zipfile.ZipFile(xlsx) as archive:
+        part = _workbook_part(archive)
+        if archive.getinfo(part).file_size > WORKBOOK_XML_MAX_BYTES:
+            raise ValueError("Workbook part too large")
+        with archive.open(part) as workbook:
+            return [
+                element.get("name")
+                for _, element in ElementTree.iterparse(workbook)
+                if _local_name(element.tag) == "sheet"
+            ]
+
+
+def content_hash(xlsx_path: str) -> str:
+    """Sha256 of the file content."""
+    digest = hashlib.sha256()
+    with open(xlsx_path, "rb") as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _cache_path(file_hash: str) -> str:
+    """Cache path."""
+    return os.path.join(
+        PARSED_CACHE_DIR,
+        "{}.v{}{}".format(file_hash, PARSED_FORMAT_VERSION, PARSED_CACHE_SUFFIX),
+    )
+
+
+def _read_cache(file_hash: str) -> Optional[ParsedTimesheet]:
+    """Read cache, marking the entry as recently used."""
+    path = _cache_path(file_hash)
+    try:
+        with open(path, "rb") as file:
+            timesheet = pickle.load(file)
+        os.utime(path)
+        return timesheet
+    except FileNotFoundError:
+        return None
+    except Exception:
+        log.warning(
+            "Ignoring unreadable parsed timesheet",
+            exc_info=True,
+            extra={"content_hash": file_hash, "event": "parse_timesheet"},
+        )
+        return None
+
+
+def _write_cache(timesheet: ParsedTimesheet) -> None:
+    """Write cache atomically, concurrent writers of the same file are fine."""
+    os.makedirs(PARSED_CACHE_DIR, exist_ok=True)
+    path = _cache_path(timesheet.content_hash)
+    tmp_path = "{}.{}.tmp".format(path, uuid4())
+    with open(tmp_path, "wb") as file:
+        pickle.dump(timesheet, file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+    _evict_cache(keep=path)
+
+
+def _evict_cache(keep: str, max_bytes: int = PARSED_CACHE_MAX_MB * 1024 * 1024) -> None:
+    """Delete the least recently used entries over max_bytes, but keep."""
+    entries = []
+    for entry in os.scandir(PARSED_CACHE_DIR):
+        if not entry.name.endswith(PARSED_CACHE_SUFFIX):
+            continue
+        try:
+            stat = entry.stat()
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, entry.path))
+    size = sum(entry_size for _, entry_size, _ in entries)
+    for _, entry_size, path in sorted(entries):
+        if size <= max_bytes:
+            break
+        if path == keep:
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        size -= entry_size
+
+
+def load_parsed_timesheet(
+    xlsx_path: str, select: Callable[[str], bool] = lambda name: True
+) -> ParsedTimesheet:
+    """
+    Parsed timesheet of the xlsx, with at least the sheets matching select
+    parsed. Sheets already in the cache are not read again; the others are
+    read once in read-only mode and added to the cache.
+    """
+    file_hash = content_hash(xlsx_path)
+    timesheet = _read_cache(file_hash)
+    if timesheet is not None:
+        missing = [
+            name
+            for name in timesheet.sheet_names
+            if select(name) and name not in timesheet.sheets
+        ]
+        if not missing:
+            return timesheet
+
+    wb_obj = openpyxl.load_workbook(xlsx_path, read_only=True, data_only=True)
+    try:
+        if timesheet is None:
+            timesheet = ParsedTimesheet(file_hash, list(wb_obj.sheetnames))
+        for name in timesheet.sheet_names:
+            if select(name) and name not in timesheet.sheets:
+                timesheet.sheets[name] = parse_sheet(name, read_rows(wb_obj[name]))
+    finally:
+        wb_obj.close()
+    _write_cache(timesheet)
+    return timesheet
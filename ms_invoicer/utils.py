@@ -1,22 +1,20 @@
-import json
-from typing import Optional, Tuple, Union
-from urllib.parse import urlparse
+import hashlib
+from typing import BinaryIO, Optional, Tuple
 import logging
 import os
-import boto3
 import pytz
 
 from typing import List
-from fastapi import UploadFile
+from fastapi import HTTPException, UploadFile, status
 from datetime import datetime, time, timedelta
-from openpyxl.worksheet.worksheet import Worksheet
-from openpyxl.cell.cell import Cell
 
-from ms_invoicer.config import S3_ACCESS_KEY, S3_SECRET_ACCESS_KEY
+from ms_invoicer.config import MAX_UPLOAD_MB
 from ms_invoicer.constants import LogEvent
 
 log = logging.getLogger(__name__)
 
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
 
 MONTH_NAMES_FRENCH = {
     1: 'Janvier',
@@ -34,18 +32,6 @@ MONTH_NAMES_FRENCH = {
 }
 
 
-class BreadCrumbs:
-    def __init__(self, href: str, value: str, required_id: Optional[int] = None) -> None:
-        """Initialize instance."""
-        self.href = href
-        self.value = value
-        self.required_id = required_id
-    
-    def __repr__(self) -> str:
-        """Return representation string."""
-        return json.dumps({"href": self.href, "value": self.value, "required_id": self.required_id})
-
-
 def check_dates(base_date: datetime, date1: time, date2: time = None) -> datetime:
     """ """
     result = datetime.combine(base_date, date1)
@@ -56,7 +42,7 @@ def check_dates(base_date: datetime, date1: time, date2: time = None) -> datetim
 
 def create_folders() -> None:
     """Create folders."""
-    folder_names = ["temp", "temp/xlsx", "temp/pdf", "temp/cache"]
+    folder_names = ["temp", "temp/xlsx", "temp/pdf", "temp/parsed", "temp/jinja"]
     for folder_name in folder_names:
         if not os.path.exists(folder_name):
             log.info(
@@ -71,12 +57,76 @@ def create_folders() -> None:
             )
 
 
-def save_file(file_path: str, file: UploadFile) -> None:
-    """Save file."""
-    if os.path.exists(file_path):
-        os.remove(file_path)
-    with open(file_path, "wb") as output_file:
-        output_file.write(file.file.read())
+class UploadReader:
+    """
+    Reader of an upload that copies what is read to output_file, if any, and
+    keeps the sha256 and size of the content. Reading past max_bytes fails with
+    413, so a too big upload stops after max_bytes whoever is reading it.
+    """
+
+    def __init__(
+        self,
+        source: BinaryIO,
+        output_file: Optional[BinaryIO] = None,
+        max_bytes: int = MAX_UPLOAD_MB * 1024 * 1024,
+    ) -> None:
+        """Initialize instance."""
+        self.source = source
+        self.output_file = output_file
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.sha256 = hashlib.sha256()
+
+    def readable(self) -> bool:
+        """Readable."""
+        return True
+
+    def read(self, size: Optional[int] = -1) -> bytes:
+        """
+        Read size bytes, less only at the end of the upload, and all of it
+        when size is negative. The source is read UPLOAD_CHUNK_SIZE at a time.
+        """
+        remaining = size if size is not None and size >= 0 else None
+        chunks: List[bytes] = []
+        while remaining is None or remaining > 0:
+            data = self.source.read(
+                UPLOAD_CHUNK_SIZE if remaining is None else min(remaining, UPLOAD_CHUNK_SIZE)
+            )
+            if not data:
+                break
+            self.size += len(data)
+            if self.size > self.max_bytes:
+                raise HTTPException(
+                    status_code=status.HTTP_413_CONTENT_TOO_LARGE,
+                    detail="Archivo demasiado grande",
+                )
+            self.sha256.update(data)
+            if self.output_file is not None:
+                self.output_file.write(data)
+            chunks.append(data)
+            if remaining is not None:
+                remaining -= len(data)
+        return b"".join(chunks)
+
+    def drain(self) -> None:
+        """Read what is left of the upload."""
+        while self.read(UPLOAD_CHUNK_SIZE):
+            pass
+
+
+def save_file(file_path: str, file: UploadFile) -> Tuple[str, int]:
+    """
+    Copy the upload to file_path in chunks and return the sha256 and size
+    of its content. A partial file is removed when the copy fails.
+    """
+    try:
+        with open(file_path, "wb") as output_file:
+            reader = UploadReader(file.file, output_file)
+            reader.drain()
+    except Exception:
+        remove_file(file_path)
+        raise
+    return reader.sha256.hexdigest(), reader.size
 
 
 def remove_file(file_path: str) -> None:
@@ -90,202 +140,6 @@ def remove_file(file_path: str) -> None:
         )
 
 
-def find_ranges(sheet: Worksheet) -> List[Tuple[int, int, int, int]]:
-    """
-    This function takes an Excel worksheet (using the openpyxl library) as input,
-    searches for a specific string in the first column of the sheet, and returns
-    a list of tuples representing the row ranges that contain the string.
-
-    Input:
-
-    sheet: an Excel worksheet object (type: Worksheet)
-
-    Output:
-
-    A list of tuples, where each tuple contains four integers representing the
-    starting and ending rows of a range that contains the target string.
-
-    Functionality:
-
-    The function iterates through each row of the given worksheet, stopping at
-    row 200 and column 10. For each row, it checks the value of the first cell
-    (column A). If the value is a non-empty string containing the text "NOM CONTRAT",
-    the function records the starting row number and adds a tuple to the result list.
-    The tuple contains the starting row number, the row number 2 rows below the
-    starting row, the row number 4 rows below the starting row, and the row number
-    34 rows below the starting row. These row numbers are calculated based on the
-    assumption that each contract occupies 31 rows (31 days in a month).
-    """
-    result = []
-    start_num_info = None
-    start_num = None
-    end_num = None
-    for row in sheet.iter_rows(max_col=10, max_row=200):
-        row_data: Cell = row[0]
-        if row_data.value and isinstance(row_data.value, str):
-            if (
-                row_data.value.lower().startswith("nom contrat") 
-                or row_data.value.lower().startswith("nom")
-            ):
-                start_num_info = int(row_data.row)
-            elif row_data.value.lower().startswith("total"):
-                end_num = int(row_data.row)
-            elif row_data.value.lower().startswith("date"):
-                start_num = int(row_data.row) + 1
-
-        if start_num_info and end_num and start_num:
-            result.append((start_num_info, start_num_info + 2, start_num, end_num))
-            start_num_info = None
-            end_num = None
-    return result
-
-
-def find_letter(sheet: Worksheet) -> Optional[str]:
-    """Find letter."""
-    result = None
-    for row in sheet.iter_rows(max_col=10, max_row=200):
-        row_data: Cell = row[0]
-        if row_data.value and isinstance(row_data.value, str):
-            if row_data.value.lower().startswith("date"):
-                    for col in sheet.iter_cols(min_row=int(row_data.row), max_row=int(row_data.row)+1, max_col=30):
-                        col_data: Cell = col[0]
-                        if (
-                            col_data.value
-                            and isinstance(col_data.value, str)
-                            and col_data.value.lower().startswith("heures")
-                        ):
-                            result = col_data.column_letter
-                            break
-        if result:
-            break
-    return result
-
-
-def upload_file(
-    file_path: str,
-    file_name: str,
-    bucket: str = "invoicer-dev-01",
-    object_name: Optional[str] = None,
-    is_pdf: bool = False,
-) -> str:
-    """Upload a file to an S3 bucket
-
-    :param file_name: File to upload
-    :param bucket: Bucket to upload to
-    :param object_name: S3 object name. If not specified then file_name is used
-    :return: True if file was uploaded, else False
-    """
-
-    """if ENV != "production":
-        url = "https://" + bucket + ".s3.amazonaws.com/" + file_name
-        return url"""
-
-    # If S3 object_name was not specified, use file_name
-    if object_name is None:
-        object_name = os.path.basename(file_path)
-
-    # Upload the file
-    session: boto3.Session = boto3.session.Session()
-    s3 = session.client(
-        "s3",
-        aws_access_key_id=S3_ACCESS_KEY,
-        aws_secret_access_key=S3_SECRET_ACCESS_KEY,
-    )
-    try:
-        args = {"ACL": "public-read"}
-        if is_pdf:
-            try:
-                download_filename = file_name.split("-")[0]
-            except:
-                download_filename = file_name
-            args = {
-                "ACL": "public-read",
-                "ContentType": "application/pdf",
-                "ContentDisposition": 'inline; filename="{}.pdf"'.format(
-                    download_filename
-                ),
-            }
-        s3.upload_file(
-            file_path,
-            bucket,
-            object_name,
-            ExtraArgs=args,
-        )
-        url = "https://" + bucket + ".s3.amazonaws.com/" + file_name
-        return url
-    except Exception as e:
-        log.exception(
-            "Failed to upload file to S3",
-            extra={
-                "bucket": bucket,
-                "file_path": file_path,
-                "object_name": object_name,
-                "is_pdf": is_pdf,
-                "event": LogEvent.UPLOAD_FILE.value,
-            },
-        )
-        raise Exception("Failure uploading file")
-
-
-def download_file_from_s3(
-    file_path_s3: str,
-    path_to_save: str,
-    bucket: str = "invoicer-dev-01",
-) -> None:
-    """Download file from s3."""
-    try:
-        session: boto3.Session = boto3.session.Session()
-        s3 = session.client(
-            "s3",
-            aws_access_key_id=S3_ACCESS_KEY,
-            aws_secret_access_key=S3_SECRET_ACCESS_KEY,
-        )
-
-        # Download the file
-        s3.download_file(bucket, file_path_s3, path_to_save)
-        if not os.path.exists(path_to_save):
-            raise Exception("Failure downloading file")
-    except Exception as e:
-        log.exception(
-            "Failed to download file from S3",
-            extra={
-                "bucket": bucket,
-                "file_path_s3": file_path_s3,
-                "path_to_save": path_to_save,
-                "event": LogEvent.DOWNLOAD_FILE.value,
-            },
-        )
-        raise Exception("Failure downloading file")
-
-
-def delete_file_from_s3(
-    file_names: Union[str, list[str]], bucket_name: str = "invoicer-dev-01"
-) -> None:
-    """Delete file from s3."""
-    try:
-        # Create a session using your AWS credentials
-        s3_client = boto3.client(
-            "s3",
-            aws_access_key_id=S3_ACCESS_KEY,
-            aws_secret_access_key=S3_SECRET_ACCESS_KEY,
-        )
-        if isinstance(file_names, list):
-            for file_name in file_names:
-                s3_client.delete_object(Bucket=bucket_name, Key=file_name)
-        else:
-            s3_client.delete_object(Bucket=bucket_name, Key=file_names)
-    except Exception as e:
-        log.exception(
-            "Failed to delete file(s) from S3",
-            extra={
-                "bucket": bucket_name,
-                "file_names": file_names,
-                "event": LogEvent.DELETE_FILE.value,
-            },
-        )
-        raise Exception("Failure deleting file")
-
-
 def extract_and_get_month_name(date: datetime) -> Optional[str]:
     """Extract and get month name."""
     month = date.month
@@ -294,18 +148,6 @@ def extract_and_get_month_name(date: datetime) -> Optional[str]:
     return None
 
 
-def s3_key_from_url(url: Optional[str]) -> Optional[str]:
-    """S3 key from url."""
-    if not url:
-        return None
-    parsed = urlparse(url)
-    if parsed.path:
-        return parsed.path.lstrip("/")
-    if "amazonaws.com/" in url:
-        return url.split("amazonaws.com/")[1]
-    return None
-
-
 def get_current_date() -> datetime:
     # Create a timezone object for Eastern Standard Time
     """Get current date."""
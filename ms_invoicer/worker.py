@@ -0,0 +1,116 @@
+"""Job worker for the invoice pipeline.
+
+Run one or more worker processes next to the API:
+
+    python -m ms_invoicer.worker --concurrency 4
+
+Each process runs `concurrency` job slots. Throughput scales with the number
+of processes since jobs are claimed with `FOR UPDATE SKIP LOCKED`. A job left
+running by a killed worker is picked up again once its lease expires; the
+lease of a job is renewed while it runs, so a long job is not run twice.
+"""
+import argparse
+import asyncio
+import logging
+
+from ms_invoicer.config import (
+    JOB_LEASE_SECONDS,
+    JOB_POLL_INTERVAL_SECONDS,
+    JOB_WORKER_CONCURRENCY,
+    LOG_LEVEL,
+)
+from ms_invoicer.constants import LogEvent
+from ms_invoicer.event_handler import register_event_handlers
+from ms_invoicer.executors import shutdown_pools
+from ms_invoicer.job_queue import claim_next_job, renew_lease, run_job
+from ms_invoicer.pdf_renderer import shutdown_renderer
+from ms_invoicer.s3_client import close_s3_client
+from ms_invoicer.sql_app import schemas
+from ms_invoicer.template_engine import precompile_templates
+from ms_invoicer.utils import create_folders
+
+log = logging.getLogger(__name__)
+
+# Renewed well before it expires, a renewal can fail or be late once.
+LEASE_RENEW_SECONDS = JOB_LEASE_SECONDS / 3
+
+
+async def keep_lease(job: schemas.Job, slot: int) -> None:
+    """Renew the lease of job until cancelled or until the job is no longer held."""
+    while True:
+        await asyncio.sleep(LEASE_RENEW_SECONDS)
+        try:
+            if not await asyncio.to_thread(renew_lease, job):
+                return
+        except Exception:
+            log.exception(
+                "Failed to renew job lease",
+                extra={"slot": slot, "job_id": job.id, "event": LogEvent.WORKER.value},
+            )
+
+
+async def run_slot(slot: int) -> None:
+    """Claim and run jobs one at a time, forever."""
+    while True:
+        try:
+            job = await asyncio.to_thread(claim_next_job)
+        except Exception:
+            log.exception(
+                "Failed to claim job",
+                extra={"slot": slot, "event": LogEvent.WORKER.value},
+            )
+            job = None
+        if job is None:
+            await asyncio.sleep(JOB_POLL_INTERVAL_SECONDS)
+            continue
+        heartbeat = asyncio.create_task(keep_lease(job, slot))
+        try:
+            await run_job(job)
+        except Exception:
+            # The outcome was not recorded, the job runs again once its lease expires.
+            log.exception(
+                "Failed to record job outcome",
+                extra={"slot": slot, "job_id": job.id, "event": LogEvent.WORKER.value},
+            )
+        finally:
+            heartbeat.cancel()
+
+
+async def run_worker(concurrency: int) -> None:
+    """Run worker."""
+    log.info(
+        "Starting worker",
+        extra={"concurrency": concurrency, "event": LogEvent.WORKER.value},
+    )
+    await asyncio.gather(*(run_slot(slot) for slot in range(concurrency)))
+
+
+def main() -> None:
+    """Worker entry point."""
+    parser = argparse.ArgumentParser(description="Run invoice pipeline jobs.")
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=JOB_WORKER_CONCURRENCY,
+        help="number of jobs run at the same time by this process",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        format="[%(asctime)s] %(levelname)-8s - %(message)s", level=LOG_LEVEL
+    )
+    create_folders()
+    register_event_handlers()
+    precompile_templates()
+    try:
+        asyncio.run(run_worker(args.concurrency))
+    except KeyboardInterrupt:
+        log.info("Worker stopped", extra={"event": LogEvent.WORKER.value})
+    finally:
+        shutdown_renderer()
+        shutdown_pools()
+        close_s3_client()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+"""Time and peak memory of the summary builder at 10, 100 and 1000 sheets.
+
+Writes a synthetic timesheet of SHEETS_PER_FILE contract sheets (30 and 31
+day months, one sheet with two contracts), then builds summaries of N sheets
+from it with build_summary_workbook and with the former builder, which
+copied the template sheet with copy_worksheet. Every build runs in a fresh
+process, so the peak RSS is its own. Run from the repository root with the
+Dynaconf env of the API:
+
+    PYTHONPATH=. python scripts/bench_summary.py --sheets 10 100 1000
+
+With --check the two summaries of the smallest N are compared cell by cell.
+"""
+import argparse
+import os
+import resource
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from copy import copy
+from datetime import datetime, time as day_time, timedelta
+from multiprocessing import get_context
+from typing import Any, Callable, Dict, List
+
+import openpyxl
+
+from ms_invoicer.file_helpers import FileToProcess, build_summary_workbook
+from ms_invoicer.timesheet import load_parsed_timesheet
+from ms_invoicer.utils import extract_and_get_month_name
+
+SHEETS_PER_FILE = 10
+
+
+def write_timesheet(path: str) -> None:
+    """Timesheet of SHEETS_PER_FILE sheets with one or two contracts each."""
+    workbook = openpyxl.Workbook()
+    workbook.remove(workbook.active)
+    for index in range(SHEETS_PER_FILE):
+        sheet = workbook.create_sheet("Sheet {}".format(index + 1))
+        for contract in range(2 if index == 0 else 1):
+            start = datetime(2024, 4 + (index + contract) % 2, 1)
+            days = 30 if start.month == 4 else 31
+            sheet.append(["NOM CONTRAT", None, "Contrat {}-{}".format(index, contract)])
+            sheet.append(["PERIODO", None, start.strftime("%B")])
+            sheet.append(["ADRESSE", None, "1 rue"])
+            sheet.append(["Date", "Nom, Prenom", "Entree", "Debut pause", "Fin pause", "Sortie", "Heures"])
+            for day in range(days):
+                sheet.append([
+                    start + timedelta(days=day),
+                    "Employe {}".format(day % 7),
+                    day_time(8, 0),
+                    day_time(12, 0),
+                    day_time(13, 0),
+                    day_time(17, 0),
+                    8,
+                ])
+            sheet.append(["Total", None, None, None, None, None, 8 * days])
+    workbook.save(path)
+
+
+def build_with_copy_worksheet(
+    xlsx_path_name_list: List[FileToProcess], output_file_path: str
+) -> None:
+    """The former builder: a copy of the template sheet per input sheet."""
+    shutil.copy("scripts/summary_template.xlsx", output_file_path)
+    new_workbook = openpyxl.load_workbook(output_file_path)
+    index_contract = 1
+    for path in xlsx_path_name_list:
+        timesheet = load_parsed_timesheet(path.file_path)
+        for input_sheet in timesheet.selected(lambda name: True):
+            new_sheet_wb = new_workbook.copy_worksheet(new_workbook["01"])
+            new_sheet_wb.title = "{}".format(index_contract)
+            index_contract += 1
+            period_extracted = False
+            for contract in input_sheet.contracts:
+                for cell, value in contract.info:
+                    if isinstance(cell, str) and "NOM CONTRAT" in cell:
+                        new_sheet_wb["C1"].value = value
+                if not period_extracted:
+                    new_sheet_wb["C2"].value = extract_and_get_month_name(
+                        contract.cell(contract.start, 0)
+                    )
+                    period_extracted = True
+                minrow, maxrow = contract.start, contract.end
+                for col, row in enumerate(contract.rows(minrow, maxrow - 1), start=minrow):
+                    new_sheet_wb["A{}".format(col)].value = row[0]
+                    new_sheet_wb["C{}".format(col)].value = row[1]
+                    new_sheet_wb["D{}".format(col)].value = row[2]
+                    new_sheet_wb["E{}".format(col)].value = row[3]
+                    new_sheet_wb["F{}".format(col)].value = row[4]
+                    new_sheet_wb["G{}".format(col)].value = row[5]
+                if maxrow - minrow <= 30:
+                    new_sheet_wb.delete_rows(36)
+                    new_sheet_wb["G36"].value = "=SUM(G6:G35)"
+                    new_sheet_wb["G38"].value = "=SUM(G22:G35)"
+                    new_sheet_wb["I36"].value = "=SUM(I6:I35)"
+                    new_sheet_wb["K36"].value = "=SUM(K6:K35)"
+    new_workbook.remove(new_workbook["01"])
+    new_workbook.save(output_file_path)
+    new_workbook.close()
+
+
+BUILDERS: Dict[str, Callable[[List[FileToProcess], str], None]] = {
+    "copy_worksheet": build_with_copy_worksheet,
+    "write_only": build_summary_workbook,
+}
+
+
+def measure(builder: str, inputs: List[FileToProcess], output: str) -> Dict[str, Any]:
+    """Build the summary in this process, return its time and peak RSS."""
+    start = time.perf_counter()
+    BUILDERS[builder](inputs, output)
+    return {
+        "seconds": time.perf_counter() - start,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "size_kb": os.path.getsize(output) / 1024,
+    }
+
+
+def cell_state(cell: Any, styles: Dict[tuple, tuple]) -> tuple:
+    """What a summary cell shows: value and style, styles memoized by style array."""
+    # Styles are read through proxies, which only compare equal to their target.
+    key = tuple(cell._style) if cell._style is not None else None
+    if key is None or key not in styles:
+        state = (
+            copy(cell.font),
+            copy(cell.fill),
+            copy(cell.border),
+            copy(cell.alignment),
+            cell.number_format,
+            copy(cell.protection),
+        )
+        if key is None:
+            # Merged cells other than the top left one have no style array.
+            return (cell.value,) + state
+        styles[key] = state
+    return (cell.value,) + styles[key]
+
+
+def compare(expected_path: str, actual_path: str) -> List[str]:
+    """Differences between two summaries."""
+    expected = openpyxl.load_workbook(expected_path)
+    actual = openpyxl.load_workbook(actual_path)
+    if expected.sheetnames != actual.sheetnames:
+        return ["sheets {} != {}".format(expected.sheetnames, actual.sheetnames)]
+    differences = []
+    expected_styles: Dict[tuple, tuple] = {}
+    actual_styles: Dict[tuple, tuple] = {}
+    for name in expected.sheetnames:
+        left, right = expected[name], actual[name]
+        rows = max(left.max_row, right.max_row)
+        columns = max(left.max_column, right.max_column)
+        for row in range(1, rows + 1):
+            for column in range(1, columns + 1):
+                if cell_state(left.cell(row, column), expected_styles) != cell_state(
+                    right.cell(row, column), actual_styles
+                ):
+                    differences.append("{}!{}".format(name, left.cell(row, column).coordinate))
+        if set(map(str, left.merged_cells.ranges)) != set(map(str, right.merged_cells.ranges)):
+            differences.append("{} merged cells".format(name))
+        for key, dimension in left.column_dimensions.items():
+            if dimension.width != right.column_dimensions[key].width:
+                differences.append("{} width of {}".format(name, key))
+        for key, dimension in left.row_dimensions.items():
+            if dimension.height != right.row_dimensions[key].height:
+                differences.append("{} height of {}".format(name, key))
+    return differences
+
+
+def main() -> None:
+    """Main."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sheets", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--builders", nargs="+", default=list(BUILDERS), choices=list(BUILDERS))
+    parser.add_argument("--check", action="store_true")
+    args = parser.parse_args()
+
+    folder = tempfile.mkdtemp()
+    try:
+        timesheet_path = os.path.join(folder, "timesheet.xlsx")
+        write_timesheet(timesheet_path)
+        # Parse it once, the builds then read the parsed cache.
+        os.makedirs("temp/parsed", exist_ok=True)
+        load_parsed_timesheet(timesheet_path)
+
+        print("{:>7}  {:<15} {:>9} {:>14} {:>10}".format(
+            "sheets", "builder", "seconds", "peak RSS (MB)", "size (KB)"
+        ))
+        for sheets in args.sheets:
+            inputs = [
+                FileToProcess("timesheet.xlsx", timesheet_path, invoice_id, "")
+                for invoice_id in range(max(sheets // SHEETS_PER_FILE, 1))
+            ]
+            for builder in args.builders:
+                output = os.path.join(folder, "{}_{}.xlsx".format(builder, sheets))
+                with ProcessPoolExecutor(1, mp_context=get_context("spawn")) as executor:
+                    result = executor.submit(measure, builder, inputs, output).result()
+                print("{:>7}  {:<15} {:>9.2f} {:>14.0f} {:>10.0f}".format(
+                    sheets, builder, result["seconds"], result["peak_rss_mb"], result["size_kb"]
+                ))
+
+        if args.check:
+            sheets = min(args.sheets)
+            differences = compare(
+                os.path.join(folder, "copy_worksheet_{}.xlsx".format(sheets)),
+                os.path.join(folder, "write_only_{}.xlsx".format(sheets)),
+            )
+            print("\n{} differences{}".format(len(differences), ": " if differences else ""))
+            for difference in differences[:20]:
+                print("  " + difference)
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
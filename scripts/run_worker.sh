@@ -0,0 +1,8 @@
+#!/bin/bash
+set -euo pipefail
+
+APP_DIR="$(cd "$(dirname "$0")/.." && pwd)"
+export ENV_FOR_DYNACONF="${ENV_FOR_DYNACONF:-development}"
+export PYTHONPATH="$APP_DIR${PYTHONPATH:+:$PYTHONPATH}"
+
+exec python -m ms_invoicer.worker "$@"
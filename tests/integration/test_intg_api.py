@@ -43,3 +43,10 @@ def test_customer(test_client: TestClient):
     response = test_client.get("/customer/{}".format(result_id))
     assert response.status_code == 200
     assert response.json() == None
+
+
+@pytest.mark.parametrize("path", ["/metrics/executors", "/metrics/cache", "/metrics/renderer"])
+def test_metrics_require_a_token(test_client: TestClient, path: str):
+    """The metrics of the process are not served to anonymous callers."""
+    response = test_client.get(path)
+    assert response.status_code == 401
@@ -0,0 +1,72 @@
+import json
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+
+from ms_invoicer.constants import JobStatus
+from ms_invoicer.db_pool import get_db_context
+from ms_invoicer.security_helper import create_access_token
+from ms_invoicer.sql_app import crud, models, schemas
+from ms_invoicer.sql_app.database import Base, engine
+from ms_invoicer.utils import get_current_date
+
+
+@pytest.fixture()
+def invoice_form():
+    """Form of a generate_pdf call without xlsx, for a new user."""
+    Base.metadata.create_all(bind=engine)
+    now = get_current_date()
+    with get_db_context() as db:
+        user = crud.create_user(
+            db, schemas.UserCreate(username="generate_pdf", hashpass="x", created=now, updated=now)
+        )
+        customer = crud.create_customer(
+            db, schemas.CustomerCreate(name="customer_generate_pdf", user_id=user.id)
+        )
+        bill_to = crud.create_billto(
+            db,
+            schemas.BillToCreate(to="to", addr="addr", phone="phone", email="email", user_id=user.id),
+        )
+        ids = (user.id, customer["id"], bill_to.id)
+    user_id, customer_id, bill_to_id = ids
+
+    yield {
+        "headers": {"Authorization": "Bearer {}".format(create_access_token({"sub": "generate_pdf"}))},
+        "data": {
+            "invoice": json.dumps({
+                "number_id": 1001, "reason": "r", "tax_1": 5, "tax_2": 10,
+                "with_taxes": True, "with_tables": False, "customer_id": customer_id,
+                "created": "2026-01-01T00:00:00", "updated": "2026-01-01T00:00:00",
+            }),
+            "bill_to_id": str(bill_to_id),
+            "contracts": json.dumps([
+                {"title": "Service A", "amount": 100, "currency": "CAD", "hours": 2, "price_unit": 50}
+            ]),
+            "pages": "[]",
+        },
+    }
+
+    with get_db_context() as db:
+        for model in (models.Job, models.Service, models.File, models.Invoice,
+                      models.Customer, models.BillTo):
+            db.query(model).filter(model.user_id == user_id).delete()
+        crud.delete_user(db, model_id=user_id)
+
+
+def test_generate_pdf_on_the_async_engine(test_client: TestClient, invoice_form):
+    """generate_pdf stores its rows through asyncpg, dated in naive UTC."""
+    before = datetime.utcnow() - timedelta(seconds=1)
+    response = test_client.post("/generate_pdf", **invoice_form)
+
+    assert response.status_code == 200, response.text
+    body = response.json()
+    with get_db_context() as db:
+        file = db.query(models.File).filter(models.File.id == body["id"]).first()
+        invoice = db.query(models.Invoice).filter(models.Invoice.id == file.invoice_id).first()
+        job = db.query(models.Job).filter(models.Job.id == body["job_id"]).first()
+        assert [service.title for service in file.services] == ["Service A"]
+        assert job.status == JobStatus.PENDING.value
+        for created in (file.created, invoice.created, job.created, job.run_after):
+            assert created.tzinfo is None
+            assert before <= created <= datetime.utcnow() + timedelta(seconds=1)
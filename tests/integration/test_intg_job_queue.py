@@ -0,0 +1,173 @@
+import asyncio
+from datetime import timedelta
+from typing import Optional
+
+import pytest
+
+from ms_invoicer.constants import JobStatus
+from ms_invoicer.dao import file_job_key
+from ms_invoicer.db_pool import get_db_context
+from ms_invoicer.event_bus import Event, publish, register
+from ms_invoicer.job_queue import (
+    claim_next_job,
+    complete_job,
+    enqueue,
+    renew_lease,
+    retry_delay,
+    run_job,
+)
+from ms_invoicer.sql_app import crud, models, schemas
+from ms_invoicer.sql_app.database import Base, engine
+from ms_invoicer.utils import get_current_date
+
+
+class StepEvent(Event):
+    """Step of a test pipeline run, failing or publishing the next one on demand."""
+
+    def __init__(
+        self, current_user_id: int, file_id: int, fail: bool = False, next_step: bool = False
+    ) -> None:
+        """Initialize instance."""
+        self.current_user_id = current_user_id
+        self.file_id = file_id
+        self.fail = fail
+        self.next_step = next_step
+
+    def job_key(self) -> Optional[str]:
+        """Job key."""
+        return file_job_key(self.file_id)
+
+
+async def handle_step(event: StepEvent) -> None:
+    """Handle step."""
+    if event.fail:
+        raise ValueError("step failed")
+    if event.next_step:
+        await publish(StepEvent(event.current_user_id, event.file_id))
+
+
+register(StepEvent, handle_step)
+
+
+def get_job(job_id: int) -> models.Job:
+    """Get job."""
+    with get_db_context() as db:
+        job = db.query(models.Job).filter(models.Job.id == job_id).first()
+        db.expunge(job)
+        return job
+
+
+@pytest.fixture()
+def user_id():
+    """User owning the jobs of a test, the queue is expected to hold no other runnable job."""
+    Base.metadata.create_all(bind=engine)
+    now = get_current_date()
+    with get_db_context() as db:
+        user = crud.create_user(
+            db, schemas.UserCreate(username="jobs", hashpass="x", created=now, updated=now)
+        )
+        user_id = user.id
+
+    yield user_id
+
+    with get_db_context() as db:
+        db.query(models.Job).filter(models.Job.user_id == user_id).delete()
+        crud.delete_user(db, model_id=user_id)
+
+
+def test_chain_runs_in_order(user_id: int):
+    """A job waits for the older job of its chain."""
+    first_id = enqueue(StepEvent(user_id, file_id=1))
+    second_id = enqueue(StepEvent(user_id, file_id=1))
+
+    first = claim_next_job()
+    assert first.id == first_id
+    assert first.attempts == 1
+    assert claim_next_job() is None
+
+    with get_db_context() as db:
+        complete_job(db, first)
+    assert claim_next_job().id == second_id
+
+
+def test_failed_job_is_retried_then_failed_with_its_chain(user_id: int):
+    """A failed job goes back to pending with a backoff until its last attempt."""
+    job_id = enqueue(StepEvent(user_id, file_id=2, fail=True))
+    next_id = enqueue(StepEvent(user_id, file_id=2))
+
+    queued_after = get_job(job_id).run_after
+    job = claim_next_job()
+    assert not asyncio.run(run_job(job))
+    retried = get_job(job_id)
+    assert retried.status == JobStatus.PENDING.value
+    assert retried.last_error == repr(ValueError("step failed"))
+    assert retried.run_after >= queued_after + retry_delay(job.attempts)
+    assert claim_next_job() is None
+
+    with get_db_context() as db:
+        crud.patch_job(
+            db=db,
+            model_id=job_id,
+            update_dict={"attempts": job.max_attempts - 1, "run_after": get_current_date()},
+        )
+    job = claim_next_job()
+    assert job.attempts == job.max_attempts
+    assert not asyncio.run(run_job(job))
+    assert get_job(job_id).status == JobStatus.FAILED.value
+    assert get_job(next_id).status == JobStatus.FAILED.value
+
+
+def test_expired_lease_after_last_attempt_fails(user_id: int):
+    """A job that crashed its worker on every attempt is not claimed again."""
+    now = get_current_date()
+    with get_db_context() as db:
+        job = crud.create_job(
+            db,
+            schemas.JobCreate(
+                event_type=StepEvent(user_id, file_id=3).event_type(),
+                payload=StepEvent(user_id, file_id=3).to_payload(),
+                chain_key=file_job_key(3),
+                status=JobStatus.RUNNING.value,
+                attempts=5,
+                max_attempts=5,
+                run_after=now,
+                created=now,
+                updated=now,
+                user_id=user_id,
+            ),
+        )
+        job.locked_until = now - timedelta(seconds=1)
+        job_id = job.id
+
+    assert claim_next_job() is None
+    failed = get_job(job_id)
+    assert failed.status == JobStatus.FAILED.value
+    assert failed.locked_until is None
+
+
+def test_lease_is_renewed_while_the_job_is_held(user_id: int):
+    """The lease of a running job is extended, not once the job is done."""
+    job_id = enqueue(StepEvent(user_id, file_id=5))
+    job = claim_next_job()
+    locked_until = get_job(job_id).locked_until
+
+    assert renew_lease(job)
+    assert get_job(job_id).locked_until >= locked_until
+    with get_db_context() as db:
+        complete_job(db, job)
+    assert not renew_lease(job)
+    assert get_job(job_id).locked_until is None
+
+
+def test_published_events_are_enqueued_when_the_job_is_done(user_id: int):
+    """Events published by a handler are enqueued with the completion of its job."""
+    job_id = enqueue(StepEvent(user_id, file_id=4, next_step=True))
+
+    assert asyncio.run(run_job(claim_next_job()))
+    with get_db_context() as db:
+        jobs = crud.get_jobs_by_chain(
+            db=db, chain_key=file_job_key(4), current_user_id=user_id
+        )
+        statuses = [(job.id, job.status) for job in jobs]
+    assert statuses[0] == (job_id, JobStatus.DONE.value)
+    assert [status for _, status in statuses[1:]] == [JobStatus.PENDING.value]
@@ -0,0 +1,79 @@
+from typing import List, Optional
+
+import pytest
+
+from ms_invoicer.db_pool import get_db_context
+from ms_invoicer.pagination import decode_cursor, page
+from ms_invoicer.sql_app import crud, schemas
+from ms_invoicer.sql_app.database import Base, engine
+from ms_invoicer.utils import get_current_date
+
+NUMBER_IDS = [1003, None, 1001, 1003, None, 1002, 1004]
+
+
+@pytest.fixture()
+def customer():
+    """Customer with invoices sharing number_ids, some without one."""
+    Base.metadata.create_all(bind=engine)
+    now = get_current_date()
+    with get_db_context() as db:
+        user = crud.create_user(
+            db, schemas.UserCreate(username="pages", hashpass="x", created=now, updated=now)
+        )
+        customer = crud.create_customer(
+            db, schemas.CustomerCreate(name="customer_pages", user_id=user.id)
+        )
+        for number_id in NUMBER_IDS:
+            invoice = crud.create_invoice(
+                db,
+                schemas.InvoiceCreate(
+                    number_id=0, reason="r", tax_1=5, tax_2=10, with_taxes=True,
+                    with_tables=False, created=now, updated=now,
+                    customer_id=customer["id"], user_id=user.id,
+                ),
+            )
+            invoice.number_id = number_id
+        ids = (user.id, customer["id"])
+
+    yield ids
+
+    with get_db_context() as db:
+        crud.delete_invoices_by_customer(db, model_id=ids[1], current_user_id=ids[0])
+        crud.delete_customer(db, model_id=ids[1], current_user_id=ids[0])
+        crud.delete_user(db, model_id=ids[0])
+
+
+def list_invoices(user_id: int, customer_id: int, limit: int) -> List[List[int]]:
+    """Ids of the invoices of every page, following the cursors like a client."""
+    pages = []
+    cursor: Optional[str] = None
+    with get_db_context() as db:
+        while True:
+            invoices, cursor = page(
+                crud.get_invoices_by_customer(
+                    db=db,
+                    model_id=customer_id,
+                    current_user_id=user_id,
+                    after=decode_cursor(cursor, 2),
+                    limit=limit + 1,
+                ),
+                limit,
+                key=crud.invoice_page_key,
+            )
+            pages.append([crud.invoice_page_key(invoice) for invoice in invoices])
+            if cursor is None:
+                return pages
+
+
+@pytest.mark.parametrize("limit", [1, 2, 3, len(NUMBER_IDS)])
+def test_pages_cover_every_invoice_once(customer, limit: int):
+    """Pages hold every invoice once, newest number first and NULL numbers last."""
+    pages = list_invoices(*customer, limit=limit)
+    keys = [key for keys in pages for key in keys]
+
+    assert all(len(keys) == limit for keys in pages[:-1])
+    assert 0 < len(pages[-1]) <= limit
+    assert len(keys) == len(NUMBER_IDS)
+    assert len(set(keys)) == len(keys)
+    assert keys == sorted(keys, reverse=True)
+    assert [number_id for number_id, _ in keys[-2:]] == [crud.NULL_NUMBER_ID] * 2
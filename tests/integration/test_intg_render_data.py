@@ -0,0 +1,109 @@
+from typing import List
+
+import pytest
+from sqlalchemy import event
+
+from ms_invoicer.dao import PdfToProcessEvent
+from ms_invoicer.db_pool import get_db_context
+from ms_invoicer.invoice_helper import load_invoice_render_data
+from ms_invoicer.sql_app import crud, models, schemas
+from ms_invoicer.sql_app.database import Base, engine
+from ms_invoicer.utils import get_current_date
+
+
+@pytest.fixture()
+def pdf_event():
+    """Event of an invoice with two services, top info and globals."""
+    Base.metadata.create_all(bind=engine)
+    now = get_current_date()
+    with get_db_context() as db:
+        user = crud.create_user(
+            db, schemas.UserCreate(username="render", hashpass="x", created=now, updated=now)
+        )
+        customer = crud.create_customer(
+            db, schemas.CustomerCreate(name="customer_render", user_id=user.id)
+        )
+        bill_to = crud.create_billto(
+            db,
+            schemas.BillToCreate(to="to", addr="addr", phone="phone", email="email", user_id=user.id),
+        )
+        invoice = crud.create_invoice(
+            db,
+            schemas.InvoiceCreate(
+                number_id=1001, reason="r", tax_1=5, tax_2=10, with_taxes=True,
+                with_tables=False, created=now, updated=now,
+                customer_id=customer["id"], user_id=user.id,
+            ),
+        )
+        file = crud.create_file(
+            db,
+            schemas.FileCreate(
+                s3_xlsx_url=None, s3_pdf_url=None, pages_xlsx="", created=now,
+                invoice_id=invoice.id, bill_to_id=bill_to.id, user_id=user.id,
+            ),
+        )
+        crud.create_services_bulk(
+            db,
+            [
+                schemas.ServiceCreate(
+                    title=title, amount=100, currency="CAD", hours=2, price_unit=50,
+                    file_id=file.id, invoice_id=invoice.id, user_id=user.id,
+                )
+                for title in ("Service A", "Service B")
+            ],
+        )
+        crud.create_topinfo(
+            db,
+            schemas.TopInfoCreate(
+                ti_from="QUeBEC INC", addr="addr", phone="phone", email="email", user_id=user.id
+            ),
+        )
+        for identifier, name, value in ((1, "TPS 5%", "5"), (2, "TVQ 10%", "10"), (3, "Empresa", "ACME")):
+            crud.create_global(
+                db,
+                schemas.GlobalCreate(
+                    identifier=identifier, name=name, value=value,
+                    created=now, updated=now, user_id=user.id,
+                ),
+            )
+        ids = (user.id, customer["id"], invoice.id, file.id)
+    user_id, customer_id, invoice_id, file_id = ids
+
+    yield PdfToProcessEvent(
+        current_user_id=user_id,
+        invoice_id=invoice_id,
+        file_id=file_id,
+        html_template_name="template01.html",
+        xlsx_url=None,
+        with_file=False,
+    )
+
+    with get_db_context() as db:
+        for model in (models.Service, models.File, models.Invoice, models.Customer,
+                      models.BillTo, models.TopInfo, models.Globals):
+            db.query(model).filter(model.user_id == user_id).delete()
+        crud.delete_user(db, model_id=user_id)
+
+
+def test_load_invoice_render_data_queries(pdf_event: PdfToProcessEvent):
+    """The render context is loaded with two queries."""
+    statements: List[str] = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        """Count."""
+        if statement.lstrip().upper().startswith("SELECT"):
+            statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", count)
+    try:
+        data = load_invoice_render_data(pdf_event)
+    finally:
+        event.remove(engine, "before_cursor_execute", count)
+
+    assert len(statements) == 2
+    assert [service["service_txt"] for service in data.services] == ["Service A", "Service B"]
+    assert data.context["to"] == "to"
+    assert data.context["top_info_from"] == "QUeBEC INC"
+    assert data.context["title_company"] == "ACME"
+    assert data.context["tps_name"] == "TPS 5%"
+    assert data.context["total"] == 230
@@ -0,0 +1,96 @@
+from datetime import datetime, time as day_time, timedelta
+
+import openpyxl
+import pytest
+
+from ms_invoicer.file_helpers import FileToProcess, build_summary_workbook
+from ms_invoicer.summary_writer import TEMPLATE_PATH, TEMPLATE_SHEET
+from ms_invoicer.utils import create_folders
+
+MONTHS = {"April": datetime(2024, 4, 1), "May": datetime(2024, 5, 1)}
+
+
+@pytest.fixture()
+def timesheet(tmp_path):
+    """Timesheet with a 30 day and a 31 day contract sheet, days from row 6 as in the template."""
+    create_folders()
+    workbook = openpyxl.Workbook()
+    workbook.remove(workbook.active)
+    for name, start in MONTHS.items():
+        days = 30 if start.month == 4 else 31
+        sheet = workbook.create_sheet(name)
+        sheet.append(["NOM CONTRAT", None, "Contrat {}".format(name)])
+        sheet.append(["PERIODO", None, name])
+        sheet.append(["ADRESSE", None, "1 rue"])
+        sheet.append([])
+        sheet.append(["Date", "Entree", "Debut pause", "Fin pause", "Sortie", "Heures"])
+        for day in range(days):
+            sheet.append([
+                start + timedelta(days=day),
+                day_time(8, 0),
+                day_time(12, 0),
+                day_time(13, 0),
+                day_time(17, 0),
+                8,
+            ])
+        sheet.append(["Total", None, None, None, None, 8 * days])
+    path = str(tmp_path / "timesheet.xlsx")
+    workbook.save(path)
+    yield path
+
+
+def build(timesheet: str, output: str, pages_xlsx: str = "") -> openpyxl.Workbook:
+    """Build the summary of the timesheet and load it."""
+    build_summary_workbook(
+        [FileToProcess("timesheet.xlsx", timesheet, invoice_id=1, pages_xlsx=pages_xlsx)],
+        output,
+    )
+    return openpyxl.load_workbook(output)
+
+
+def test_summary_has_a_sheet_per_contract(timesheet: str, tmp_path):
+    """Each contract sheet gets a summary sheet with its name, month and days."""
+    summary = build(timesheet, str(tmp_path / "summary.xlsx"))
+    template = openpyxl.load_workbook(TEMPLATE_PATH)[TEMPLATE_SHEET]
+
+    assert summary.sheetnames == ["1", "2"]
+    for title, (name, start) in zip(summary.sheetnames, MONTHS.items()):
+        sheet = summary[title]
+        assert sheet["C1"].value == "Contrat {}".format(name)
+        assert sheet["A6"].value == start
+        assert [sheet.cell(6, column).value for column in range(3, 8)] == [
+            day_time(8, 0), day_time(12, 0), day_time(13, 0), day_time(17, 0), 8
+        ]
+        assert [cell.value for cell in sheet[5][:7]] == [cell.value for cell in template[5][:7]]
+        assert set(map(str, sheet.merged_cells.ranges)) == set(
+            map(str, template.merged_cells.ranges)
+        )
+        assert {
+            key: dimension.width for key, dimension in sheet.column_dimensions.items()
+        } == {
+            key: dimension.width for key, dimension in template.column_dimensions.items()
+        }
+    assert summary["1"]["C2"].value == "Avril"
+    assert summary["2"]["C2"].value == "Mai"
+
+
+def test_summary_totals_of_a_30_day_month(timesheet: str, tmp_path):
+    """The 31st row is dropped from 30 day months and the totals end at row 35."""
+    summary = build(timesheet, str(tmp_path / "summary.xlsx"))
+    template = openpyxl.load_workbook(TEMPLATE_PATH)[TEMPLATE_SHEET]
+
+    assert summary["1"]["A35"].value == datetime(2024, 4, 30)
+    assert summary["1"]["G36"].value == "=SUM(G6:G35)"
+    assert summary["1"]["G38"].value == "=SUM(G22:G35)"
+    assert summary["2"]["A36"].value == datetime(2024, 5, 31)
+    assert summary["2"]["G37"].value == template["G37"].value
+    assert summary["2"]["G38"].value == template["G38"].value
+
+
+def test_summary_of_selected_pages(timesheet: str, tmp_path):
+    """Only the sheets listed in pages_xlsx are summarized."""
+    summary = build(timesheet, str(tmp_path / "summary.xlsx"), pages_xlsx="May")
+
+    assert summary.sheetnames == ["1"]
+    assert summary["1"]["C1"].value == "Contrat May"
+    assert summary["1"]["C2"].value == "Mai"
@@ -0,0 +1,43 @@
+import io
+
+import pytest
+from fastapi import HTTPException, status
+
+from ms_invoicer import storage as storage_module
+from ms_invoicer.storage import LocalStorage, S3Storage
+from ms_invoicer.utils import UploadReader
+
+
+class ReadingS3Client:
+    """S3 client reading what is uploaded, like upload_fileobj does."""
+
+    def upload_fileobj(self, file, bucket, key, ExtraArgs=None, Config=None):
+        """Upload fileobj."""
+        while file.read(1024):
+            pass
+
+
+@pytest.fixture(params=["s3", "local"])
+def storage(request, tmp_path, monkeypatch):
+    """Storage backend under test."""
+    if request.param == "s3":
+        monkeypatch.setattr(storage_module, "get_s3_client", ReadingS3Client)
+        return S3Storage("bucket")
+    return LocalStorage(str(tmp_path), "/storage")
+
+
+def test_upload_over_the_limit_is_a_413(storage):
+    """The 413 of a too big upload reaches the caller of put."""
+    reader = UploadReader(io.BytesIO(b"x" * 4096), max_bytes=1024)
+
+    with pytest.raises(HTTPException) as error:
+        storage.put("too_big.xlsx", reader)
+    assert error.value.status_code == status.HTTP_413_CONTENT_TOO_LARGE
+
+
+def test_upload_under_the_limit_is_stored(storage):
+    """An upload within the limit is stored whole."""
+    reader = UploadReader(io.BytesIO(b"x" * 1024), max_bytes=1024)
+
+    assert storage.put("small.xlsx", reader) == storage.url("small.xlsx")
+    assert reader.size == 1024